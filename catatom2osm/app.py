@@ -1,7 +1,5 @@
 """Main application processes."""
-import codecs
 import glob
-import gzip
 import io
 import logging
 import os
@@ -14,10 +12,27 @@ from past.builtins import basestring  # NOQA: F401 - qgis/utils.py:744: Warning
 # isort: on
 import qgis.utils
 from osgeo import gdal
-from qgis.core import QgsApplication, QgsGeometry, QgsVectorLayer
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsVectorLayer,
+)
 
 from catatom2osm import cdau  # NOQA: F401 - Used in get_auxiliary_addresses
-from catatom2osm import boundary, catatom, cbcn, config, csvtools, geo, osmxml, overpass
+from catatom2osm import (
+    boundary,
+    catatom,
+    cbcn,
+    compress,
+    config,
+    csvtools,
+    geo,
+    hgwnames,
+    osmxml,
+    overpass,
+)
 from catatom2osm.exceptions import CatIOError, CatValueError
 from catatom2osm.report import instance as report
 
@@ -30,6 +45,20 @@ if config.silence_gdal:
 
 tasks_folder = "tasks"
 
+current_osm_ql = {  # Overpass statements for the current OSM data sets
+    "current_highway.osm": [
+        'way["highway"]["name"]',
+        'relation["highway"]["name"]',
+        'way["place"="square"]["name"]',
+        'relation["place"="square"]["name"]',
+    ],
+    "current_address.osm": [
+        'node["addr:street"]["addr:housenumber"]["entrance"]',
+        'wr["addr:street"]["addr:housenumber"][~"building"~".*"]',
+        'nwr["addr:place"]["addr:housenumber"]',
+    ],
+}
+
 
 class QgsSingleton(QgsApplication):
     """Keep a unique instance of QGIS for the application (and tests)."""
@@ -64,6 +93,10 @@ class CatAtom2Osm(object):
         self.options = options
         self.cat = catatom.Reader(a_path)
         self.path = self.cat.path
+        cache_path = os.path.join(
+            os.path.dirname(self.path), config.overpass_cache_path
+        )
+        self.overpass_cache = overpass.Cache(cache_path)
         report.clear(options=self.options.args, mun_code=self.cat.zip_code)
         report.qgs_version = qgis_utils.QGIS_VERSION
         report.gdal_version = gdal.__version__
@@ -126,9 +159,7 @@ class CatAtom2Osm(object):
                 return
         if self.options.address:
             self.process_address()
-            self.address.reproject()
         if not self.options.zoning:
-            self.building.reproject()
             self.process_tasks(getattr(self, self.source))
         self.output_zoning()
         self.finish()
@@ -180,7 +211,9 @@ class CatAtom2Osm(object):
                 msg = "Can't open %s" % self.options.split
                 fn = self.options.split
                 if os.path.basename(fn) == fn and "." not in fn:
-                    fn = boundary.get_boundary(self.path, self.boundary_search_area, fn)
+                    fn = boundary.get_boundary(
+                        self.path, self.boundary_search_area, fn, self.overpass_cache
+                    )
                     split = geo.BaseLayer(fn, "zoningsplit", "ogr")
                     if not split.isValid():
                         raise CatIOError(msg)
@@ -200,10 +233,12 @@ class CatAtom2Osm(object):
         self.parcel = geo.ParcelLayer(self.cat.zip_code)
         self.parcel.source_date = parcel_gml.source_date
         q = None
+        request = None
         if self.split:
             if self.split.crs() != parcel_gml.crs():
                 self.split.reproject(parcel_gml.crs())
             q = lambda f, __: self.split.is_inside_area(f)
+            request = QgsFeatureRequest().setFilterRect(self.split.extent())
         elif self.options.parcel:
             localid = self.options.parcel[0]
             try:
@@ -212,14 +247,30 @@ class CatAtom2Osm(object):
                 msg = _("Parcel '%s' does not exists") % localid
                 raise CatValueError(msg)
             bb = pa.geometry().boundingBox().buffered(config.parcel_buffer)
-            g = QgsGeometry.fromRect(bb)
+            g = geo.aux.PreparedGeometry(QgsGeometry.fromRect(bb))
             q = lambda f, __: geo.aux.is_inside(f, g)
+            request = QgsFeatureRequest().setFilterRect(bb)
         self.parcel_query = q
-        self.parcel.append(parcel_gml, query=q)
+        self.parcel.append(parcel_gml, query=q, request=request)
         del parcel_gml
         if self.parcel.featureCount() == 0:
             raise CatValueError(_("No parcels data"))
 
+    def get_tasks_request(self):
+        """
+        Return a request to filter the features of the tasks in the provider.
+
+        Restricts the features to the extent of the parcels and, if there are
+        few tasks, to the localIds containing its references. The exact
+        filter is still done by the query function of append.
+        """
+        rect = self.parcel.extent().buffered(config.parcel_buffer)
+        request = QgsFeatureRequest().setFilterRect(rect)
+        if 0 < len(self.tasks) <= config.max_filter_keys:
+            exp = " OR ".join(f"\"localId\" LIKE '%{ref}%'" for ref in self.tasks)
+            request.setFilterExpression(exp)
+        return request
+
     def get_building(self):
         """Merge building, parts and pools."""
         building_gml = self.cat.read("building")
@@ -231,21 +282,27 @@ class CatAtom2Osm(object):
         self.building = geo.ConsLayer()
         self.building.source_date = building_gml.source_date
         q = None
+        request = None
         if self.split or self.options.parcel:
             q = lambda f, kw: self.building.get_id(f) in kw["keys"]
-        self.building.append(building_gml, query=q, keys=self.tasks.keys())
+            request = self.get_tasks_request()
+        self.building.append(
+            building_gml, query=q, request=request, keys=self.tasks.keys()
+        )
         del building_gml
         inbu = self.building.featureCount()
         if inbu == 0:
             raise CatValueError(_("No buildings data"))
         if other_gml:
-            self.building.append(other_gml, query=q, keys=self.tasks.keys())
+            self.building.append(
+                other_gml, query=q, request=request, keys=self.tasks.keys()
+            )
             del other_gml
         if self.options.address and not self.options.building:
             return
         inpo = self.building.featureCount() - inbu
         part_gml = self.cat.read("buildingpart")
-        self.building.append(part_gml, query=q, keys=self.tasks.keys())
+        self.building.append(part_gml, query=q, request=request, keys=self.tasks.keys())
         del part_gml
         if self.options.building:
             report.building_date = self.building.source_date
@@ -274,8 +331,12 @@ class CatAtom2Osm(object):
             else:
                 tasks_u += 1
             comment = self.get_task_comment(label)
-            task_osm = task.to_osm(upload="yes", tags={"comment": comment})
-            if self.options.address and self.options.building:
+            # The full data model is only needed to merge addresses
+            merge = self.options.address and self.options.building
+            task_osm = task.to_osm(
+                upload="yes", tags={"comment": comment}, compact=not merge
+            )
+            if merge:
                 self.merge_address(task_osm, self.address_osm)
             if self.options.address:
                 report.address_stats(task_osm)
@@ -313,17 +374,22 @@ class CatAtom2Osm(object):
         last_task = None
         to_add = []
         fcount = source.featureCount()
+        crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
+        view = source.get_view(crs)
         for i, feat in enumerate(source.getFeatures()):
             localid = source.get_id(feat)
             label = self.tasks.get(localid, localid)
             if i == 0:
                 last_task = label
+            if feat.id() in view:
+                feat.setGeometry(view[feat.id()])
             f = source.copy_feature(feat, {}, {})
             if i == fcount - 1 or label == last_task:
                 to_add.append(f)
             if i == fcount - 1 or label != last_task:
                 if last_task not in tasks:
                     tasks[last_task] = layer_class(baseName=last_task)
+                    tasks[last_task].setCrs(crs)
                     tasks[last_task].source_date = source.source_date
                 tasks[last_task].writer.addFeatures(to_add)
                 to_add = [f]
@@ -372,9 +438,7 @@ class CatAtom2Osm(object):
 
     def process_building(self):
         """Process all buildings dataset."""
-        self.building.remove_outside_parts()
-        self.building.remove_parts_wo_building()
-        self.building.explode_multi_parts()
+        self.building.preprocess()
         self.building.clean()
         if log.app_level <= logging.DEBUG:
             fn = "building.geojson"
@@ -384,8 +448,7 @@ class CatAtom2Osm(object):
 
     def process_parcel(self):
         """Process parcels dataset."""
-        self.parcel.set_zones(self.urban_zoning)
-        self.parcel.set_zones(self.rustic_zoning)
+        self.parcel.set_zones(self.urban_zoning, self.rustic_zoning)
         self.parcel.set_missing_zones()
         tasks1 = self.parcel.merge_by_adjacent_buildings(self.building)
         for k, v in self.tasks.items():
@@ -459,10 +522,14 @@ class CatAtom2Osm(object):
                 raise CatIOError(msg)
         self.address = geo.AddressLayer(source_date=address_gml.source_date)
         q = None
+        request = None
         if self.split or self.options.parcel:
             q = lambda f, kw: self.address.get_id(f) in kw["keys"]  # NOQA: E731
+            request = self.get_tasks_request()
             self.boundary_bbox = self.parcel.bounding_box()
-        self.address.append(address_gml, query=q, keys=self.tasks.keys())
+        self.address.append(
+            address_gml, query=q, request=request, keys=self.tasks.keys()
+        )
         del address_gml
         report.inp_address = self.address.featureCount()
         report.inp_address_entrance = self.address.count("spec='Entrance'")
@@ -496,14 +563,12 @@ class CatAtom2Osm(object):
             current_address = self.get_current_ad_osm()
             self.address.conflate(current_address)
         self.building.move_address(self.address)
-        self.address.reproject()
         self.address_osm = self.address.to_osm()
 
     def stop_address(self):
         """Save current processing status and exits."""
         self.export_layer(self.parcel, "parcel.shp", driver_name="ESRI Shapefile")
         self.export_layer(self.building, "building.shp", driver_name="ESRI Shapefile")
-        self.address.reproject()
         address_osm = self.address.to_osm()
         self.write_osm(address_osm, "address.osm")
         fn = self.cat.get_path("tasks.csv")
@@ -588,13 +653,12 @@ class CatAtom2Osm(object):
             for ad in address_index[ref]:
                 entrance = False
                 if "entrance" in ad.tags:
-                    for w in building_osm.get_outline(group):
-                        entrance = w.search_node(ad.x, ad.y)
-                        if entrance:
-                            entrance.tags.update(ad.tags)
-                            entrance.tags.pop("ref", None)
-                            entrance.tags.pop("image", None)
-                            break
+                    outline = set(building_osm.get_outline(group))
+                    entrance = building_osm.find_node(ad.x, ad.y, outline)
+                    if entrance:
+                        entrance.tags.update(ad.tags)
+                        entrance.tags.pop("ref", None)
+                        entrance.tags.pop("image", None)
                 if entrance:
                     entrance_count += 1
                 else:
@@ -631,6 +695,7 @@ class CatAtom2Osm(object):
             csvtools.dict2csv(highway_types_path, config.highway_types)
         else:
             csvtools.csv2dict(highway_types_path, config.highway_types)
+            hgwnames.update_tables()
         if self.is_new:
             if self.options.manual:
                 highway = None
@@ -647,12 +712,7 @@ class CatAtom2Osm(object):
 
     def get_highway(self):
         """Get OSM highways for street names conflation."""
-        ql = [
-            'way["highway"]["name"]',
-            'relation["highway"]["name"]',
-            'way["place"="square"]["name"]',
-            'relation["place"="square"]["name"]',
-        ]
+        ql = current_osm_ql["current_highway.osm"]
         highway_osm = self.read_osm("current_highway.osm", ql=ql)
         highway = geo.HighwayLayer()
         highway.read_from_osm(highway_osm)
@@ -661,11 +721,7 @@ class CatAtom2Osm(object):
 
     def get_current_ad_osm(self):
         """Get OSM address for conflation."""
-        ql = [
-            'node["addr:street"]["addr:housenumber"]["entrance"]',
-            'wr["addr:street"]["addr:housenumber"][~"building"~".*"]',
-            'nwr["addr:place"]["addr:housenumber"]',
-        ]
+        ql = current_osm_ql["current_address.osm"]
         address_osm = self.read_osm("current_address.osm", ql=ql)
         current_address = set()
         w = 0
@@ -741,6 +797,8 @@ class CatAtom2Osm(object):
         Read an OSM data set from an OSM XML file.
 
         If the file not exists, downloads data from overpass using ql query.
+        The current OSM data sets are downloaded all together if
+        config.overpass_combined is set (see download_current_osm).
 
         Args:
             paths (str): input filename components relative to self.path
@@ -755,19 +813,18 @@ class CatAtom2Osm(object):
         if not os.path.exists(osm_path):
             if not ql:
                 return None
-            log.info(_("Downloading '%s'") % filename)
-            query = overpass.Query(self.boundary_search_area)
-            if hasattr(self, "boundary_bbox") and self.boundary_bbox:
-                query.set_search_area(self.boundary_bbox)
-            query.add(ql)
-            if log.app_level == logging.DEBUG:
-                query.download(osm_path, log)
+            if config.overpass_combined and filename in current_osm_ql:
+                self.download_current_osm()
             else:
-                query.download(osm_path)
-        if osm_path.endswith(".gz"):
-            fo = gzip.open(osm_path, "rb")
-        else:
-            fo = open(osm_path, "rb")
+                log.info(_("Downloading '%s'") % filename)
+                query = overpass.Query(
+                    self.boundary_search_area, cache=self.overpass_cache
+                )
+                if hasattr(self, "boundary_bbox") and self.boundary_bbox:
+                    query.set_search_area(self.boundary_bbox)
+                query.add(ql)
+                self.download_osm(query, osm_path)
+        fo = compress.open_reader(osm_path)
         data = osmxml.deserialize(fo)
         fo.close()
         if len(data.elements) == 0:
@@ -784,6 +841,55 @@ class CatAtom2Osm(object):
             )
         return data
 
+    def download_current_osm(self):
+        """
+        Download all the missing current OSM data sets in a single query.
+
+        The response is split locally in a file for each data set of
+        current_osm_ql.
+        """
+        queries = {
+            fn: ql
+            for fn, ql in current_osm_ql.items()
+            if not os.path.exists(self.cat.get_path(fn))
+        }
+        log.info(_("Downloading '%s'") % ", ".join(queries.keys()))
+        query = overpass.Query(self.boundary_search_area, cache=self.overpass_cache)
+        if hasattr(self, "boundary_bbox") and self.boundary_bbox:
+            query.set_search_area(self.boundary_bbox)
+        for ql in queries.values():
+            query.add(ql)
+        osm_path = self.cat.get_path("current_osm.osm")
+        self.download_osm(query, osm_path)
+        with open(osm_path, "rb") as fo:
+            data = osmxml.deserialize(fo)
+        os.remove(osm_path)
+        for fn, subset in overpass.partition(data, queries).items():
+            with io.open(self.cat.get_path(fn), "w", encoding="utf-8") as fo:
+                osmxml.serialize(fo, subset)
+
+    def download_osm(self, query, osm_path):
+        """
+        Download the results of an Overpass query to a file.
+
+        If config.overpass_tile_size is set and the search area is a bounding
+        box bigger than a tile, the query is splitted in tiles that are fetched
+        concurrently (see overpass.Query.read_tiles).
+
+        Args:
+            query (overpass.Query): Query to download
+            osm_path (str): Output filename
+        """
+        size = config.overpass_tile_size
+        if size and query.bbox and len(overpass.get_tiles(query.bbox, size)) > 1:
+            data = query.read_tiles(size)
+            with io.open(osm_path, "w", encoding="utf-8") as fo:
+                osmxml.serialize(fo, data)
+        elif log.app_level == logging.DEBUG:
+            query.download(osm_path, log)
+        else:
+            query.download(osm_path)
+
     def write_osm(self, data, *paths):
         """
         Generate an OSM XML file for an OSM data set.
@@ -791,17 +897,14 @@ class CatAtom2Osm(object):
         Args:
             data (Osm): OSM data set
             paths (str): output filename components relative to self.path
-                            (compress if ends with .gz)
+                            (compress if ends with .gz, .xz or .zst)
         """
         for e in data.elements:
             if "ref" in e.tags:
                 del e.tags["ref"]
         data.merge_duplicated()
         osm_path = self.cat.get_path(*paths)
-        if osm_path.endswith(".gz"):
-            file_obj = codecs.getwriter("utf-8")(gzip.open(osm_path, "w"))
-        else:
-            file_obj = io.open(osm_path, "w", encoding="utf-8")
+        file_obj = compress.open_writer(osm_path)
         osmxml.serialize(file_obj, data)
         file_obj.close()
         msg = _("Generated '%s': %d nodes, %d ways, %d relations")
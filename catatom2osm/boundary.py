@@ -89,8 +89,8 @@ def get_municipality(code):
     return (id, name)
 
 
-def get_boundary(cat_path, boundary_search_area, id_or_name):
-    query = overpass.Query(boundary_search_area)
+def get_boundary(cat_path, boundary_search_area, id_or_name, cache=None):
+    query = overpass.Query(boundary_search_area, cache=cache)
     if re.search(r"^[0-9]+$", id_or_name):
         query.add(f"wr({id_or_name})")
     else:
@@ -9,7 +9,7 @@ from qgis.core import QgsFeature
 from catatom2osm import config, download
 from catatom2osm.exceptions import CatIOError
 from catatom2osm.geo import AddressLayer, BaseLayer, Point
-from catatom2osm.geo.aux import is_inside
+from catatom2osm.geo.aux import get_prepared, is_inside
 
 log = logging.getLogger(config.app_name)
 
@@ -66,6 +66,7 @@ def get_address(cbcn, parcel):
     address.startEditing()
     index = parcel.get_index()
     pa_feat = {f.id(): f for f in parcel.getFeatures()}
+    prepared = {}
     for ad in cbcn.getFeatures():
         if ad["NOM_VIA"] == None:  # NOQA
             continue
@@ -77,7 +78,7 @@ def get_address(cbcn, parcel):
         sep = cbcn_thr
         for fid in fids:
             dist = pa_feat[fid].geometry().closestSegmentWithContext(pt)[0]
-            if is_inside(ad, pa_feat[fid]):
+            if is_inside(ad, get_prepared(pa_feat[fid], prepared)):
                 parcel = pa_feat[fid]
                 break
             elif dist < sep:
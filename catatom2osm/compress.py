@@ -0,0 +1,125 @@
+"""Writers and readers of compressed OSM files."""
+import gzip
+import io
+import lzma
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from catatom2osm import config
+from catatom2osm.exceptions import CatIOError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = (".gz", ".xz", ".zst")
+
+
+class BlockGzipFile(io.RawIOBase):
+    """
+    Write a gzip file compressing blocks of data in parallel threads.
+
+    Each block is written as an independent gzip member. Members are
+    concatenated in order, which is a valid gzip file for any reader. zlib
+    releases the GIL while compressing, so the threads run in parallel.
+    """
+
+    def __init__(self, filename, level=9, workers=2, block_size=4 * 1024 * 1024):
+        self.fileobj = open(filename, "wb")
+        self.level = level
+        self.workers = workers
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        """Queue a block to compress, writing the finished ones in order."""
+        self.pending.append(
+            self.executor.submit(gzip.compress, block, self.level, mtime=0)
+        )
+        while len(self.pending) > 2 * self.workers:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.pending:
+                self.submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            self.fileobj.close()
+            super().close()
+
+
+def get_format(filename):
+    """Return the compression format extension of filename or ''."""
+    for ext in FORMATS:
+        if filename.endswith(ext):
+            return ext
+    return ""
+
+
+def check_format(ext):
+    if ext == ".zst" and zstandard is None:
+        raise CatIOError(_("Install the zstandard package to use '%s' files") % ext)
+
+
+def open_writer(filename, level=None, workers=None):
+    """
+    Open a text file for writing, compressed by its extension.
+
+    Args:
+        filename (str): Output file name, compressed if ends with .gz, .xz
+            or .zst
+        level (int): Compression level, config.compress_level by default
+        workers (int): Threads to compress .gz files in blocks,
+            config.compress_workers by default
+
+    Returns:
+        (TextIOWrapper) UTF-8 text file buffered by config.write_buffer_size
+    """
+    level = config.compress_level if level is None else level
+    workers = config.compress_workers if workers is None else workers
+    ext = get_format(filename)
+    check_format(ext)
+    if ext == ".gz" and workers > 1:
+        raw = BlockGzipFile(filename, level, workers, config.compress_block_size)
+    elif ext == ".gz":
+        raw = gzip.open(filename, "wb", compresslevel=level)
+    elif ext == ".xz":
+        raw = lzma.open(filename, "wb", preset=level)
+    elif ext == ".zst":
+        raw = zstandard.open(filename, "wb", cctx=zstandard.ZstdCompressor(level))
+    else:
+        raw = open(filename, "wb", buffering=0)
+    buffered = io.BufferedWriter(raw, buffer_size=config.write_buffer_size)
+    return io.TextIOWrapper(buffered, encoding="utf-8", newline="")
+
+
+def open_reader(filename):
+    """Open a binary file for reading, decompressed by its extension."""
+    ext = get_format(filename)
+    check_format(ext)
+    if ext == ".gz":
+        return gzip.open(filename, "rb")
+    elif ext == ".xz":
+        return lzma.open(filename, "rb")
+    elif ext == ".zst":
+        return zstandard.open(filename, "rb")
+    return open(filename, "rb")
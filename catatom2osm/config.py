@@ -73,6 +73,7 @@ dist_thr = 0.02  # Threshold in meters for vertex simplification and topological
 straight_thr = 2  # Threshold in degrees from straight angle to delete a vertex
 acute_thr = 10  # Remove vertices with an angle smaller than this value
 min_area = 0.05  # Delete geometries with an area smaller than this value
+clean_workers = 1  # Worker processes to clean geometries in shards, 1 disables
 addr_thr = 10  # Distance in meters to merge address node with building outline
 acute_inv = 5  # Remove geometries/rings that result invalid after removing
 # any vertex with an angle smaller than this value
@@ -82,6 +83,7 @@ warning_min_area = 1  # Area in m2 for small area warning
 warning_max_area = 30000  # Area in m2 for big area warning
 bbox_buffer = 0.002  # Buffer in degrees around overpass bounding boxes
 parcel_buffer = 200  # Buffer in meters around parcel to search adjacents
+max_filter_keys = 50  # Maximum parcel references to filter in the data provider
 parcel_parts = 20  # Number of building parts to agregate parcels
 parcel_dist = 1000  # Distance in meters to agregate parcels
 
@@ -604,6 +606,17 @@ excluded_types = ["DS", "ER"]
 aux_address = {"cdau": ["04", "11", "14", "18", "21", "23", "29", "41", "53"]}
 aux_path = "auxsrcs"
 
+overpass_cache_path = "overpass"  # Folder for cached Overpass responses
+overpass_cache_ttl = 86400  # Seconds to reuse a cached Overpass response, 0 disables
+overpass_combined = True  # Download all the current OSM data sets in a single query
+overpass_tile_size = 0.1  # Tiles size in degrees to split large queries, 0 disables
+overpass_workers = 2  # Maximum number of concurrent Overpass requests
+
+compress_level = 6  # Compression level of the generated files, 1 fastest to 9 smallest
+compress_workers = 1  # Threads to compress large .gz files in blocks, 1 disables
+compress_block_size = 4 * 1024 * 1024  # Bytes per block with compress_workers > 1
+write_buffer_size = 1024 * 1024  # Bytes buffered before writing to OSM files
+
 prov_codes = {
     "02": "Albacete",
     "03": "Alicante",
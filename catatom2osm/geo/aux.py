@@ -1,16 +1,80 @@
+from qgis.core import QgsGeometry
+
+
 def get_geometry(feat):
     return feat.geometry() if hasattr(feat, "geometry") else feat
 
 
+class PreparedGeometry(object):
+    """
+    Geometry with a GEOS engine prepared for repeated spatial predicates.
+
+    Can be used in place of the container argument of is_inside and
+    is_inside_area.
+    """
+
+    def __init__(self, feat):
+        self._geometry = QgsGeometry(get_geometry(feat))
+        self.bbox = self._geometry.boundingBox()
+        self.engine = QgsGeometry.createGeometryEngine(self._geometry.constGet())
+        self.engine.prepareGeometry()
+
+    def geometry(self):
+        return self._geometry
+
+    def boundingBox(self):
+        return self.bbox
+
+    def contains(self, geom):
+        if not self.bbox.contains(geom.boundingBox()):
+            return False
+        return self.engine.contains(geom.constGet())
+
+    def within(self, geom):
+        if not geom.boundingBox().contains(self.bbox):
+            return False
+        return self.engine.within(geom.constGet())
+
+    def intersects(self, geom):
+        if not self.bbox.intersects(geom.boundingBox()):
+            return False
+        return self.engine.intersects(geom.constGet())
+
+    def overlaps(self, geom):
+        if not self.bbox.intersects(geom.boundingBox()):
+            return False
+        return self.engine.overlaps(geom.constGet())
+
+    def intersection(self, geom):
+        return QgsGeometry(self.engine.intersection(geom.constGet()))
+
+
+def get_prepared(feat, cache):
+    """Return the prepared geometry of feat, kept in cache by feature id."""
+    prepared = cache.get(feat.id())
+    if prepared is None:
+        prepared = PreparedGeometry(feat)
+        cache[feat.id()] = prepared
+    return prepared
+
+
+def get_container(f2):
+    return f2 if isinstance(f2, PreparedGeometry) else get_geometry(f2)
+
+
 def is_inside(f1, f2):
     g1 = get_geometry(f1)
-    g2 = get_geometry(f2)
+    g2 = get_container(f2)
+    if not g2.boundingBox().intersects(g1.boundingBox()):
+        return False
     return g2.contains(g1) or g2.overlaps(g1)
 
 
 def is_inside_area(f1, f2):
     g1 = get_geometry(f1)
-    g2 = get_geometry(f2)
+    g2 = get_container(f2)
+    if not g2.boundingBox().intersects(g1.boundingBox()):
+        return False
     if g2.contains(g1):
         return True
     elif g2.overlaps(g1):
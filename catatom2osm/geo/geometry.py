@@ -1,4 +1,5 @@
 import logging
+from collections import defaultdict
 
 from qgis.core import QgsFeature, QgsGeometry, QgsPointXY
 
@@ -93,12 +94,15 @@ class Geometry(object):
         if len(mp) < 2:
             return False
         else:
-            geom = None
-            for p in mp:
-                g = Geometry.fromPolygonXY(p)
-                ng = g if geom is None else geom.combine(g)
-                if ng.isGeosValid():
-                    geom = ng
+            parts = [Geometry.fromPolygonXY(p) for p in mp]
+            geom = Geometry.union(parts)
+            if geom is None or not geom.isGeosValid():
+                # Skip the parts that make the union invalid
+                geom = None
+                for g in parts:
+                    ng = g if geom is None else geom.combine(g)
+                    if ng.isGeosValid():
+                        geom = ng
             if geom is not None:
                 feature.setGeometry(geom)
         return geom.isGeosValid()
@@ -106,16 +110,58 @@ class Geometry(object):
     @staticmethod
     def merge_adjacent_features(group):
         """Combine all geometries in group of features."""
-        geom = False
+        geometries = []
         for p in group:
             g = p.geometry()
             if g.isGeosValid():
-                geom = geom.combine(g) if geom else g
+                geometries.append(g)
             else:
                 msg = _("The geometry of zone '%s' is not valid") % p["label"]
                 log.warning(msg)
                 report.warnings.append(msg)
-        return geom
+        return Geometry.union(geometries) if geometries else False
+
+    @staticmethod
+    def union(geometries):
+        """
+        Return the union of a list of geometries.
+
+        All the geometries are merged in a single cascaded union. If it fails,
+        they are combined in pairs of similar size until one is left.
+        Returns None for an empty list.
+        """
+        if len(geometries) < 2:
+            return QgsGeometry(geometries[0]) if geometries else None
+        geom = QgsGeometry.unaryUnion(geometries)
+        if not geom.isNull():
+            return geom
+        while len(geometries) > 1:
+            pairs = zip(geometries[0::2], geometries[1::2])
+            combined = [g1.combine(g2) for g1, g2 in pairs]
+            if len(geometries) % 2:
+                combined.append(geometries[-1])
+            geometries = combined
+        return geometries[0]
+
+    @staticmethod
+    def get_clusters(points, size):
+        """
+        Group points in the cells of a grid.
+
+        Args:
+            points (list): QgsPointXY
+            size (float): Side of the grid cells.
+
+        Returns:
+            (list) Bounding box of the points in each non empty cell.
+        """
+        clusters = defaultdict(list)
+        for point in points:
+            clusters[(point.x() // size, point.y() // size)].append(point)
+        return [
+            Geometry.fromMultiPointXY(cluster).boundingBox()
+            for cluster in clusters.values()
+        ]
 
     @staticmethod
     def is_valid(geom):
@@ -5,7 +5,6 @@ from qgis.core import QgsField, QgsFields
 from qgis.PyQt.QtCore import QVariant
 
 from catatom2osm import config, hgwnames, translate
-from catatom2osm.geo.aux import get_attributes
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.base import BaseLayer
 from catatom2osm.geo.types import WKBPoint
@@ -59,10 +58,10 @@ class AddressLayer(BaseLayer):
         """Trim to parcel id."""
         return feat["localId"].split("_")[0].split(".")[-1]
 
-    def to_osm(self, data=None, tags={}, upload="never"):
+    def to_osm(self, data=None, tags={}, upload="never", compact=False):
         """Export to OSM."""
         return super(AddressLayer, self).to_osm(
-            translate.address_tags, data, tags=tags, upload=upload
+            translate.address_tags, data, tags=tags, upload=upload, compact=compact
         )
 
     def conflate(self, current_address):
@@ -72,9 +71,10 @@ class AddressLayer(BaseLayer):
         Args:
             current_address (OSM): dataset
         """
+        request = self.get_request(["TN_text", "designator"], geometry=False)
         to_clean = [
             feat.id()
-            for feat in self.getFeatures()
+            for feat in self.getFeatures(request)
             if feat["TN_text"] + feat["designator"] in current_address
         ]
         if to_clean:
@@ -83,9 +83,9 @@ class AddressLayer(BaseLayer):
                 _("Refused %d addresses because they exist in OSM") % len(to_clean)
             )
             report.refused_addresses = len(to_clean)
-        to_clean = [
-            feat.id() for feat in self.search("designator = '%s'" % config.no_number)
-        ]
+        exp = "designator = '%s'" % config.no_number
+        request = self.get_request([], geometry=False, expression=exp)
+        to_clean = [feat.id() for feat in self.getFeatures(request)]
         if to_clean:
             self.writer.deleteFeatures(to_clean)
             log.debug(_("Deleted %d addresses without house number") % len(to_clean))
@@ -108,31 +108,44 @@ class AddressLayer(BaseLayer):
         else:
             highway_names = defaultdict(list)
             index = highway.get_index()
-            features = {feat.id(): feat for feat in highway.getFeatures()}
-            for f in self.getFeatures():
+            request = highway.get_request(["name"], geometry=False)
+            names = {feat.id(): feat["name"] for feat in highway.getFeatures(request)}
+            for f in self.getFeatures(self.get_request(["TN_text"])):
                 if f["TN_text"]:
                     highway_names[f["TN_text"]].append(f.geometry().asPoint())
+            matcher = hgwnames.Matcher(names.values())
+            buffer = config.bbox_buffer * 100000
             for name, points in highway_names.items():
-                bbox = Geometry.fromMultiPointXY(points).boundingBox()
-                bbox.grow(config.bbox_buffer * 100000)
-                choices = [features[fid]["name"] for fid in index.intersects(bbox)]
-                highway_names[name] = hgwnames.match(name, choices)
+                # Search near each group of addresses, not in the whole street
+                fids = []
+                for bbox in Geometry.get_clusters(points, buffer):
+                    bbox.grow(buffer)
+                    fids += index.intersects(bbox)
+                choices = [names[fid] for fid in fids]
+                highway_names[name] = list(dict.fromkeys(choices))
+            highway_names = matcher.match_all(highway_names)
         return highway_names
 
     def get_image_links(self):
         to_change = {}
-        for feat in self.getFeatures():
+        image_ndx = self.fields().indexFromName("image")
+        for feat in self.getFeatures(self.get_request(["localId"], geometry=False)):
             url = config.cadastre_doc_url.format(feat["localId"][-14:])
-            feat["image"] = url
-            to_change[feat.id()] = get_attributes(feat)
+            to_change[feat.id()] = {image_ndx: url}
         self.writer.changeAttributeValues(to_change)
 
     def remove_address_wo_building(self, buildings):
         """Remove address without associated building."""
-        bu_refs = [
-            f["localId"] for f in buildings.getFeatures() if buildings.is_building(f)
+        request = buildings.get_request(["localId"], geometry=False)
+        bu_refs = {
+            f["localId"]
+            for f in buildings.getFeatures(request)
+            if buildings.is_building(f)
+        }
+        request = self.get_request(["localId"], geometry=False)
+        to_clean = [
+            f.id() for f in self.getFeatures(request) if self.get_id(f) not in bu_refs
         ]
-        to_clean = [f.id() for f in self.getFeatures() if self.get_id(f) not in bu_refs]
         if to_clean:
             self.writer.deleteFeatures(to_clean)
             msg = _("Removed %d addresses without building")
@@ -1,7 +1,9 @@
 import logging
 import os
 import re
+from collections import Counter
 
+from osgeo import osr
 from qgis.core import (
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
@@ -18,10 +20,9 @@ from qgis.core import (
 )
 from tqdm import tqdm
 
-from catatom2osm import config, osm, translate
+from catatom2osm import config, osm, osmcompact, translate
 from catatom2osm.exceptions import CatIOError
-from catatom2osm.geo import BUFFER_SIZE
-from catatom2osm.geo.aux import get_attributes
+from catatom2osm.geo import BUFFER_SIZE, wkb
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.point import Point
 from catatom2osm.geo.types import WKBMultiPolygon, WKBPoint, WKBPolygon
@@ -29,13 +30,130 @@ from catatom2osm.report import instance as report
 
 log = logging.getLogger(config.app_name)
 
+crs_transforms = {}  # Registry of transformations by (source, target) CRS key
+osr_transforms = {}
+
+
+def get_crs_key(crs):
+    """Return a hashable identifier for a QgsCoordinateReferenceSystem."""
+    return crs.authid() or crs.toWkt()
+
+
+class LayerWriter(object):
+    """
+    Proxy to the data provider of a layer.
+
+    Keeps a revision number of the layer geometries incremented with each
+    edit that adds, changes or deletes geometries, and a spatial index of the layer
+    updated with the edits made through the writer.
+
+    Attributes:
+        stats (Counter): Profiling counters of the spatial index. 'hits' for
+            requests served from the cache, 'rebuilds' for indexes built
+            from the layer and 'updates' for features updated incrementally.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.revision = 0
+        self.index = None
+        self.index_size = 0
+        self.index_updates = 0
+        self.stats = Counter()
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def touch(self):
+        """Increment the geometries revision."""
+        self.revision += 1
+
+    def get_index(self):
+        """Return the spatial index of the layer, bulk loaded if not cached."""
+        if self.index is not None:
+            self.stats["hits"] += 1
+            return self.index
+        self.stats["rebuilds"] += 1
+        self.index_size = self.provider.featureCount()
+        self.index_updates = 0
+        if self.index_size > 0:
+            request = QgsFeatureRequest().setNoAttributes()
+            self.index = QgsSpatialIndex(self.provider.getFeatures(request))
+        else:  # QGIS exception for void layers).
+            self.index = QgsSpatialIndex()
+        return self.index
+
+    def clear_index(self):
+        """Discard the cached spatial index."""
+        self.index = None
+
+    def _index_remove(self, fids):
+        """Remove fids from the index with its geometries before an edit."""
+        self.index_updates += len(fids)
+        if self.index_updates > self.index_size / 2:
+            self.clear_index()  # Cheaper to rebuild
+            return
+        request = QgsFeatureRequest().setFilterFids(list(fids)).setNoAttributes()
+        for feat in self.provider.getFeatures(request):
+            if feat.hasGeometry():
+                self.index.deleteFeature(feat)
+        self.stats["updates"] += len(fids)
+
+    def _index_add(self, geometries):
+        """Add the new geometries by feature id to the index."""
+        if self.index is None:
+            return
+        for fid, geom in geometries.items():
+            if geom is not None and not geom.isNull():
+                self.index.addFeature(fid, geom.boundingBox())
+
+    def addFeature(self, *args, **kwargs):
+        self.touch()
+        self.clear_index()
+        return self.provider.addFeature(*args, **kwargs)
+
+    def addFeatures(self, *args, **kwargs):
+        self.touch()
+        result = self.provider.addFeatures(*args, **kwargs)
+        if self.index is not None:
+            features = result[1] if result[0] else []
+            self.index_size += len(features)
+            self._index_add({f.id(): f.geometry() for f in features})
+        return result
+
+    def deleteFeatures(self, fids):
+        self.touch()
+        if self.index is not None and fids:
+            self._index_remove(fids)
+            self.index_size -= len(fids)
+        return self.provider.deleteFeatures(fids)
+
+    def changeFeatures(self, attr_map, geometry_map):
+        self.touch()
+        if self.index is not None and geometry_map:
+            self._index_remove(geometry_map.keys())
+        result = self.provider.changeFeatures(attr_map, geometry_map)
+        self._index_add(geometry_map)
+        return result
+
+    def changeGeometryValues(self, geometry_map):
+        self.touch()
+        if self.index is not None and geometry_map:
+            self._index_remove(geometry_map.keys())
+        result = self.provider.changeGeometryValues(geometry_map)
+        self._index_add(geometry_map)
+        return result
+
 
 class BaseLayer(QgsVectorLayer):
     """Base class for application layers."""
 
     def __init__(self, path, baseName, providerLib="ogr"):
         super(BaseLayer, self).__init__(path, baseName, providerLib)
-        self.writer = self.dataProvider()
+        self.writer = LayerWriter(self.dataProvider())
+        self.editingStopped.connect(self.writer.touch)
+        self.editingStopped.connect(self.writer.clear_index)
+        self.crs_views = {}
         self.rename = {}
         self.resolve = {}
         self.reference_matchs = {}
@@ -67,8 +185,67 @@ class BaseLayer(QgsVectorLayer):
 
     @staticmethod
     def get_crs_transform(source_crs, target_crs):
-        prj = QgsProject.instance()
-        return QgsCoordinateTransform(source_crs, target_crs, prj)
+        """Return a cached transformation between two CRS."""
+        key = (get_crs_key(source_crs), get_crs_key(target_crs))
+        if key not in crs_transforms:
+            prj = QgsProject.instance()
+            crs_transforms[key] = QgsCoordinateTransform(source_crs, target_crs, prj)
+        return crs_transforms[key]
+
+    @staticmethod
+    def get_osr_transform(source_crs, target_crs):
+        """Return a GDAL transformation between two CRS or None if not possible."""
+        key = (get_crs_key(source_crs), get_crs_key(target_crs))
+        if key not in osr_transforms:
+            osr_transforms[key] = BaseLayer.create_osr_transform(source_crs, target_crs)
+        return osr_transforms[key]
+
+    @staticmethod
+    def create_osr_transform(source_crs, target_crs):
+        srs = []
+        for crs in (source_crs, target_crs):
+            sr = osr.SpatialReference()
+            authid = crs.authid()
+            if authid.startswith("EPSG:"):
+                err = sr.ImportFromEPSG(int(authid[5:]))
+            else:
+                err = sr.ImportFromWkt(crs.toWkt())
+            if err != 0:
+                return None
+            if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+                sr.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            srs.append(sr)
+        try:
+            return osr.CoordinateTransformation(*srs)
+        except (RuntimeError, TypeError):
+            return None
+
+    @staticmethod
+    def transform_geometries(geometries, osr_transform):
+        """
+        Transform a list of geometries with a single call to GDAL.
+
+        The vertices of all geometries are extracted from its WKB, transformed
+        together and written back.
+
+        Args:
+            geometries (list): QgsGeometry instances
+            osr_transform (osr.CoordinateTransformation): transformation
+
+        Returns:
+            (list) Transformed QgsGeometry instances
+        """
+        wkbs = [bytes(geom.asWkb()) for geom in geometries]
+        xs, ys, layout = wkb.get_coords(wkbs)
+        points = osr_transform.TransformPoints(list(zip(xs, ys)))
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        result = []
+        for data in wkb.set_coords(wkbs, layout, xs, ys):
+            geom = QgsGeometry()
+            geom.fromWkb(data)
+            result.append(geom)
+        return result
 
     def writeAsVectorFormat(self, name, driver_name, target_crs=None):
         transform_context = QgsProject.instance().transformContext()
@@ -77,10 +254,8 @@ class BaseLayer(QgsVectorLayer):
         save_options.fileEncoding = "UTF-8"
         save_options.onlySelectedFeatures = self.selectedFeatureCount() != 0
         if target_crs is not None or target_crs != self.crs():
-            save_options.ct = QgsCoordinateTransform(
-                self.crs(),
-                QgsCoordinateReferenceSystem(target_crs),
-                transform_context,
+            save_options.ct = self.get_crs_transform(
+                self.crs(), QgsCoordinateReferenceSystem(target_crs)
             )
         return QgsVectorFileWriter.writeAsVectorFormatV2(
             self, name, transform_context, save_options
@@ -155,7 +330,9 @@ class BaseLayer(QgsVectorLayer):
                     dst_ft[dst_attr] = feature[src_attr]
         return dst_ft
 
-    def append(self, layer, rename=None, resolve=None, query=None, **kwargs):
+    def append(
+        self, layer, rename=None, resolve=None, query=None, request=None, **kwargs
+    ):
         """
         Copy all features from layer.
 
@@ -165,6 +342,8 @@ class BaseLayer(QgsVectorLayer):
             resolve (dict): xlink reference fields
             query (func): function with args feature and kwargs that returns
                 a boolean deciding if each feature will be included or not
+            request (QgsFeatureRequest): filter applied by the data provider
+                of layer before the query function
             kwargs: aditional arguments for query function
 
         Examples:
@@ -172,6 +351,9 @@ class BaseLayer(QgsVectorLayer):
             Will copy only features with a value 'bar' in the field 'foo'.
             >>> query = lambda feat, kwargs: layer.is_inside(feat, kwargs['zone'])
             Will copy only features inside zone.
+            >>> request = QgsFeatureRequest().setFilterRect(zone.boundingBox())
+            With the query above, skips the features outside the zone
+            bounding box without evaluating query.
 
             See also copy_feature().
         """
@@ -179,7 +361,8 @@ class BaseLayer(QgsVectorLayer):
         total = 0
         to_add = []
         pbar = self.get_progressbar(_("Append"), layer.featureCount())
-        for feature in layer.getFeatures():
+        features = layer.getFeatures(request) if request else layer.getFeatures()
+        for feature in features:
             Geometry.merge_adjacent_polygons(feature)
             geom = feature.geometry()
             if not query or query(feature, kwargs):
@@ -208,18 +391,22 @@ class BaseLayer(QgsVectorLayer):
         if target_crs is None:
             target_crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
         crs_transform = self.get_crs_transform(self.crs(), target_crs)
+        osr_transform = self.get_osr_transform(self.crs(), target_crs)
         to_change = {}
         pbar = self.get_progressbar(_("Reproject"), self.featureCount())
-        for feature in self.getFeatures():
-            geom = QgsGeometry(feature.geometry())
-            geom.transform(crs_transform)
-            to_change[feature.id()] = geom
+        request = QgsFeatureRequest().setNoAttributes()
+        for feature in self.getFeatures(request):
+            geom = feature.geometry()
+            if not geom.isNull():
+                to_change[feature.id()] = geom
             if len(to_change) > BUFFER_SIZE:
+                to_change = self.transform(to_change, crs_transform, osr_transform)
                 self.writer.changeGeometryValues(to_change)
                 to_change = {}
             pbar.update()
         pbar.close()
         if len(to_change) > 0:
+            to_change = self.transform(to_change, crs_transform, osr_transform)
             self.writer.changeGeometryValues(to_change)
         self.setCrs(target_crs)
         self.updateExtents()
@@ -236,6 +423,85 @@ class BaseLayer(QgsVectorLayer):
             target_crs.description(),
         )
 
+    def transform(self, geometries, crs_transform, osr_transform=None):
+        """
+        Return a dictionary of geometries transformed, batched if possible.
+
+        Args:
+            geometries (dict): Geometries by feature id
+            crs_transform (QgsCoordinateTransform): transformation
+            osr_transform (osr.CoordinateTransformation): batch transformation
+
+        Returns:
+            (dict) Transformed geometries by feature id
+        """
+        result = None
+        if osr_transform is not None:
+            try:
+                result = self.transform_geometries(
+                    list(geometries.values()), osr_transform
+                )
+            except (RuntimeError, TypeError, ValueError):
+                result = None
+        if result is None:
+            result = []
+            for geom in geometries.values():
+                geom = QgsGeometry(geom)
+                geom.transform(crs_transform)
+                result.append(geom)
+        return dict(zip(geometries.keys(), result))
+
+    def get_view(self, target_crs=None):
+        """
+        Return the geometries of this layer in other CRS.
+
+        The geometries are reprojected once and reused until a geometry of
+        the layer is added, changed or deleted.
+
+        Args:
+            target_crs (QgsCoordinateReferenceSystem): Defaults to EPSG:4326
+
+        Returns:
+            (dict) Geometries by feature id
+        """
+        if target_crs is None:
+            target_crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
+        view = self.get_cached_view(target_crs)
+        if view is not None:
+            return view
+        key = get_crs_key(target_crs)
+        self.crs_views = {}  # Keep only the last view
+        crs_transform = None
+        osr_transform = None
+        if get_crs_key(self.crs()) != key:
+            crs_transform = self.get_crs_transform(self.crs(), target_crs)
+            osr_transform = self.get_osr_transform(self.crs(), target_crs)
+        view = {}
+        chunk = {}
+        request = QgsFeatureRequest().setNoAttributes()
+        for feature in self.getFeatures(request):
+            geom = feature.geometry()
+            if not geom.isNull():
+                chunk[feature.id()] = geom
+            if crs_transform and len(chunk) > BUFFER_SIZE:
+                view.update(self.transform(chunk, crs_transform, osr_transform))
+                chunk = {}
+        if crs_transform:
+            chunk = self.transform(chunk, crs_transform, osr_transform)
+        view.update(chunk)
+        self.crs_views[key] = (self.writer.revision, get_crs_key(self.crs()), view)
+        return view
+
+    def get_cached_view(self, target_crs):
+        """Return the geometries of get_view if they are up to date or None."""
+        cached = self.crs_views.get(get_crs_key(target_crs))
+        if cached is None:
+            return None
+        revision, source_key, view = cached
+        if revision != self.writer.revision or source_key != get_crs_key(self.crs()):
+            return None
+        return view
+
     def join_field(
         self,
         source_layer,
@@ -248,6 +514,8 @@ class BaseLayer(QgsVectorLayer):
         Replace qgis table join mechanism.
 
         I'm not able to work with it in standalone script mode (without GUI).
+        Source values are hashed by the join field reading only the needed
+        columns of both layers.
 
         Args:
             source_layer (QgsVectorLayer): Source layer.
@@ -267,26 +535,31 @@ class BaseLayer(QgsVectorLayer):
                 fields.append(field)
         self.writer.addAttributes(fields)
         self.updateFields()
+        source_fields = source_layer.fields()
+        join_ndx = source_fields.indexFromName(join_field_name)
+        source_ndx = [source_fields.indexFromName(attr) for attr in field_names_subset]
+        target_ndx = [
+            self.fields().indexFromName(prefix + a) for a in field_names_subset
+        ]
+        key_ndx = self.fields().indexFromName(target_field_name)
         source_values = {}
         pbar = self.get_progressbar(
             _("Join field"), self.featureCount() + source_layer.featureCount()
         )
-        for feature in source_layer.getFeatures():
-            source_values[feature[join_field_name]] = {
-                attr: feature[attr] for attr in field_names_subset
-            }
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([join_ndx] + source_ndx)
+        for feature in source_layer.getFeatures(request):
+            attrs = feature.attributes()
+            source_values[attrs[join_ndx]] = [attrs[i] for i in source_ndx]
             pbar.update()
+        void = [None] * len(target_ndx)
         total = 0
         to_change = {}
-        for feature in self.getFeatures():
-            attrs = {}
-            for attr in field_names_subset:
-                fieldId = feature.fieldNameIndex(prefix + attr)
-                value = None
-                if feature[target_field_name] in source_values:
-                    value = source_values[feature[target_field_name]][attr]
-                attrs[fieldId] = value
-            to_change[feature.id()] = attrs
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([key_ndx])
+        for feature in self.getFeatures(request):
+            values = source_values.get(feature.attributes()[key_ndx], void)
+            to_change[feature.id()] = dict(zip(target_ndx, values))
             total += 1
             if len(to_change) > BUFFER_SIZE:
                 self.writer.changeAttributeValues(to_change)
@@ -311,12 +584,11 @@ class BaseLayer(QgsVectorLayer):
         field_ndx = self.writer.fieldNameIndex(field_name)
         if field_ndx >= 0:
             to_change = {}
-            for feat in self.getFeatures():
+            request = self.get_request([field_name], geometry=False)
+            for feat in self.getFeatures(request):
                 value = feat[field_name]
                 if value in translations and translations[value] != "":
-                    new_value = translations[value]
-                    feat[field_name] = new_value
-                    to_change[feat.id()] = get_attributes(feat)
+                    to_change[feat.id()] = {field_ndx: translations[value]}
                 elif clean:
                     to_clean.append(feat.id())
             self.writer.changeAttributeValues(to_change)
@@ -325,11 +597,13 @@ class BaseLayer(QgsVectorLayer):
         return len(to_clean)
 
     def get_index(self):
-        """Return a QgsSpatialIndex of all features in this layer."""
-        if self.featureCount() > 0:
-            return QgsSpatialIndex(self.getFeatures())
-        else:  # QGIS exception for void layers).
-            return QgsSpatialIndex()
+        """
+        Return a QgsSpatialIndex of all features in this layer.
+
+        The index is cached and updated with the edits made with the writer
+        (see LayerWriter). It must not be modified by the caller.
+        """
+        return self.writer.get_index()
 
     def bounding_box(self, expression=None):
         """
@@ -401,35 +675,58 @@ class BaseLayer(QgsVectorLayer):
         data=None,
         tags={},
         upload="never",
+        compact=False,
     ):
         """
         Export this layer to an Osm data set.
 
+        The geometries are converted to EPSG:4326 using get_view. Vertices
+        of polygons in the same position share a node.
+
         Args:
             tags_translation (function): Function to translate fields to tags.
                 By defaults convert all fields.
             data (Osm): OSM data set to append. By default creates a new one.
             upload (str): upload attribute of the osm dataset, default 'never'
             tags (dict): tags to update config.changeset_tags
+            compact (bool): If True and data is None, creates an
+                osmcompact.Osm data set, faster to build and write but without
+                the editing methods of osm.Osm.
 
         Returns:
             Osm: OSM data set
         """
         if data is None:
             generator = config.app_name + " " + config.app_version
-            data = osm.Osm(upload, generator=generator)
+            osm_class = osmcompact.Osm if compact else osm.Osm
+            data = osm_class(upload, generator=generator)
             nodes = ways = relations = 0
         else:
             nodes = len(data.nodes)
             ways = len(data.ways)
             relations = len(data.relations)
+        view = {}
+        if self.crs().isValid() and get_crs_key(self.crs()) != "EPSG:4326":
+            view = self.get_view()
+        vertices = {}  # Nodes of the polygons by coordinates
+
+        def get_node(point):
+            node = vertices.get(point)
+            if node is None:
+                node = data.Node(point)
+                vertices[point] = node
+            return node
+
         for feature in self.getFeatures():
-            geom = feature.geometry()
+            geom = view[feature.id()] if feature.id() in view else feature.geometry()
             e = None
             if geom.wkbType() == WKBPoint:
                 e = data.Node(geom.asPoint())
             elif geom.wkbType() in [WKBPolygon, WKBMultiPolygon]:
-                mp = Geometry.get_multipolygon(geom)
+                mp = [
+                    [[get_node(point) for point in ring] for ring in polygon]
+                    for polygon in wkb.get_polygons(bytes(geom.asWkb()))
+                ]
                 if len(mp) == 1:
                     if len(mp[0]) == 1:
                         e = data.Way(mp[0][0])
@@ -460,6 +757,37 @@ class BaseLayer(QgsVectorLayer):
         )
         return data
 
+    def get_request(
+        self, columns=None, geometry=True, fids=None, expression=None, rect=None
+    ):
+        """
+        Return a feature request for this layer.
+
+        Args:
+            columns (list): Names of the attributes to fetch. Defaults to all.
+            geometry (bool): If False, features are fetched without geometry.
+            fids (iterable): Filter by feature ids.
+            expression (str): Filter expression. Incompatible with fids.
+            rect (QgsRectangle): Filter by bounding box.
+
+        Returns:
+            QgsFeatureRequest: request
+        """
+        request = QgsFeatureRequest()
+        if fids is not None and expression:
+            raise TypeError("Feature ids and expression filters are exclusive")
+        if fids is not None:
+            request.setFilterFids(list(fids))
+        if expression:
+            request.setFilterExpression(expression)
+        if rect is not None:
+            request.setFilterRect(rect)
+        if not geometry:
+            request.setFlags(request.flags() | QgsFeatureRequest.NoGeometry)
+        if columns is not None:
+            request.setSubsetOfAttributes(columns, self.fields())
+        return request
+
     def search(self, expression=""):
         """Return a features iterator for this search expression."""
         if expression == "":
@@ -472,7 +800,9 @@ class BaseLayer(QgsVectorLayer):
         """Return number of features for this search expression."""
         count = 0
         exists = set()
-        for f in self.search(expression):
+        columns = [unique] if unique else []
+        request = self.get_request(columns, geometry=False, expression=expression)
+        for f in self.getFeatures(request):
             if unique:
                 if f[unique] not in exists:
                     count += 1
@@ -1,15 +1,21 @@
 import logging
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 from qgis.core import QgsFeatureRequest, QgsField, QgsGeometry
 from qgis.PyQt.QtCore import QVariant
 
 from catatom2osm import config, translate
-from catatom2osm.geo import BUFFER_SIZE, SIMPLIFY_BUILDING_PARTS
-from catatom2osm.geo.aux import get_attributes, is_inside
+from catatom2osm.geo import BUFFER_SIZE, SIMPLIFY_BUILDING_PARTS, wkb
+from catatom2osm.geo.aux import (
+    PreparedGeometry,
+    get_attributes,
+    get_prepared,
+    is_inside,
+)
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.polygon import PolygonLayer
 from catatom2osm.geo.point import Point
+from catatom2osm.geo.store import GeometryStore
 from catatom2osm.report import instance as report
 
 log = logging.getLogger(config.app_name)
@@ -78,29 +84,41 @@ class ConsLayer(PolygonLayer):
     def explode_multi_parts(self, address=False):
         request = QgsFeatureRequest()
         if address:
-            refs = {self.get_id(ad) for ad in address.getFeatures()}
-            fids = [f.id() for f in self.getFeatures() if f["localId"] not in refs]
+            ad_request = address.get_request(["localId"], geometry=False)
+            refs = {self.get_id(ad) for ad in address.getFeatures(ad_request)}
+            fids = [
+                f.id()
+                for f in self.getFeatures(self.get_request(["localId"], geometry=False))
+                if f["localId"] not in refs
+            ]
             request.setFilterFids(fids)
         super(ConsLayer, self).explode_multi_parts(request)
 
-    def to_osm(self, data=None, tags={}, upload="never"):
+    def to_osm(self, data=None, tags={}, upload="never", compact=False):
         """Export to OSM."""
+        translation = translate.get_building_translator(self.fields())
         return super(ConsLayer, self).to_osm(
-            translate.building_tags, data, tags=tags, upload=upload
+            translation, data, tags=tags, upload=upload, compact=compact
         )
 
-    def index_of_parts(self):
+    def search_in(self, expression, store=None):
+        """Return features matching expression, with geometries from store."""
+        if store is None:
+            return self.search(expression)
+        return store.features(self.get_request(expression=expression))
+
+    def index_of_parts(self, store=None):
         """Index parts of building by building localid."""
         parts = defaultdict(list)
-        for part in self.search("regexp_match(localId, '_part')"):
+        for part in self.search_in("regexp_match(localId, '_part')", store):
             localId = self.get_id(part)
             parts[localId].append(part)
         return parts
 
-    def index_of_pools(self):
+    def index_of_pools(self, store=None):
         """Index pools in building parcel by building localid."""
         pools = defaultdict(list)
-        for pool in self.search("regexp_match(localId, '_PI')"):
+        for pool in self.search_in("regexp_match(localId, '_PI')", store):
             localId = self.get_id(pool)
             pools[localId].append(pool)
         return pools
@@ -124,10 +142,12 @@ class ConsLayer(PolygonLayer):
 
     def remove_parts_wo_building(self):
         """Remove building parts without building."""
-        bu_refs = [f["localId"] for f in self.getFeatures() if self.is_building(f)]
+        request = self.get_request(["localId"], geometry=False)
+        features = list(self.getFeatures(request))
+        bu_refs = {f["localId"] for f in features if self.is_building(f)}
         to_clean = [
             f.id()
-            for f in self.getFeatures()
+            for f in features
             if self.is_part(f) and self.get_id(f) not in bu_refs
         ]
         if to_clean:
@@ -145,6 +165,7 @@ class ConsLayer(PolygonLayer):
         to_clean_o = []
         to_clean_b = []
         buildings = {f["localId"]: f for f in self.getFeatures() if self.is_building(f)}
+        prepared = {}
         pbar = self.get_progressbar(_("Remove outside parts"), self.featureCount())
         for feat in self.getFeatures():
             if self.is_part(feat):
@@ -152,7 +173,7 @@ class ConsLayer(PolygonLayer):
                 if feat["lev_above"] == 0 and feat["lev_below"] != 0:
                     to_clean_b.append(feat.id())
                 elif ref in buildings:
-                    bu = buildings[ref]
+                    bu = get_prepared(buildings[ref], prepared)
                     if not is_inside(feat, bu):
                         to_clean_o.append(feat.id())
             pbar.update()
@@ -171,6 +192,61 @@ class ConsLayer(PolygonLayer):
             )
             report.underground_parts = len(to_clean_b)
 
+    def preprocess(self):
+        """
+        Apply the pre-clean filters in a single pass over the layer.
+
+        Equivalent to calling remove_outside_parts, remove_parts_wo_building
+        and explode_multi_parts in this order, with the same report counters.
+        """
+        features = list(self.getFeatures())
+        buildings = {f["localId"]: f for f in features if self.is_building(f)}
+        to_clean_o = []
+        to_clean_b = []
+        to_clean_w = []
+        to_clean_m = []
+        to_add = []
+        prepared = {}
+        pbar = self.get_progressbar(_("Preprocess buildings"), len(features))
+        for feat in features:
+            pbar.update()
+            if self.is_part(feat):
+                ref = self.get_id(feat)
+                if feat["lev_above"] == 0 and feat["lev_below"] != 0:
+                    to_clean_b.append(feat.id())
+                    continue
+                if ref not in buildings:
+                    to_clean_w.append(feat.id())
+                    continue
+                if not is_inside(feat, get_prepared(buildings[ref], prepared)):
+                    to_clean_o.append(feat.id())
+                    continue
+            parts = self.get_exploded_parts(feat)
+            if parts:
+                to_add += parts
+                to_clean_m.append(feat.id())
+        pbar.close()
+        to_clean = to_clean_o + to_clean_b + to_clean_w + to_clean_m
+        if to_clean:
+            self.writer.deleteFeatures(to_clean)
+        if to_clean_o:
+            log.debug(
+                _("Removed %d building parts outside the outline"), len(to_clean_o)
+            )
+            report.outside_parts = len(to_clean_o)
+        if to_clean_b:
+            log.debug(
+                _("Deleted %d building parts with no floors above ground"),
+                len(to_clean_b),
+            )
+            report.underground_parts = len(to_clean_b)
+        if to_clean_w:
+            log.debug(_("Removed %d parts without building"), len(to_clean_w))
+            report.parts_wo_building = len(to_clean_w)
+        if to_clean_m:
+            self.writer.addFeatures(to_add)
+            self.report_exploded(len(to_clean_m), len(to_add))
+
     def get_parts(self, outline, parts):
         """
         Return a dictionary of parts for levels, the maximum and minimum levels.
@@ -180,6 +256,8 @@ class ConsLayer(PolygonLayer):
         max_level = 0
         min_level = 0
         parts_for_level = defaultdict(list)
+        if len(parts) > 1:
+            outline = PreparedGeometry(outline)
         for part in parts:
             if is_inside(part, outline):
                 level = (part["lev_above"] or 0, part["lev_below"] or 0)
@@ -260,7 +338,7 @@ class ConsLayer(PolygonLayer):
             new_geom = Geometry().fromPolygonXY(new_poly)
         return delete, new_geom
 
-    def merge_building_parts(self):
+    def merge_building_parts(self, store=None):
         """
         Apply merge_adjacent_parts to each set of building and its parts.
 
@@ -269,9 +347,13 @@ class ConsLayer(PolygonLayer):
         delete them.
         Detect inner rings of buildings/parts with geometry equals to a pool
         geometry and remove them.
+
+        Args:
+            store (GeometryStore): Read and write geometries in store. If it
+                is None, changes are written to the layer.
         """
-        parts = self.index_of_parts()
-        pools = self.index_of_pools()
+        parts = self.index_of_parts(store)
+        pools = self.index_of_pools(store)
         to_clean = []
         to_change = {}
         to_change_g = {}
@@ -283,12 +365,13 @@ class ConsLayer(PolygonLayer):
         visited_parcels = set()
         t_buildings = self.count("not regexp_match(localId, '_')")
         pbar = self.get_progressbar(_("Merge building parts"), t_buildings)
-        for building in self.search("not regexp_match(localId, '_')"):
+        for building in self.search_in("not regexp_match(localId, '_')", store):
             ref = building["localId"]
             it_pools = pools[ref]
             it_parts = parts[ref]
+            container = PreparedGeometry(building) if len(it_pools) > 1 else building
             for pool in it_pools:
-                if pool["layer"] != 1 and is_inside(pool, building):
+                if pool["layer"] != 1 and is_inside(pool, container):
                     pool["layer"] = 1
                     to_change[pool.id()] = get_attributes(pool)
                     pools_on_roofs += 1
@@ -322,10 +405,14 @@ class ConsLayer(PolygonLayer):
         pbar.close()
         if to_change:
             self.writer.changeAttributeValues(to_change)
-        if to_change_g:
-            self.writer.changeGeometryValues(to_change_g)
-        if to_clean:
-            self.writer.deleteFeatures(to_clean)
+        if store is not None:
+            store.update(to_change_g)
+            store.delete(to_clean)
+        else:
+            if to_change_g:
+                self.writer.changeGeometryValues(to_change_g)
+            if to_clean:
+                self.writer.deleteFeatures(to_clean)
         if pools_on_roofs:
             log.debug(_("Located %d swimming pools over a building"), pools_on_roofs)
             report.pools_on_roofs = pools_on_roofs
@@ -346,26 +433,71 @@ class ConsLayer(PolygonLayer):
             log.debug(_("Merged %d adjacent parts"), adjacent_parts_deleted)
             report.adjacent_parts = adjacent_parts_deleted
 
-    def clean(self):
+    def clean(self, workers=None):
         """
         Clean geometries.
 
         Delete invalid geometries and close vertices, add topological points,
-        merge building parts and simplify vertices.
+        merge building parts and simplify vertices. The geometries are kept in
+        memory between stages and written once at the end.
+
+        Args:
+            workers (int): Number of worker processes, config.clean_workers
+                by default. With more than one, invalid geometries and topology
+                are processed in shards (see PolygonLayer.clean_shards).
         """
-        self.delete_invalid_geometries(
-            query_small_area=lambda feat: "_part" not in feat["localId"]
-        )
-        self.topology()
-        self.merge_building_parts()
-        self.simplify()
-        self.delete_small_geometries()
+        workers = workers or config.clean_workers
+        store = GeometryStore(self)
+        query_small_area = lambda feat: "_part" not in feat["localId"]
+        if workers > 1:
+            stages = ["delete_invalid_geometries", "topology"]
+            self.clean_shards(store, workers, stages, query_small_area)
+        else:
+            self.delete_invalid_geometries(query_small_area, store)
+            self.topology(store)
+        self.merge_building_parts(store)
+        self.simplify(store)
+        self.delete_small_geometries(store)
+        store.flush()
+
+    @staticmethod
+    def get_segments(geom):
+        """
+        Return the segments of the outer ring of the first polygon of geom.
+
+        Returns:
+            (list) (key, position) for each segment, where key is the frozenset
+            of the (x, y) coordinates of its vertices and position is the vertex
+            index of its end.
+        """
+        ring = [(p.x(), p.y()) for p in Geometry.get_multipolygon(geom)[0][0]]
+        return [(frozenset(ring[i : i + 2]), i + 1) for i in range(len(ring) - 1)]
+
+    @staticmethod
+    def index_segments(segments, ref, fid, geom, remove=False):
+        """
+        Add to (or remove from) segments the outer segments of a geometry.
+
+        Args:
+            segments (dict): Position of the segment by feature id for each
+                (reference, segment key).
+            ref (str): Reference of the building of the feature.
+            fid (int): Feature id.
+            geom (QgsGeometry): Geometry of the feature.
+            remove (bool): If True, remove the segments.
+        """
+        for key, pos in ConsLayer.get_segments(geom):
+            if remove:
+                segments[(ref, key)].pop(fid, None)
+            else:
+                segments[(ref, key)].setdefault(fid, pos)
 
     def move_entrance(
         self,
         ad,
         ad_buildings,
-        ad_parts,
+        parts,
+        segments,
         to_move,
         to_insert,
         parents_per_vx,
@@ -377,6 +509,15 @@ class ConsLayer(PolygonLayer):
         position is not enough close ('remote'), is a corner ('corner'),
         is in an inner ring ('inner') or is in a wall shared with another
         building ('shared').
+
+        Args:
+            ad (QgsFeature): Entrance address.
+            ad_buildings (list): Buildings of the address.
+            parts (dict): Building parts by feature id.
+            segments (dict): Segment index of the parts (see index_segments).
+            to_move (dict): Accumulator for moved addresses geometries.
+            to_insert (dict): Accumulator for changed buildings/parts geometries.
+            parents_per_vx (dict): Building ids for each vertex (x, y).
         """
         point = ad.geometry().asPoint()
         distance = 9e9
@@ -389,6 +530,10 @@ class ConsLayer(PolygonLayer):
         bid = building.id()
         va = Point(bg.vertexAt(vertex - 1))
         vb = Point(bg.vertexAt(vertex))
+        vertices = ((va.x(), va.y()), (vb.x(), vb.y()))
+        parents = [
+            fid for v in vertices for fid in parents_per_vx.get(v, []) if fid != bid
+        ]
         if distance > config.addr_thr**2:
             ad["spec"] = "remote"
         elif vertex > len(Geometry.get_multipolygon(bg)[0][0]):
@@ -398,7 +543,7 @@ class ConsLayer(PolygonLayer):
             or closest.sqrDist(vb) < config.entrance_thr**2
         ):
             ad["spec"] = "corner"
-        elif PolygonLayer.is_shared_segment(parents_per_vx, va, vb, bid):
+        elif any(c > 1 for c in Counter(parents).values()):
             ad["spec"] = "shared"
         else:
             dg = Geometry.fromPointXY(closest)
@@ -406,17 +551,16 @@ class ConsLayer(PolygonLayer):
             bg.insertVertex(closest.x(), closest.y(), vertex)
             to_insert[bid] = QgsGeometry(bg)
             building.setGeometry(bg)
-            for part in ad_parts:
+            ref = self.get_id(building)
+            key = (ref, frozenset(vertices))
+            for fid, pos in list(segments.get(key, {}).items()):
+                part = parts[fid]
                 pg = part.geometry()
-                r = Geometry.get_multipolygon(pg)[0][0]
-                for i in range(len(r) - 1):
-                    vpa = Point(pg.vertexAt(i))
-                    vpb = Point(pg.vertexAt(i + 1))
-                    if va in (vpa, vpb) and vb in (vpa, vpb):
-                        pg.insertVertex(closest.x(), closest.y(), i + 1)
-                        to_insert[part.id()] = QgsGeometry(pg)
-                        part.setGeometry(pg)
-                        break
+                self.index_segments(segments, ref, fid, pg, remove=True)
+                pg.insertVertex(closest.x(), closest.y(), pos)
+                self.index_segments(segments, ref, fid, pg)
+                to_insert[fid] = QgsGeometry(pg)
+                part.setGeometry(pg)
 
     def move_address(self, address):
         """
@@ -433,15 +577,25 @@ class ConsLayer(PolygonLayer):
         to_clean = []
         mp = 0
         oa = 0
-        (buildings, parts) = self.index_of_building_and_parts()
-        exp = "NOT(localId ~ '_')"
-        ppv, geometries = self.get_parents_per_vertex_and_geometries(exp)
+        buildings = defaultdict(list)
+        parts = {}
+        segments = defaultdict(dict)
+        ppv = defaultdict(list)
+        request = self.get_request(["localId"])
+        for feat in self.getFeatures(request):
+            if self.is_building(feat):
+                buildings[feat["localId"]].append(feat)
+                for point in Geometry.get_vertices_list(feat):
+                    ppv[(point.x(), point.y())].append(feat.id())
+            elif self.is_part(feat):
+                parts[feat.id()] = feat
+                ref = self.get_id(feat)
+                self.index_segments(segments, ref, feat.id(), feat.geometry())
         pbar = self.get_progressbar(_("Move addresses"), address.featureCount())
         for ad in address.getFeatures():
             refcat = self.get_id(ad)
-            building_count = len(buildings.get(refcat, []))
-            ad_buildings = buildings[refcat]
-            ad_parts = parts[refcat]
+            ad_buildings = buildings.get(refcat, [])
+            building_count = len(ad_buildings)
             if building_count == 0:
                 to_clean.append(ad.id())
                 oa += 1
@@ -450,7 +604,8 @@ class ConsLayer(PolygonLayer):
                     self.move_entrance(
                         ad,
                         ad_buildings,
-                        ad_parts,
+                        parts,
+                        segments,
                         to_move,
                         to_insert,
                         ppv,
@@ -514,6 +669,67 @@ class ConsLayer(PolygonLayer):
         if to_change:
             self.writer.changeAttributeValues(to_change)
 
+    @staticmethod
+    def get_osm_polygons(el):
+        """
+        Return the outer rings of an OSM building or pool.
+
+        Returns:
+            (list) Polygons as lists of rings of coordinates or None if el is
+            not a closed building or pool.
+        """
+        is_pool = "leisure" in el.tags and el.tags["leisure"] == "swimming_pool"
+        is_building = "building" in el.tags
+        if not (is_building or is_pool):
+            return None
+        if el.type == "way" and el.is_closed():
+            return [[el.geometry()]]
+        elif el.type == "relation":
+            return [[ring] for ring in el.outer_geometry()] or None
+        return None
+
+    def get_conflicts(self, current_bu_osm):
+        """
+        Return the conflicts of the buildings and pools in current_bu_osm.
+
+        An OSM building is in conflict with a building of this layer if one
+        contains the other or they overlap. The OSM geometries are built from
+        WKB and prepared when they have more than one candidate.
+
+        Returns:
+            (list) (element, fids) tuples for each OSM building or pool, where
+            fids are the ids of the conflicting features in this layer, empty
+            if there is no conflict or None if the OSM geometry is not valid.
+        """
+        index = self.get_index()
+        request = self.get_request([])
+        geometries = {f.id(): f.geometry() for f in self.getFeatures(request)}
+        conflicts = []
+        pbar = self.get_progressbar(_("Conflate"), len(current_bu_osm.elements))
+        for el in current_bu_osm.elements:
+            pbar.update()
+            polygons = self.get_osm_polygons(el)
+            if polygons is None:
+                continue
+            geom = QgsGeometry()
+            geom.fromWkb(wkb.from_multipolygon(polygons))
+            if geom.isNull() or not geom.isGeosValid():
+                conflicts.append((el, None))
+                continue
+            fids = index.intersects(geom.boundingBox())
+            if len(fids) > 1:
+                geom = PreparedGeometry(geom)
+            fids = [
+                fid
+                for fid in fids
+                if geom.contains(geometries[fid])
+                or geom.within(geometries[fid])
+                or geom.overlaps(geometries[fid])
+            ]
+            conflicts.append((el, fids))
+        pbar.close()
+        return conflicts
+
     def conflate(self, current_bu_osm, delete=True):
         """
         Remove from current_bu_osm the buildings that don't have conflicts.
@@ -522,43 +738,22 @@ class ConsLayer(PolygonLayer):
         """
         if len(current_bu_osm.elements) == 0:
             return
-        index = self.get_index()
-        geometries = {f.id(): QgsGeometry(f.geometry()) for f in self.getFeatures()}
         num_buildings = 0
         conflicts = 0
         to_clean = set()
-        pbar = self.get_progressbar(_("Conflate"), len(current_bu_osm.elements))
-        for el in current_bu_osm.elements:
-            poly = None
-            is_pool = "leisure" in el.tags and el.tags["leisure"] == "swimming_pool"
-            is_building = "building" in el.tags
-            if el.type == "way" and el.is_closed() and (is_building or is_pool):
-                poly = [[map(Point, el.geometry())]]
-            elif el.type == "relation" and (is_building or is_pool):
-                poly = [[map(Point, w)] for w in el.outer_geometry()]
-            if poly:
-                num_buildings += 1
-                geom = Geometry().fromMultiPolygonXY(poly)
-                if geom is None or not geom.isGeosValid():
-                    msg = _("OSM building with id %s is not valid") % el.fid
-                    pbar.clear()
-                    log.warning(msg)
-                    report.warnings.append(msg)
-                else:
-                    fids = index.intersects(geom.boundingBox())
-                    conflict = False
-                    for fid in fids:
-                        fg = geometries[fid]
-                        if geom.contains(fg) or fg.contains(geom) or geom.overlaps(fg):
-                            conflict = True
-                            conflicts += 1
-                            break
-                    if delete and not conflict:
-                        to_clean.add(el)
-                    if not delete and conflict:
-                        el.tags["conflict"] = "yes"
-            pbar.update()
-        pbar.close()
+        for el, fids in self.get_conflicts(current_bu_osm):
+            num_buildings += 1
+            if fids is None:
+                msg = _("OSM building with id %s is not valid") % el.fid
+                log.warning(msg)
+                report.warnings.append(msg)
+                continue
+            if fids:
+                conflicts += 1
+            if delete and not fids:
+                to_clean.add(el)
+            if not delete and fids:
+                el.tags["conflict"] = "yes"
         for el in to_clean:
             current_bu_osm.remove(el)
         log.debug(
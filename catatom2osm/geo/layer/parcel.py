@@ -1,11 +1,11 @@
 import logging
-from collections import defaultdict
+from collections import Counter, defaultdict
 
-from qgis.core import QgsFeature, QgsField, QgsGeometry, QgsRectangle
+from qgis.core import QgsFeature, QgsField, QgsGeometry
 from qgis.PyQt.QtCore import QVariant
 
 from catatom2osm import config
-from catatom2osm.geo.aux import get_attributes, is_inside_area, merge_groups
+from catatom2osm.geo.aux import get_prepared, is_inside_area, merge_groups
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.cons import ConsLayer
 from catatom2osm.geo.layer.polygon import PolygonLayer
@@ -57,6 +57,7 @@ class ParcelLayer(PolygonLayer):
         """Create fake parcels for buildings not contained in any."""
         pa_refs = [f["localId"] for f in self.getFeatures()]
         to_add = {}
+        geometries = defaultdict(list)
         for source in sources:
             if source is None:
                 continue
@@ -66,64 +67,93 @@ class ParcelLayer(PolygonLayer):
                     mp = Geometry.get_outer_rings(feat)
                     geom = Geometry.fromMultiPolygonXY(mp)
                     if ref in to_add:
-                        parcel = to_add[ref]
-                        geom = parcel.geometry().combine(geom)
-                        parcel.setGeometry(geom)
-                        to_add[ref] = parcel
+                        geometries[ref].append(geom)
                     elif split is None or split.is_inside_area(geom):
                         parcel = QgsFeature(self.fields())
                         parcel["localId"] = ref
-                        parcel.setGeometry(geom)
                         to_add[ref] = parcel
+                        geometries[ref].append(geom)
+        for ref, parcel in to_add.items():
+            parcel.setGeometry(Geometry.union(geometries[ref]))
         if to_add:
             self.writer.addFeatures(to_add.values())
             log.debug(_("Added %d missing parcels"), len(to_add))
 
     def set_muncode(self, muncode):
         """Assign to each parcel the code of the municipality."""
-        to_change = {}
-        for pa in self.getFeatures():
-            pa["muncode"] = muncode
-            to_change[pa.id()] = get_attributes(pa)
+        fieldId = self.fields().indexFromName("muncode")
+        request = self.get_request([], geometry=False)
+        to_change = {pa.id(): {fieldId: muncode} for pa in self.getFeatures(request)}
         if to_change:
             self.writer.changeAttributeValues(to_change)
 
-    def set_zones(self, zoning):
-        """Assign to each parcel the label of the zone that contains it."""
-        index = zoning.get_index()
-        features = {f.id(): f for f in zoning.getFeatures()}
+    def set_zones(self, *zonings):
+        """
+        Assign to each parcel the label of the zone that contains it.
+
+        The zoning layers are tried in order in a single pass over the
+        parcels. A zone contains a parcel if its label matches the parcel
+        reference, if it contains the centroid of the parcel, or else if it
+        contains most of the area of the parcel. Areas are only computed for
+        the parcels with the centroid outside or in the boundary of the zone.
+        """
+        engines = []
+        for zoning in zonings:
+            features = {f.id(): f for f in zoning.getFeatures()}
+            labels = {fid: zoning.format_label(f) for fid, f in features.items()}
+            engines.append((zoning, zoning.get_index(), features, labels, {}))
+        zone_ndx = self.fields().indexFromName("zone")
+        counts = Counter()
         to_change = {}
-        for pa in self.getFeatures():
-            if pa["zone"] is None:
-                c = pa.geometry().centroid().asPoint()
-                bb = QgsRectangle(c, c)
-                fids = index.intersects(bb)
-                for fid in fids:
+        for pa in self.getFeatures(self.get_request(["localId", "zone"])):
+            if pa["zone"] is not None:
+                continue
+            pa_label = self.get_zone(pa)
+            centroid = pa.geometry().centroid()
+            bb = centroid.boundingBox()
+            for zoning, index, features, labels, prepared in engines:
+                label = None
+                for fid in index.intersects(bb):
                     zone = features[fid]
-                    label = zoning.format_label(zone)
-                    pa_label = self.get_zone(pa)
-                    if pa_label == label or is_inside_area(pa, zone):
-                        if str(label) == "inf":
-                            label = pa_label
-                        pa["zone"] = label
-                        to_change[pa.id()] = get_attributes(pa)
+                    if labels[fid] == pa_label or self.is_zone_of(
+                        pa, centroid, get_prepared(zone, prepared)
+                    ):
+                        label = labels[fid]
                         break
+                if label is not None:
+                    if str(label) == "inf":
+                        label = pa_label
+                    to_change[pa.id()] = {zone_ndx: label}
+                    counts[zoning.name()] += 1
+                    break
         msg = _("Assigned %d zones from %s to parcels")
-        log.debug(msg, len(to_change), self.sourceName())
+        for zoning in zonings:
+            log.debug(msg, counts[zoning.name()], zoning.name())
         if to_change:
             self.writer.changeAttributeValues(to_change)
 
+    @staticmethod
+    def is_zone_of(parcel, centroid, zone):
+        """Return True if zone contains centroid or most of the parcel area."""
+        return zone.contains(centroid) or is_inside_area(parcel, zone)
+
     def set_missing_zones(self):
         """Assign label from cadastral reference if no zone exists."""
         to_change = {}
         m = 0
-        for pa in self.getFeatures():
-            if pa["zone"] is None:
+        zone_ndx = self.fields().indexFromName("zone")
+        type_ndx = self.fields().indexFromName("type")
+        request = self.get_request(["localId", "zone"], geometry=False)
+        for pa in self.getFeatures(request):
+            attrs = {}
+            zone = pa["zone"]
+            if zone is None:
                 m += 1
-                pa["zone"] = self.get_zone(pa)
-            pa["type"] = _("Rustic") if len(pa["zone"]) == 3 else _("Urban")
-            pa["type"] = pa["type"].replace("ú", "&uacute;")
-            to_change[pa.id()] = get_attributes(pa)
+                zone = self.get_zone(pa)
+                attrs[zone_ndx] = zone
+            ptype = _("Rustic") if len(zone) == 3 else _("Urban")
+            attrs[type_ndx] = ptype.replace("ú", "&uacute;")
+            to_change[pa.id()] = attrs
         if m:
             log.debug(_("There are %d parcels without zone"), m)
         self.writer.changeAttributeValues(to_change)
@@ -194,12 +224,13 @@ class ParcelLayer(PolygonLayer):
     def count_parts(self, buildings):
         """Add count of parts in parcel field."""
         parts_count = defaultdict(int)
-        for f in buildings.getFeatures():
+        request = buildings.get_request(["localId"], geometry=False)
+        for f in buildings.getFeatures(request):
             parts_count[buildings.get_id(f)] += 1
         to_change = {}
-        for f in self.getFeatures():
-            f["parts"] = parts_count[f["localId"]]
-            to_change[f.id()] = get_attributes(f)
+        parts_ndx = self.fields().indexFromName("parts")
+        for f in self.getFeatures(self.get_request(["localId"], geometry=False)):
+            to_change[f.id()] = {parts_ndx: parts_count[f["localId"]]}
         self.writer.changeAttributeValues(to_change)
         return dict(parts_count)
 
@@ -1,15 +1,29 @@
 import logging
+import multiprocessing
 from collections import Counter, defaultdict
 
-from qgis.core import QgsFeature, QgsFeatureRequest, QgsFields, QgsGeometry
+from qgis.core import (
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFields,
+    QgsGeometry,
+)
 
 from catatom2osm import config
-from catatom2osm.geo import BUFFER_SIZE
-from catatom2osm.geo.aux import is_inside, is_inside_area, merge_groups
+from catatom2osm.geo import shard
+from catatom2osm.geo.aux import (
+    PreparedGeometry,
+    get_geometry,
+    get_prepared,
+    is_inside,
+    is_inside_area,
+    merge_groups,
+)
 from catatom2osm.geo.debug import DebugWriter
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.base import BaseLayer
 from catatom2osm.geo.point import Point
+from catatom2osm.geo.store import GeometryStore
 from catatom2osm.geo.types import WKBPolygon
 from catatom2osm.report import instance as report
 
@@ -29,22 +43,47 @@ class PolygonLayer(BaseLayer):
         self.straight_thr = config.straight_thr
         # Threshold for topological points
         self.dist_thr = config.dist_thr
+        self.containers = None
 
     def get_area(self):
         """Return sum of all features area."""
         return sum([f.geometry().area() for f in self.getFeatures()])
 
+    def get_containers(self, feature):
+        """
+        Iterate over the features of this layer that could contain feature.
+
+        Yields in feature id order the features whose bounding box intersects
+        feature with its prepared geometry. The spatial index, prepared
+        geometries and combined area of the layer are kept until the layer is
+        modified.
+        """
+        revision = self.writer.revision
+        if self.containers is None or self.containers[0] != revision:
+            features = {feat.id(): feat for feat in self.getFeatures()}
+            index = self.get_index()
+            geoms = [feat.geometry() for feat in features.values()]
+            area = QgsGeometry.unaryUnion(geoms)
+            area = None if area.isNull() else PreparedGeometry(area)
+            self.containers = (revision, index, features, {}, area)
+        __, index, features, prepared, area = self.containers
+        geom = get_geometry(feature)
+        if area is not None and not area.intersects(geom):
+            return
+        for fid in sorted(index.intersects(geom.boundingBox())):
+            yield features[fid], get_prepared(features[fid], prepared)
+
     def is_inside(self, feature):
         """Return first feature of this layer that is_inside feature."""
-        for feat in self.getFeatures():
-            if is_inside(feature, feat):
+        for feat, prepared in self.get_containers(feature):
+            if is_inside(feature, prepared):
                 return feat
         return None
 
     def is_inside_area(self, feature):
         """Return first feature of this layer that is_inside_area feature."""
-        for feat in self.getFeatures():
-            if is_inside_area(feature, feat):
+        for feat, prepared in self.get_containers(feature):
+            if is_inside_area(feature, prepared):
                 return feat
         return None
 
@@ -62,26 +101,39 @@ class PolygonLayer(BaseLayer):
         msg = _("Explode multi parts")
         pbar = self.get_progressbar(msg, self.featureCount())
         for feature in self.getFeatures(request):
-            mp = Geometry.get_multipolygon(feature)
-            if len(mp) > 1:
-                for part in mp:
-                    feat = QgsFeature(feature)
-                    feat.setGeometry(Geometry.fromPolygonXY(part))
-                    to_add.append(feat)
+            parts = self.get_exploded_parts(feature)
+            if parts:
+                to_add += parts
                 to_clean.append(feature.id())
             pbar.update()
         pbar.close()
         if to_clean:
             self.writer.deleteFeatures(to_clean)
             self.writer.addFeatures(to_add)
-            log.debug(
-                _("%d multi-polygons splitted into %d polygons in " "the '%s' layer"),
-                len(to_clean),
-                len(to_add),
-                self.name(),
-            )
-            report.values["multipart_geoms_" + self.name()] = len(to_clean)
-            report.values["exploded_parts_" + self.name()] = len(to_add)
+            self.report_exploded(len(to_clean), len(to_add))
+
+    @staticmethod
+    def get_exploded_parts(feature):
+        """Return a feature for each part of a multipolygon or [] for polygons."""
+        mp = Geometry.get_multipolygon(feature)
+        parts = []
+        if len(mp) > 1:
+            for part in mp:
+                feat = QgsFeature(feature)
+                feat.setGeometry(Geometry.fromPolygonXY(part))
+                parts.append(feat)
+        return parts
+
+    def report_exploded(self, multipolygons, polygons):
+        """Log and report the result of explode_multi_parts."""
+        log.debug(
+            _("%d multi-polygons splitted into %d polygons in " "the '%s' layer"),
+            multipolygons,
+            polygons,
+            self.name(),
+        )
+        report.values["multipart_geoms_" + self.name()] = multipolygons
+        report.values["exploded_parts_" + self.name()] = polygons
 
     @staticmethod
     def is_shared_segment(parents_per_vx, va, vb, feature_id):
@@ -96,16 +148,26 @@ class PolygonLayer(BaseLayer):
         parents += [gid for gid in parents_per_vx[vb.asWkt()] if gid != feature_id]
         return any([c > 1 for c in Counter(parents).values()])
 
-    def get_parents_per_vertex_and_geometries(self, expression=""):
+    def get_parents_per_vertex_and_geometries(self, expression="", store=None):
         """
         Auxiliary indexes for vertex of geometries.
 
+        Args:
+            expression (str): Filter for the features to index.
+            store (GeometryStore): If provided, index the geometries in store
+                instead of the features matching expression.
+
         Returns:
             (dict) parent fids for each vertex, (dict) geometry for each fid.
         Precondition:
             Called before reproject.
         """
         parents_per_vertex = defaultdict(list)
+        if store is not None:
+            for fid, geom in store.items():
+                for point in Geometry.get_vertices_list(geom):
+                    parents_per_vertex[point.asWkt()].append(fid)
+            return (parents_per_vertex, store)
         geometries = {}
         for feature in self.search(expression):
             geom = QgsGeometry(feature.geometry())
@@ -158,8 +220,17 @@ class PolygonLayer(BaseLayer):
         groups = merge_groups(adjs)
         return (groups, geometries)
 
-    def topology(self):
-        """Add to nearest segments each vertex in a polygon layer."""
+    def topology(self, store=None, fids=None, counted=None):
+        """
+        Add to nearest segments each vertex in a polygon layer.
+
+        Args:
+            store (GeometryStore): Read and write geometries in store. If it
+                is None, changes are written to the layer.
+            fids (set): Only look for the vertices of these features.
+            counted (func): Only report the changes in the vertices for which
+                it returns True.
+        """
         threshold = self.dist_thr  # Distance threshold to create nodes
         dup_thr = self.dup_thr
         straight_thr = self.straight_thr
@@ -167,19 +238,24 @@ class PolygonLayer(BaseLayer):
         td = 0
         if log.app_level <= logging.DEBUG:
             debshp = DebugWriter("debug_topology.shp", self)
-        geometries = {f.id(): QgsGeometry(f.geometry()) for f in self.getFeatures()}
-        index = self.get_index()
-        to_change = {}
+        own_store = store is None
+        geometries = GeometryStore(self) if own_store else store
+        index = geometries.get_index()
         nodes = set()
-        pbar = self.get_progressbar(_("Topology"), len(geometries))
+        pbar = self.get_progressbar(
+            _("Topology"), len(geometries if fids is None else fids)
+        )
         for (gid, geom) in geometries.items():
+            if fids is not None and gid not in fids:
+                continue
             if geom.area() < config.min_area:
                 continue
             for point in frozenset(Geometry.get_outer_vertices(geom)):
                 if point not in nodes:
+                    inc = 1 if counted is None or counted(point) else 0
                     area_of_candidates = Point(point).boundingBox(threshold)
-                    fids = index.intersects(area_of_candidates)
-                    for fid in fids:
+                    candidates = index.intersects(area_of_candidates)
+                    for fid in candidates:
                         g = QgsGeometry(geometries[fid])
                         (p, ndx, ndxa, ndxb, dist_v) = g.closestVertex(point)
                         (dist_s, closest, vertex) = g.closestSegmentWithContext(point)[
@@ -204,7 +280,7 @@ class PolygonLayer(BaseLayer):
                                     )
                                     nodes.add(p)
                                     nodes.add(va)
-                                    td += 1
+                                    td += inc
                             if dist_b < dup_thr**2:
                                 g.deleteVertex(ndxb)
                                 note = "dupe refused by isGeosValid"
@@ -218,7 +294,7 @@ class PolygonLayer(BaseLayer):
                                     )
                                     nodes.add(p)
                                     nodes.add(vb)
-                                    td += 1
+                                    td += inc
                         elif dist_v < dup_thr**2:
                             g.moveVertex(point.x(), point.y(), ndx)
                             note = "dupe refused by isGeosValid"
@@ -231,7 +307,7 @@ class PolygonLayer(BaseLayer):
                                     point.y(),
                                 )
                                 nodes.add(p)
-                                td += 1
+                                td += inc
                         elif (
                             dist_s < threshold**2 and closest != va and closest != vb
                         ):
@@ -249,19 +325,15 @@ class PolygonLayer(BaseLayer):
                                             point.x(),
                                             point.y(),
                                         )
-                                        tp += 1
+                                        tp += inc
                         if note.startswith("Merge") or note.startswith("Add"):
-                            to_change[fid] = g
                             geometries[fid] = g
                         if note and log.app_level <= logging.DEBUG:
                             debshp.add_point(point, note)
-            if len(to_change) > BUFFER_SIZE:
-                self.writer.changeGeometryValues(to_change)
-                to_change = {}
             pbar.update()
         pbar.close()
-        if len(to_change) > 0:
-            self.writer.changeGeometryValues(to_change)
+        if own_store:
+            geometries.flush()
         if td:
             log.debug(_("Merged %d close vertices in the '%s' layer"), td, self.name())
             report.values["vertex_close_" + self.name()] = td
@@ -280,25 +352,34 @@ class PolygonLayer(BaseLayer):
         if len(to_change) > 0:
             self.writer.changeGeometryValues(to_change)
 
-    def delete_small_geometries(self):
-        to_clean = []
-        for feat in self.getFeatures():
-            fid = feat.id()
-            geom = feat.geometry()
-            if geom.area() < config.min_area:
-                to_clean.append(fid)
+    def delete_small_geometries(self, store=None):
+        """Delete geometries with area less than config.min_area."""
+        own_store = store is None
+        store = GeometryStore(self) if own_store else store
+        to_clean = [fid for fid, geom in store.items() if geom.area() < config.min_area]
+        store.delete(to_clean)
+        if own_store:
+            store.flush()
         if to_clean:
-            self.writer.deleteFeatures(to_clean)
             msg = _("Deleted %d invalid geometries in the '%s' layer")
             log.debug(msg, len(to_clean), self.name())
             report.inc("geom_invalid_" + self.name(), len(to_clean))
 
-    def delete_invalid_geometries(self, query_small_area=lambda feat: True):
+    def delete_invalid_geometries(
+        self, query_small_area=lambda feat: True, store=None, counted=None
+    ):
         """
         Delete invalid geometries.
 
         Test if any of it acute angle vertex could be deleted.
         Also removes zig-zag and spike vertex (see Point.get_spike_context).
+
+        Args:
+            query_small_area (func): Filter of features to delete if small.
+            store (GeometryStore): Read and write geometries in store. If it
+                is None, changes are written to the layer.
+            counted (func): Only report the changes in the features for which
+                it returns True given the center of its bounding box.
         """
         if log.app_level <= logging.DEBUG:
             debshp = DebugWriter("debug_notvalid.shp", self, QgsFields(), WKBPolygon)
@@ -310,19 +391,24 @@ class PolygonLayer(BaseLayer):
         rings = 0
         zz = 0
         spikes = 0
+        invalid = 0
         geometries = {}
+        own_store = store is None
+        store = GeometryStore(self) if own_store else store
         msg = _("Delete invalid geometries")
-        pbar = self.get_progressbar(msg, len(geometries))
-        for feat in self.getFeatures():
+        pbar = self.get_progressbar(msg, len(store))
+        for feat in store.features():
             fid = feat.id()
             geom = feat.geometry()
+            center = geom.boundingBox().center()
+            inc = 1 if counted is None or counted(center) else 0
             badgeom = False
             pn = 0
             for polygon in Geometry.get_multipolygon(geom):
                 f = QgsFeature(QgsFields())
                 g = Geometry.fromPolygonXY(polygon)
                 if g.area() < config.min_area and query_small_area(feat):
-                    parts += 1
+                    parts += inc
                     geom.deletePart(pn)
                     to_change[fid] = geom
                     f.setGeometry(QgsGeometry(g))
@@ -353,7 +439,7 @@ class PolygonLayer(BaseLayer):
                         g.deleteVertex(n)
                         if not g.isGeosValid() or g.area() < config.min_area:
                             if i > 0:
-                                rings += 1
+                                rings += inc
                                 geom.deleteRing(i)
                                 to_change[fid] = geom
                                 if log.app_level <= logging.DEBUG:
@@ -361,6 +447,7 @@ class PolygonLayer(BaseLayer):
                             else:
                                 badgeom = True
                                 to_clean.append(fid)
+                                invalid += inc
                                 if log.app_level <= logging.DEBUG:
                                     debshp.addFeature(f)
                             break
@@ -378,7 +465,7 @@ class PolygonLayer(BaseLayer):
                                 valid = g.isGeosValid()
                                 if valid:
                                     geom = g
-                                    zz += 1
+                                    zz += inc
                                     to_change[fid] = g
                                 if log.app_level <= logging.DEBUG:
                                     debshp2.add_point(
@@ -396,7 +483,7 @@ class PolygonLayer(BaseLayer):
                                 g.deleteVertex(ndx)
                                 valid = g.isGeosValid()
                                 if valid:
-                                    spikes += 1
+                                    spikes += inc
                                     skip = ndxa > ndx
                                     geom = g
                                     to_change[fid] = g
@@ -412,6 +499,7 @@ class PolygonLayer(BaseLayer):
                 geometries[fid] = geom
             if geom.area() < config.min_area and query_small_area(feat):
                 to_clean.append(fid)
+                invalid += inc
                 if fid in to_change:
                     del to_change[fid]
             pbar.update()
@@ -435,8 +523,10 @@ class PolygonLayer(BaseLayer):
                             to_change[fid] = g
                     n += 1
                     v = Point(geom.vertexAt(n))
-        if to_change:
-            self.writer.changeGeometryValues(to_change)
+        store.update(to_change)
+        store.delete(to_clean)
+        if own_store:
+            store.flush()
         if parts:
             msg = _("Deleted %d invalid part geometries in the '%s' layer")
             log.debug(msg, parts, self.name())
@@ -445,11 +535,10 @@ class PolygonLayer(BaseLayer):
             msg = _("Deleted %d invalid ring geometries in the '%s' layer")
             log.debug(msg, rings, self.name())
             report.values["geom_rings_" + self.name()] = rings
-        if to_clean:
-            self.writer.deleteFeatures(to_clean)
+        if invalid:
             msg = _("Deleted %d invalid geometries in the '%s' layer")
-            log.debug(msg, len(to_clean), self.name())
-            report.values["geom_invalid_" + self.name()] = len(to_clean)
+            log.debug(msg, invalid, self.name())
+            report.values["geom_invalid_" + self.name()] = invalid
         if zz:
             msg = _("Deleted %d zig-zag vertices in the '%s' layer")
             log.debug(msg, zz, self.name())
@@ -459,7 +548,7 @@ class PolygonLayer(BaseLayer):
             log.debug(msg, spikes, self.name())
             report.values["vertex_spike_" + self.name()] = spikes
 
-    def simplify(self):
+    def simplify(self, store=None, fids=None, counted=None):
         """
         Reduce the number of vertices in a polygon layer.
 
@@ -468,15 +557,28 @@ class PolygonLayer(BaseLayer):
 
         * Delete vertex if the distance to the segment formed by its parents is
           less than 'cath_thr' meters.
+
+        Args:
+            store (GeometryStore): Read and write geometries in store. If it
+                is None, changes are written to the layer.
+            fids (set): Only simplify the vertices of these features.
+            counted (func): Only report the deleted vertices for which it
+                returns True.
         """
         if log.app_level <= logging.DEBUG:
             debshp = DebugWriter("debug_simplify.shp", self)
         killed = 0
-        to_change = {}
+        own_store = store is None
+        store = GeometryStore(self) if own_store else store
         # Clean non corners
-        (parents_per_vertex, geometries) = self.get_parents_per_vertex_and_geometries()
+        (parents_per_vertex, geometries) = self.get_parents_per_vertex_and_geometries(
+            store=store
+        )
         pbar = self.get_progressbar(_("Simplify"), len(parents_per_vertex))
         for wkt, parents in parents_per_vertex.items():
+            if fids is not None and fids.isdisjoint(parents):
+                pbar.update()
+                continue
             point = Point(wkt)
             # Test if this vertex is a 'corner' in any of its parent polygons
             for fid in parents:
@@ -492,7 +594,8 @@ class PolygonLayer(BaseLayer):
                     break
             msg = "Keep"
             if not is_corner:
-                killed += 1  # delete the vertex from all its parents.
+                # delete the vertex from all its parents.
+                killed += 1 if counted is None or counted(point) else 0
                 for fid in frozenset(parents):
                     g = QgsGeometry(geometries[fid])
                     (__, ndx, __, __, __) = g.closestVertex(point)
@@ -506,17 +609,13 @@ class PolygonLayer(BaseLayer):
                     if Geometry.is_valid(g) and not invalid_ring:
                         parents.remove(fid)
                         geometries[fid] = g
-                        to_change[fid] = g
                         msg = "Deleted"
             if log.app_level <= logging.DEBUG:
                 debshp.add_point(point, msg + " " + debmsg)
-            if len(to_change) > BUFFER_SIZE:
-                self.writer.changeGeometryValues(to_change)
-                to_change = {}
             pbar.update()
         pbar.close()
-        if len(to_change) > 0:
-            self.writer.changeGeometryValues(to_change)
+        if own_store:
+            store.flush()
         if killed > 0:
             log.debug(
                 _("Simplified %d vertices in the '%s' layer"), killed, self.name()
@@ -547,9 +646,7 @@ class PolygonLayer(BaseLayer):
             group = sorted(group, key=sort, reverse=reverse)
             groups[i] = group
             count_adj += len(group)
-            geom = geometries[group[0]]
-            for fid in group[1:]:
-                geom = geom.combine(geometries[fid])
+            geom = Geometry.union([geometries[fid] for fid in group])
             if split:
                 mp = Geometry.get_multipolygon(geom)
                 for j, part in enumerate(mp):
@@ -581,27 +678,116 @@ class PolygonLayer(BaseLayer):
         for feat in self.getFeatures():
             g1 = feat.geometry()
             fids = index.intersects(g1.boundingBox())
-            gc = None
+            others = []
             for fid in fids:
                 g2 = geometries[fid]
                 if g2.intersects(g1):
-                    if gc is None:
-                        gc = QgsGeometry(g2)
-                    else:
-                        gc = gc.combine(g2)
+                    others.append(g2)
                     pbar.update()
+            gc = Geometry.union(others)
             if gc is not None:
                 g1 = g1.difference(gc)
                 self.writer.changeGeometryValues({feat.id(): g1})
         pbar.close()
 
-    def clean(self):
+    def clean_shards(self, store, workers, stages, query_small_area=None):
+        """
+        Run clean stages in worker processes over spatial shards of the layer.
+
+        Each shard is processed with the features near its border as context.
+        Then topology (and simplify if it is in stages) is applied again with
+        the whole layer to the features crossing the border of its shard and
+        the features near them.
+        The report counts each change once, in the shard of the tile where it
+        is located, and doesn't count the second pass.
+
+        Args:
+            store (GeometryStore): Read and write geometries in store.
+            workers (int): Number of worker processes.
+            stages (list): Names of the methods to apply.
+            query_small_area (func): Filter of features to delete if small.
+        """
+        margin = max(self.dist_thr, self.dup_thr, self.cath_thr, config.dist_inv)
+        count = workers * shard.SHARDS_PER_WORKER
+        grid = shard.get_grid(store.geometries, count)
+        shards, border = shard.get_shards(store.geometries, grid, margin)
+        small = {}
+        if query_small_area is not None:
+            small = {feat.id(): query_small_area(feat) for feat in store.features()}
+        thresholds = {
+            key: getattr(self, key)
+            for key in ("dup_thr", "cath_thr", "straight_thr", "dist_thr")
+        }
+        header = (
+            self.name(),
+            self.crs().authid(),
+            shard.get_wkb_type(self),
+            thresholds,
+            stages,
+            grid,
+        )
+
+        def get_data(fids):
+            return [(f, bytes(store[f].asWkb()), small.get(f, True)) for f in fids]
+
+        values = Counter()
+        context = multiprocessing.get_context("spawn")
+        pbar = self.get_progressbar(_("Clean shards"), len(shards))
+        with context.Pool(
+            workers, initializer=shard.init_worker, initargs=(log.app_level,)
+        ) as pool:
+            tasks = (header + (t, get_data(o), get_data(h)) for t, o, h in shards)
+            for results, shard_values in pool.imap_unordered(shard.clean_shard, tasks):
+                to_clean = []
+                for fid, data in results:
+                    if data is None:
+                        to_clean.append(fid)
+                    else:
+                        geom = QgsGeometry()
+                        geom.fromWkb(data)
+                        store[fid] = geom
+                store.delete(to_clean)
+                values.update(shard_values)
+                pbar.update()
+        pbar.close()
+        border &= set(store.keys())
+        msg = _("Processed %d shards with %d border features in the '%s' layer")
+        log.debug(msg, len(shards), len(border), self.name())
+        # The shards discard the changes of their vertices in halo features
+        near = set(border)
+        index = store.get_index()
+        for fid in border:
+            bbox = store[fid].boundingBox()
+            bbox.grow(margin)
+            near.update(index.intersects(bbox))
+        previous = dict(report.values)
+        self.topology(store, near)
+        if "simplify" in stages:
+            self.simplify(store, near)
+        report.values.clear()
+        report.values.update(previous)
+        report.values.update(values)
+
+    def clean(self, workers=None):
         """
         Clean geometries.
 
         Delete invalid geometries and close vertices, add topological points
-        and simplify vertices.
+        and simplify vertices. The geometries are kept in memory between
+        stages and written once at the end.
+
+        Args:
+            workers (int): Number of worker processes, config.clean_workers
+                by default. With more than one the layer is split in shards
+                (see clean_shards).
         """
-        self.delete_invalid_geometries()
-        self.topology()
-        self.simplify()
+        workers = workers or config.clean_workers
+        store = GeometryStore(self)
+        if workers > 1:
+            stages = ["delete_invalid_geometries", "topology", "simplify"]
+            self.clean_shards(store, workers, stages)
+        else:
+            self.delete_invalid_geometries(store=store)
+            self.topology(store)
+            self.simplify(store)
+        store.flush()
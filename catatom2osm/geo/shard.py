@@ -0,0 +1,157 @@
+"""Split the clean of a polygon layer in spatial shards for worker processes."""
+import logging
+import math
+import os
+import sys
+
+from qgis.core import QgsFeature, QgsGeometry, QgsRectangle, QgsWkbTypes
+
+from catatom2osm import config
+from catatom2osm.report import instance as report
+
+log = logging.getLogger(config.app_name)
+
+SHARDS_PER_WORKER = 4
+
+
+def get_grid(geometries, count):
+    """
+    Get a grid of about count square tiles covering geometries.
+
+    Returns:
+        (tuple) minimum x, minimum y, tile width, tile height, columns.
+    """
+    extent = QgsRectangle()
+    extent.setMinimal()
+    for geom in geometries.values():
+        extent.combineExtentWith(geom.boundingBox())
+    cols = max(1, int(math.ceil(math.sqrt(count))))
+    width = extent.width() / cols or 1
+    height = extent.height() / cols or 1
+    return (extent.xMinimum(), extent.yMinimum(), width, height, cols)
+
+
+def get_cell(grid, x, y):
+    """Return the (column, row) of the tile of grid containing x, y."""
+    xmin, ymin, width, height, cols = grid
+    col = min(max(int((x - xmin) / width), 0), cols - 1)
+    row = min(max(int((y - ymin) / height), 0), cols - 1)
+    return col, row
+
+
+def get_tile(grid, point):
+    """Return the index of the tile of grid containing point."""
+    col, row = get_cell(grid, point.x(), point.y())
+    return row * grid[4] + col
+
+
+def get_shards(geometries, grid, margin):
+    """
+    Partition geometries in the tiles of a grid.
+
+    Each feature belongs to the tile containing the center of its bounding
+    box. Features near enough to another tile to interact with its features
+    are also included, read only, in the halo of that tile.
+
+    Args:
+        geometries (dict): Geometries by feature id.
+        grid (tuple): Grid of tiles (see get_grid).
+        margin (float): Distance of interaction between features.
+
+    Returns:
+        (list) (tile index, owned fids, halo fids) for each non empty tile,
+        (set) fids of the features that cross the border of its tile.
+    """
+    cols = grid[4]
+    owned = [[] for __ in range(cols * cols)]
+    halos = [[] for __ in range(cols * cols)]
+    border = set()
+    for fid, geom in geometries.items():
+        bbox = geom.boundingBox()
+        bbox.grow(margin)
+        tile = get_tile(grid, bbox.center())
+        owned[tile].append(fid)
+        col0, row0 = get_cell(grid, bbox.xMinimum(), bbox.yMinimum())
+        col1, row1 = get_cell(grid, bbox.xMaximum(), bbox.yMaximum())
+        if col0 != col1 or row0 != row1:
+            border.add(fid)
+            for r in range(row0, row1 + 1):
+                for c in range(col0, col1 + 1):
+                    if r * cols + c != tile:
+                        halos[r * cols + c].append(fid)
+    shards = [(i, o, h) for i, (o, h) in enumerate(zip(owned, halos)) if o]
+    return shards, border
+
+
+def init_worker(app_level):
+    """Start QGIS in a worker process."""
+    # Imported here because the application module depends on the layers
+    from catatom2osm.app import QgsSingleton
+
+    QgsSingleton()
+    # Debug files and progress bars of the workers would clash with the main
+    # process ones
+    log.app_level = max(app_level, logging.INFO)
+    sys.stderr = open(os.devnull, "w")
+
+
+def clean_shard(task):
+    """
+    Clean the geometries of a shard in a worker process.
+
+    Args:
+        task (tuple): Layer name, CRS auth id, geometry type, thresholds
+            (dict of layer attributes), list of stages (method names), grid
+            (see get_grid), tile index, owned and halo features as lists of
+            (fid, WKB, query small area) tuples.
+
+    Returns:
+        (list) (fid, WKB or None if deleted) for changed owned features,
+        (dict) report values of the layer, counting only the changes located
+        in the tile so that each one is counted by a single shard.
+    """
+    from catatom2osm.geo.layer.polygon import PolygonLayer  # circular import
+
+    name, crs, wkb_type, thresholds, stages, grid, tile, owned, halo = task
+    uri = "{}?crs={}&field=fid:integer&field=small:integer"
+    layer = PolygonLayer(uri.format(wkb_type, crs), name, "memory")
+    for key, value in thresholds.items():
+        setattr(layer, key, value)
+    to_add = []
+    for fid, data, small in owned + halo:
+        geom = QgsGeometry()
+        geom.fromWkb(data)
+        feat = QgsFeature(layer.fields())
+        feat.setAttributes([fid, int(small)])
+        feat.setGeometry(geom)
+        to_add.append(feat)
+    __, features = layer.writer.addFeatures(to_add)
+    fids = {feat.id(): feat["fid"] for feat in features}
+    suffix = "_" + name
+    for key in [k for k in report.values if k.endswith(suffix)]:
+        del report.values[key]
+
+    def counted(point):
+        return get_tile(grid, point) == tile
+
+    for stage in stages:
+        if stage == "delete_invalid_geometries":
+            layer.delete_invalid_geometries(lambda feat: feat["small"], counted=counted)
+        else:
+            getattr(layer, stage)(counted=counted)
+    original = {fid: data for fid, data, __ in owned}
+    results = {}
+    for feat in layer.getFeatures():
+        fid = fids[feat.id()]
+        if fid in original:
+            data = bytes(feat.geometry().asWkb())
+            if data != original.pop(fid):
+                results[fid] = data
+    results.update({fid: None for fid in original})
+    values = {k: v for k, v in report.values.items() if k.endswith(suffix)}
+    return list(results.items()), values
+
+
+def get_wkb_type(layer):
+    """Return the geometry type name of layer for a memory provider uri."""
+    return QgsWkbTypes.displayString(layer.wkbType())
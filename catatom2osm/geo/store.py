@@ -0,0 +1,104 @@
+"""In memory geometries shared between processing stages of a layer."""
+from qgis.core import QgsFeatureRequest, QgsGeometry, QgsSpatialIndex
+
+from catatom2osm.geo import BUFFER_SIZE
+
+
+class GeometryStore(object):
+    """
+    Geometries of a layer by feature id with tracking of changes.
+
+    The stages of a process read and write geometries in the store instead
+    of the layer data provider. Changed geometries and deleted features are
+    written to the layer once with flush.
+    """
+
+    def __init__(self, layer, request=None):
+        """
+        Load the geometries of a layer.
+
+        Args:
+            layer (BaseLayer): Source layer.
+            request (QgsFeatureRequest): Optional filter of features to load.
+        """
+        self.layer = layer
+        request = QgsFeatureRequest(request) if request else QgsFeatureRequest()
+        request.setNoAttributes()
+        self.geometries = {
+            feat.id(): feat.geometry() for feat in layer.getFeatures(request)
+        }
+        self.dirty = set()
+        self.deleted = set()
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def __contains__(self, fid):
+        return fid in self.geometries
+
+    def __iter__(self):
+        return iter(self.geometries)
+
+    def __getitem__(self, fid):
+        return self.geometries[fid]
+
+    def __setitem__(self, fid, geom):
+        self.geometries[fid] = geom
+        self.dirty.add(fid)
+
+    def items(self):
+        return self.geometries.items()
+
+    def keys(self):
+        return self.geometries.keys()
+
+    def update(self, geometries):
+        """Change the geometries in a dictionary by feature id."""
+        for fid, geom in geometries.items():
+            self[fid] = geom
+
+    def delete(self, fids):
+        """Remove features from the store."""
+        for fid in fids:
+            if fid in self.geometries:
+                del self.geometries[fid]
+                self.dirty.discard(fid)
+                self.deleted.add(fid)
+
+    def features(self, request=None):
+        """
+        Iterate over the layer features with the geometries in the store.
+
+        Args:
+            request (QgsFeatureRequest): Optional filter for the features.
+                Geometries are never fetched from the layer.
+        """
+        request = QgsFeatureRequest(request) if request else QgsFeatureRequest()
+        request.setFlags(request.flags() | QgsFeatureRequest.NoGeometry)
+        for feat in self.layer.getFeatures(request):
+            geom = self.geometries.get(feat.id())
+            if geom is not None:
+                feat.setGeometry(QgsGeometry(geom))
+                yield feat
+
+    def get_index(self):
+        """Return a QgsSpatialIndex of the geometries in the store."""
+        index = QgsSpatialIndex()
+        for fid, geom in self.geometries.items():
+            index.addFeature(fid, geom.boundingBox())
+        return index
+
+    def flush(self):
+        """Write the pending changes to the layer."""
+        to_change = {}
+        for fid in self.dirty:
+            to_change[fid] = self.geometries[fid]
+            if len(to_change) > BUFFER_SIZE:
+                self.layer.writer.changeGeometryValues(to_change)
+                to_change = {}
+        if to_change:
+            self.layer.writer.changeGeometryValues(to_change)
+        if self.deleted:
+            self.layer.writer.deleteFeatures(list(self.deleted))
+        self.dirty = set()
+        self.deleted = set()
@@ -0,0 +1,188 @@
+"""Read and rewrite the coordinates of WKB geometries in bulk."""
+import struct
+import sys
+from array import array
+
+LITTLE_ENDIAN = sys.byteorder == "little"
+POINT, LINESTRING, POLYGON = 1, 2, 3
+MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, COLLECTION = 4, 5, 6, 7
+
+
+def get_dimension(wkb_type):
+    """Return the base type and number of ordinates for an ISO WKB type code."""
+    base = wkb_type % 1000
+    flags = wkb_type // 1000
+    if wkb_type & 0x80000000 or wkb_type & 0x40000000:  # EWKB Z/M flags
+        base = wkb_type & 0xFF
+        flags = (1 if wkb_type & 0x80000000 else 0) + (
+            2 if wkb_type & 0x40000000 else 0
+        )
+    return base, 2 + (1 if flags in (1, 2) else 2 if flags == 3 else 0)
+
+
+def get_blocks(wkb, offset=0, blocks=None):
+    """
+    Locate the coordinate sequences of a WKB geometry.
+
+    Args:
+        wkb (bytes): Well-known binary geometry
+        offset (int): Start position of the geometry in wkb
+        blocks (list): Accumulator for the result
+
+    Returns:
+        (list, int) List of (offset, vertex count, dimension, little endian)
+        tuples for each sequence of coordinates, and the offset where the
+        geometry ends.
+    """
+    blocks = [] if blocks is None else blocks
+    little = wkb[offset] == 1
+    uint = "<I" if little else ">I"
+    (wkb_type,) = struct.unpack_from(uint, wkb, offset + 1)
+    base, dim = get_dimension(wkb_type)
+    offset += 5
+    if base == POINT:
+        blocks.append((offset, 1, dim, little))
+        offset += 8 * dim
+    elif base == LINESTRING:
+        (count,) = struct.unpack_from(uint, wkb, offset)
+        blocks.append((offset + 4, count, dim, little))
+        offset += 4 + 8 * dim * count
+    elif base == POLYGON:
+        (rings,) = struct.unpack_from(uint, wkb, offset)
+        offset += 4
+        for __ in range(rings):
+            (count,) = struct.unpack_from(uint, wkb, offset)
+            blocks.append((offset + 4, count, dim, little))
+            offset += 4 + 8 * dim * count
+    elif base in (MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, COLLECTION):
+        (parts,) = struct.unpack_from(uint, wkb, offset)
+        offset += 4
+        for __ in range(parts):
+            __, offset = get_blocks(wkb, offset, blocks)
+    else:
+        raise TypeError("Unsupported WKB geometry type: %d" % wkb_type)
+    return blocks, offset
+
+
+def _read_block(wkb, block):
+    offset, count, dim, little = block
+    values = array("d", wkb[offset : offset + 8 * dim * count])
+    if little != LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def get_polygons(wkb):
+    """
+    Read the rings of a WKB polygon or multipolygon.
+
+    Args:
+        wkb (bytes): Well-known binary geometry
+
+    Returns:
+        (list) Polygons as lists of rings, each ring a list of (x, y) tuples.
+    """
+    little = wkb[0] == 1
+    uint = "<I" if little else ">I"
+    (wkb_type,) = struct.unpack_from(uint, wkb, 1)
+    base = get_dimension(wkb_type)[0]
+    if base == POLYGON:
+        parts = [get_blocks(wkb)[0]]
+    elif base == MULTIPOLYGON:
+        (count,) = struct.unpack_from(uint, wkb, 5)
+        offset = 9
+        parts = []
+        for __ in range(count):
+            blocks, offset = get_blocks(wkb, offset)
+            parts.append(blocks)
+    else:
+        raise TypeError("Unsupported WKB geometry type: %d" % wkb_type)
+    polygons = []
+    for blocks in parts:
+        rings = []
+        for block in blocks:
+            values = _read_block(wkb, block)
+            dim = block[2]
+            rings.append(list(zip(values[0::dim], values[1::dim])))
+        polygons.append(rings)
+    return polygons
+
+
+def get_coords(wkbs):
+    """
+    Extract the coordinates of a list of WKB geometries.
+
+    Args:
+        wkbs (list): WKB geometries (bytes)
+
+    Returns:
+        (array, array, list) X and Y coordinates of all the vertices in order,
+        and the coordinate blocks of each geometry (see get_blocks) needed to
+        write them back with set_coords.
+    """
+    xs = array("d")
+    ys = array("d")
+    layout = []
+    for wkb in wkbs:
+        blocks = get_blocks(wkb)[0]
+        for block in blocks:
+            values = _read_block(wkb, block)
+            dim = block[2]
+            xs.extend(values[0::dim])
+            ys.extend(values[1::dim])
+        layout.append(blocks)
+    return xs, ys, layout
+
+
+def set_coords(wkbs, layout, xs, ys):
+    """
+    Replace the X and Y coordinates of a list of WKB geometries.
+
+    Args:
+        wkbs (list): WKB geometries (bytes)
+        layout (list): Coordinate blocks returned by get_coords
+        xs (sequence): New X coordinates in the order of get_coords
+        ys (sequence): New Y coordinates in the order of get_coords
+
+    Returns:
+        (list) New WKB geometries
+    """
+    result = []
+    i = 0
+    for wkb, blocks in zip(wkbs, layout):
+        out = bytearray(wkb)
+        for block in blocks:
+            offset, count, dim, little = block
+            values = _read_block(wkb, block)
+            values[0::dim] = array("d", xs[i : i + count])
+            values[1::dim] = array("d", ys[i : i + count])
+            if little != LITTLE_ENDIAN:
+                values.byteswap()
+            out[offset : offset + 8 * dim * count] = values.tobytes()
+            i += count
+        result.append(bytes(out))
+    return result
+
+
+def from_multipolygon(polygons):
+    """
+    Build a WKB multipolygon from coordinates.
+
+    Args:
+        polygons (list): Polygons as lists of rings, each ring a sequence of
+            (x, y) tuples.
+
+    Returns:
+        (bytes) Little endian WKB geometry
+    """
+    header = struct.Struct("<BII")
+    out = bytearray(header.pack(1, MULTIPOLYGON, len(polygons)))
+    for rings in polygons:
+        out += header.pack(1, POLYGON, len(rings))
+        for ring in rings:
+            coords = array("d", [c for point in ring for c in point[:2]])
+            if not LITTLE_ENDIAN:
+                coords.byteswap()
+            out += struct.pack("<I", len(ring))
+            out += coords.tobytes()
+    return bytes(out)
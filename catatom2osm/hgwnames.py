@@ -1,30 +1,62 @@
 """Parsing of highway names."""
 import re
+from functools import lru_cache
 
-from fuzzywuzzy import fuzz, process
+from fuzzywuzzy import fuzz, process, utils
 
 from catatom2osm import config
 
+try:
+    from rapidfuzz import fuzz as rfuzz
+    from rapidfuzz import process as rprocess
+except ImportError:
+    rfuzz = None
+
 MATCH_THR = 60
+PARSE_CACHE_SIZE = 65536
+
+comments_re = re.compile(r" *\(.*\)")
+commas_re = re.compile(r"[,]+")
+spaces_re = re.compile(r"[ ]+")
+enclosing_re = re.compile(r"^\(|\)$")
+
+lowcase_words = frozenset()
+highway_types = {}
+excluded_types = frozenset()
+
+
+def update_tables():
+    """
+    Read the word tables used by parse from config.
+
+    Must be called after any change of config.lowcase_words,
+    config.highway_types or config.excluded_types.
+    """
+    global lowcase_words, highway_types, excluded_types
+    lowcase_words = frozenset(config.lowcase_words)
+    highway_types = dict(config.highway_types)
+    excluded_types = frozenset(config.excluded_types)
+    parse.cache_clear()
 
 
 def normalize(text):
-    return re.sub(r" *\(.*\)", "", text.lower().strip())
+    return comments_re.sub("", text.lower().strip())
 
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
 def parse(name):
     """Transform the name of a street from Cadastre conventions to OSM ones."""
     name = name.split(";")[0]  # Remove additional information
-    name = re.sub(r"[,]+", ", ", name).strip()  # Avoids comma without trailing space
+    name = commas_re.sub(", ", name).strip()  # Avoids comma without trailing space
     result = []
-    for (i, word) in enumerate(re.split(r"[ ]+", name.strip())):
-        nude_word = re.sub(r"^\(|\)$", "", word)  # Remove enclosing parenthesis
+    for (i, word) in enumerate(spaces_re.split(name.strip())):
+        nude_word = enclosing_re.sub("", word)  # Remove enclosing parenthesis
         if i == 0:
-            if word in config.excluded_types:
+            if word in excluded_types:
                 return ""
             else:
-                new_word = config.highway_types.get(word, word.title())
-        elif nude_word in config.lowcase_words:  # Articles
+                new_word = highway_types.get(word, word.title())
+        elif nude_word in lowcase_words:  # Articles
             new_word = word.lower()
         elif "'" in word[1:-1]:  # Articles with aphostrope
             left = word.split("'")[0]
@@ -43,6 +75,9 @@ def parse(name):
     return " ".join(result).strip()
 
 
+update_tables()
+
+
 def match(name, choices):
     """
     Fuzzy search best match for string name in iterable choices.
@@ -67,6 +102,130 @@ def match(name, choices):
     return parsed_name
 
 
+def get_key(text, query=False):
+    """Return the string compared by the token sort ratio for a name."""
+    # Same steps as process.extractOne(..., scorer=fuzz.token_sort_ratio),
+    # the query is processed once more than the choices
+    text = normalize(text)
+    if query:
+        text = utils.full_process(text)
+    text = utils.full_process(text, force_ascii=True)
+    return " ".join(sorted(text.split()))
+
+
+class Matcher(object):
+    """
+    Fuzzy search of many street names in a set of highway names.
+
+    Gives the same results as match, but each choice is normalized once and
+    choices with the same comparison key are scored once. Uses RapidFuzz
+    as scorer if it is installed.
+    """
+
+    def __init__(self, choices=None):
+        """Prepare choices (iterable of highway names) for matching."""
+        self.choices = []  # First choice for each key
+        self.keys = []
+        self.positions = {}  # Position in keys by choice
+        self.key_positions = {}  # Position in keys by key
+        for choice in choices or []:
+            self.add(choice)
+
+    def add(self, choice):
+        """Add a choice and return the position of its key."""
+        pos = self.positions.get(choice)
+        if pos is None:
+            key = get_key(choice)
+            pos = self.key_positions.get(key)
+            if pos is None:
+                pos = len(self.keys)
+                self.key_positions[key] = pos
+                self.choices.append(choice)
+                self.keys.append(key)
+            self.positions[choice] = pos
+        return pos
+
+    def get_candidates(self, choices):
+        """
+        Return the positions of the distinct keys of choices in order.
+
+        Returns:
+            (list, list) Positions and first choice of choices for each key.
+        """
+        candidates = []
+        firsts = []
+        seen = set()
+        for choice in choices:
+            pos = self.add(choice)
+            if pos not in seen:
+                seen.add(pos)
+                candidates.append(pos)
+                firsts.append(choice)
+        return candidates, firsts
+
+    def get_best(self, query, candidates):
+        """Return the index in candidates of the first best key above MATCH_THR."""
+        keys = [self.keys[pos] for pos in candidates]
+        if rfuzz is not None:
+            best = rprocess.extractOne(query, keys, scorer=rfuzz.ratio, processor=None)
+            if best is None or utils.intr(best[1]) <= MATCH_THR:
+                return None
+            # Ties are resolved by the rounded score like in fuzzywuzzy
+            score = utils.intr(best[1])
+            ties = rprocess.extract(
+                query,
+                keys,
+                scorer=rfuzz.ratio,
+                processor=None,
+                limit=None,
+                score_cutoff=score - 0.5,
+            )
+            i = min(i for __, s, i in ties if utils.intr(s) == score)
+            return i
+        best = None
+        max_score = MATCH_THR
+        for i, key in enumerate(keys):
+            score = fuzz.ratio(query, key)
+            if score > max_score:
+                best = i
+                max_score = score
+        return best
+
+    def match(self, name, choices=None):
+        """
+        Fuzzy search best match for string name in choices.
+
+        If the result is not good enough returns the name parsed.
+
+        Args:
+            name (str): String to look for
+            choices (list): Iterable with choices, all the choices of the
+                matcher if None.
+        """
+        parsed_name = parse(name)
+        if fuzz and parsed_name:
+            if choices is None:
+                candidates, firsts = range(len(self.keys)), self.choices
+            else:
+                candidates, firsts = self.get_candidates(choices)
+            i = self.get_best(get_key(parsed_name, True), candidates)
+            if i is not None:
+                return firsts[i]
+        return parsed_name
+
+    def match_all(self, names):
+        """
+        Fuzzy search a batch of names.
+
+        Args:
+            names (dict): Iterable of choices (or None for all) by name.
+
+        Returns:
+            (dict) Best match for each name.
+        """
+        return {name: self.match(name, choices) for name, choices in names.items()}
+
+
 def dsmatch(name, dataset, fn):
     """
     Fuzzy search best matching object for string name in dataset.
@@ -17,6 +17,7 @@ class Osm(object):
         self.parents = defaultdict(set)
         self.elements = set()
         self.index = {}  # elements by id
+        self.coords = defaultdict(list)  # nodes by (x, y)
         self.tags = {}
         self.note = None
         self.meta = None
@@ -56,11 +57,40 @@ class Osm(object):
             eid = etype[0].lower() + eid
         return self.index[eid]
 
+    def add_node(self, n):
+        """Add n to the coordinates index."""
+        nodes = self.coords[(n.x, n.y)]
+        if not any(o is n for o in nodes):
+            nodes.append(n)
+
+    def remove_node(self, n):
+        """Remove n from the coordinates index."""
+        nodes = self.coords.get((n.x, n.y), [])
+        nodes[:] = [o for o in nodes if o is not n]
+        if not nodes:
+            self.coords.pop((n.x, n.y), None)
+
+    def find_node(self, x, y, parents=None):
+        """
+        Return the first node created in the given position or None.
+
+        Args:
+            x (float): Longitude
+            y (float): Latitude
+            parents (set): If provided, only nodes of any of these elements.
+        """
+        for n in self.coords.get((x, y), []):
+            if parents is None or not parents.isdisjoint(self.parents.get(n, ())):
+                return n
+        return None
+
     def remove(self, el):
         """Remove el from element, from its parents and its orphaned children."""
         self.elements.discard(el)
         if el.fid in self.index:
             del self.index[el.fid]
+        if isinstance(el, Node):
+            self.remove_node(el)
         for parent in frozenset(self.parents[el]):
             parent.remove(el)
         for child in el.childs:
@@ -81,6 +111,9 @@ class Osm(object):
         n2.container = self
         self.elements.add(n2)
         self.index[n2.fid] = n2
+        if isinstance(n1, Node):
+            self.remove_node(n1)
+            self.add_node(n2)
         self.parents[n2] = self.parents[n1]
         del self.parents[n1]
 
@@ -270,6 +303,7 @@ class Node(Element):
             self.x = round(self.x, COOR_DIGITS)
             self.y = round(self.y, COOR_DIGITS)
         self._attr_list = self._attr_list + ("lon", "lat")
+        container.add_node(self)
 
     def __getitem__(self, key):
         """Commodity getter. n[0], n[1] is equivalent to n.x, n.y."""
@@ -0,0 +1,241 @@
+"""Compact OpenStreetMap data model of new elements for export."""
+from collections import defaultdict
+
+from catatom2osm import osm
+
+
+class Element(object):
+    """Base class for compact elements."""
+
+    __slots__ = ("id", "tags")
+
+    def __init__(self, container, tags={}):
+        container.counter -= 1
+        self.id = container.counter
+        self.tags = dict(tags)
+
+    @property
+    def type(self):
+        """Return class name as string."""
+        return self.__class__.__name__.lower()
+
+    @property
+    def attrs(self):
+        """Return the element attributes as a dictionary."""
+        return {"id": str(self.id), "action": "modify", "visible": "true"}
+
+
+class Node(Element):
+    """Define a node as a pair of coordinates."""
+
+    __slots__ = ("x", "y")
+
+    def __init__(self, container, x, y=0, tags={}):
+        super(Node, self).__init__(container, tags)
+        (self.x, self.y) = (x[0], x[1]) if hasattr(x, "__getitem__") else (x, y)
+        if osm.COOR_DIGITS:
+            self.x = round(self.x, osm.COOR_DIGITS)
+            self.y = round(self.y, osm.COOR_DIGITS)
+        container.nodes.append(self)
+
+    @property
+    def attrs(self):
+        attrs = super(Node, self).attrs
+        attrs["lon"] = str(self.x)
+        attrs["lat"] = str(self.y)
+        return attrs
+
+    def geometry(self):
+        """Return pair of coordinates."""
+        return (self.x, self.y)
+
+
+class Way(Element):
+    """Define a way as a list of nodes."""
+
+    __slots__ = ("nodes",)
+
+    def __init__(self, container, nodes=[], tags={}):
+        super(Way, self).__init__(container, tags)
+        self.nodes = [n if isinstance(n, Node) else Node(container, n) for n in nodes]
+        container.ways.append(self)
+
+    def is_closed(self):
+        """Return true if the way is closed."""
+        return len(self.nodes) > 2 and self.nodes[0] is self.nodes[-1]
+
+    def shoelace(self):
+        """Return the area for a closed way or 0, + for CCW nodes, - for CW."""
+        s = 0
+        if self.is_closed():
+            for n1, n2 in zip(self.nodes, self.nodes[1:]):
+                s += n1.x * n2.y - n2.x * n1.y
+        return s
+
+    def geometry(self):
+        """Return tuple of coordinates, closed rings normalized like osm.Way."""
+        g = tuple(n.geometry() for n in self.nodes)
+        if self.is_closed():
+            i = g.index(min(g))
+            g = g[i:] + g[1 : i + 1]
+            if self.shoelace() < 0:
+                g = g[::-1]
+        return g
+
+
+class Relation(Element):
+    """A relation is a collection of nodes, ways or relations with a role."""
+
+    __slots__ = ("members",)
+
+    def __init__(self, container, members=[], tags={}):
+        super(Relation, self).__init__(container, tags)
+        self.members = list(members)
+        container.relations.append(self)
+
+    def geometry(self):
+        """Return tuple of members."""
+        return tuple((m.type, id(m.element), m.role) for m in self.members)
+
+    class Member(object):
+        """An element is member of a relation with a role."""
+
+        __slots__ = ("element", "role")
+
+        def __init__(self, element, role=None):
+            self.element = element
+            self.role = role
+
+        @property
+        def type(self):
+            if isinstance(self.element, Node):
+                return "node"
+            elif isinstance(self.element, Way):
+                return "way"
+            return "relation"
+
+        @property
+        def ref(self):
+            return self.element.id
+
+        @property
+        def attrs(self):
+            attrs = dict(type=self.type, ref=str(self.ref))
+            if self.role is not None:
+                attrs["role"] = self.role
+            return attrs
+
+
+class Polygon(Relation):
+    """Helper to create a multipolygon type relation with only one outer ring."""
+
+    __slots__ = ()
+
+    def __init__(self, container, rings=[], tags={}):
+        super(Polygon, self).__init__(container, tags=tags)
+        self.tags["type"] = "multipolygon"
+        self.append_rings(container, rings)
+
+    def append_rings(self, container, rings):
+        role = "outer"
+        for ring in rings:
+            way = ring if isinstance(ring, Way) else Way(container, ring)
+            self.members.append(Relation.Member(way, role))
+            role = "inner"
+
+
+class MultiPolygon(Polygon):
+    """Helper to create a multipolygon type relation."""
+
+    __slots__ = ()
+
+    def __init__(self, container, parts=[], tags={}):
+        super(MultiPolygon, self).__init__(container, tags=tags)
+        for rings in parts:
+            self.append_rings(container, rings)
+
+
+class Osm(object):
+    """
+    OSM data set of new elements in plain lists.
+
+    Implements the part of osm.Osm used to export a layer (see
+    BaseLayer.to_osm), write it (osmxml.serialize) and collect the report
+    statistics. Elements can't be removed and their parents aren't tracked,
+    so it uses much less memory and time than the full model.
+    """
+
+    def __init__(self, upload="never", generator=None):
+        self.upload = upload
+        self.version = "0.6"
+        self.generator = generator
+        self.counter = 0
+        self.nodes = []
+        self.ways = []
+        self.relations = []
+        self.tags = {}
+        self.note = None
+        self.meta = None
+        self._attr_list = ("upload", "version", "generator")
+
+    attrs = osm.Osm.attrs
+
+    @property
+    def elements(self):
+        """Return list of all the elements."""
+        return self.nodes + self.ways + self.relations
+
+    def __getattr__(self, name):
+        """Help to create elements (see osm.Osm)."""
+        if name in ["Node", "Way", "Relation", "Polygon", "MultiPolygon"]:
+            cls = globals()[name]
+            return lambda *args, **kwargs: cls(self, *args, **kwargs)
+        raise AttributeError(name)
+
+    @staticmethod
+    def get_merged(elements):
+        """
+        Find duplicated elements like osm.Osm.merge_duplicated.
+
+        Among the elements with the same geometry, the first one with some
+        tags is kept and the next ones with the same tags are merged into it.
+        Elements without tags are merged into the first one with tags, or
+        into the last one if none has tags.
+
+        Returns:
+            (list) Remaining elements, (dict) remaining element for each merged
+            element id.
+        """
+        geomdupes = defaultdict(list)
+        for el in elements:
+            geomdupes[el.geometry()].append(el)
+        replaced = {}
+        for dupes in geomdupes.values():
+            if len(dupes) > 1:
+                targets = {}
+                for el in dupes:
+                    if el.tags:
+                        key = tuple(sorted(el.tags.items()))
+                        target = targets.setdefault(key, el)
+                        if target is not el:
+                            replaced[id(el)] = target
+                target = next((el for el in dupes if el.tags), dupes[-1])
+                for el in dupes:
+                    if el is not target and not el.tags:
+                        replaced[id(el)] = target
+        remaining = [el for el in elements if id(el) not in replaced]
+        return remaining, replaced
+
+    def merge_duplicated(self):
+        """Merge elements with the same geometry."""
+        self.nodes, replaced = self.get_merged(self.nodes)
+        for way in self.ways:
+            nodes = [replaced.get(id(n), n) for n in way.nodes]
+            way.nodes = [
+                n for i, n in enumerate(nodes) if i == 0 or n is not nodes[i - 1]
+            ]
+        self.ways, replaced = self.get_merged(self.ways)
+        for rel in self.relations:
+            for m in rel.members:
+                m.element = replaced.get(id(m.element), m.element)
+        self.relations, replaced = self.get_merged(self.relations)
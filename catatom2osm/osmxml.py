@@ -57,14 +57,23 @@ def serialize(outfile, data):
 
 
 def deserialize(infile, data=None):
-    """Generate a OSM data set from OSM XML or append to existing data."""
+    """
+    Generate a OSM data set from OSM XML or append to existing data.
+
+    Elements with an id already present in data are skipped, so the responses
+    of overlapping queries could be merged without duplicates.
+    """
     if data is None:
         data = osm.Osm()
     context = etree.iterparse(infile, events=("end",))
     childs = []
     tags = {}
     for event, elem in context:
-        if elem.tag == "osm":
+        is_element = elem.tag in ("node", "way", "relation")
+        if is_element and elem.tag[0] + str(elem.get("id")) in data.index:
+            childs = []
+            tags = {}
+        elif elem.tag == "osm":
             data.upload = elem.get("upload")
             data.version = elem.get("version")
             data.generator = elem.get("generator")
@@ -1,7 +1,15 @@
 """Minimum Overpass API interface."""
+import copy
+import hashlib
+import io
+import math
+import os
 import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from catatom2osm import download
+from catatom2osm import config, download, osm, osmxml
 from catatom2osm.exceptions import CatIOError
 
 api_servers = [
@@ -9,11 +17,56 @@ api_servers = [
     "http://overpass.osm.rambler.ru/cgi/interpreter?",
 ]
 
+statement_re = re.compile(r"^(node|way|relation|nwr|nw|nr|wr)((\[[^\]]*\])*)$")
+filter_re = re.compile(r'\[(!?)(~?)"([^"]*)"(?:(!?[=~])"([^"]*)")?\]')
+
+
+class Cache(object):
+    """On disk cache of Overpass responses."""
+
+    def __init__(self, path, ttl=None):
+        """
+        Construct a cache.
+
+        Args:
+            path (str): Directory where the responses are stored
+            ttl (int): Seconds to reuse a response. Defaults to
+                config.overpass_cache_ttl. 0 disables the cache.
+        """
+        self.path = path
+        self.ttl = config.overpass_cache_ttl if ttl is None else ttl
+
+    def get_filename(self, key):
+        return os.path.join(self.path, key + ".osm")
+
+    def get(self, key):
+        """Return the cached file name for key or None if missing or expired."""
+        if self.ttl <= 0:
+            return None
+        fn = self.get_filename(key)
+        if os.path.exists(fn) and time.time() - os.path.getmtime(fn) < self.ttl:
+            return fn
+        return None
+
+    def put(self, key, filename=None, content=None):
+        """Store the content or a copy of filename as the response for key."""
+        if self.ttl <= 0:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        fn = self.get_filename(key)
+        if filename is not None:
+            if os.path.exists(filename):
+                shutil.copyfile(filename, fn)
+        else:
+            with open(fn, "wb") as fo:
+                fo.write(content)
+
 
 class Query(object):
     """Class for a query to Overpass."""
 
-    def __init__(self, search_area, output="xml", down=True, meta=True):
+    def __init__(self, search_area, output="xml", down=True, meta=True, cache=None):
         """
         Construct a query.
 
@@ -22,6 +75,7 @@ class Query(object):
             output (str): xml (default) / json
             down (bool): True (default) to include recurse down elements
             meta (bool): True (default) to include metadata
+            cache (Cache): Optional cache of responses
         """
         self.output = output
         self.down = "(._;>>;);" if down else ""
@@ -31,6 +85,7 @@ class Query(object):
         self.set_search_area(search_area)
         self.statements = []
         self.url = ""
+        self.cache = cache
 
     def set_search_area(self, search_area):
         """
@@ -81,19 +136,195 @@ class Query(object):
             )
         return self.url
 
+    def get_key(self):
+        """Return a key for the query independent of statements order and server."""
+        statements = sorted(set(re.sub(r"\s+", "", st) for st in self.statements))
+        query = "|".join(
+            [
+                self.area_id,
+                re.sub(r"\s+", "", self.bbox),
+                self.output,
+                self.down,
+                self.meta,
+            ]
+            + statements
+        )
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
     def download(self, filename, log=False):
         """Download query results to filename."""
+        key = self.get_key()
+        cached = self.cache.get(key) if self.cache else None
+        if cached:
+            if log:
+                log.debug(_("Using cached response for '%s'"), self.get_url())
+            shutil.copyfile(cached, filename)
+            return
         for i in range(len(api_servers)):
             try:
                 if log:
                     log.debug(self.get_url(i))
                 download.wget(self.get_url(i), filename)
+                if self.cache:
+                    self.cache.put(key, filename=filename)
                 return
             except IOError:
                 pass
-        raise CatIOError("Can't read from any Overpass server'")
+        raise CatIOError("Can't read from any Overpass server")
 
     def read(self):
         """Return query results."""
-        response = download.get_response(self.get_url())
-        return response.text.encode(response.apparent_encoding)
+        key = self.get_key()
+        cached = self.cache.get(key) if self.cache else None
+        if cached:
+            with open(cached, "rb") as fo:
+                return fo.read()
+        for i in range(len(api_servers)):
+            try:
+                response = download.get_response(self.get_url(i))
+                content = response.text.encode(response.apparent_encoding)
+                if self.cache:
+                    self.cache.put(key, content=content)
+                return content
+            except IOError:
+                pass
+        raise CatIOError("Can't read from any Overpass server")
+
+    def get_tiles(self, size, bbox=None):
+        """
+        Return a copy of this query for each tile of the search area.
+
+        Args:
+            size (float): Size of the tiles in degrees
+            bbox (str): Bounding box clause covering the search area.
+                Defaults to the query bounding box. If the query has an area id,
+                each tile is also filtered by the area.
+        """
+        tiles = []
+        for tile_bbox in get_tiles(bbox or self.bbox, size):
+            tile = copy.copy(self)
+            tile.bbox = tile_bbox
+            tile.url = ""
+            tiles.append(tile)
+        return tiles
+
+    def read_tiles(self, size, bbox=None, workers=None):
+        """
+        Read query results splitting the search area in tiles.
+
+        The tiles are fetched concurrently and merged into a single data set
+        without duplicated elements.
+
+        Args:
+            size (float): Size of the tiles in degrees
+            bbox (str): See get_tiles
+            workers (int): Maximum number of concurrent requests. Defaults to
+                config.overpass_workers
+
+        Returns:
+            Osm: OSM data set
+        """
+        workers = workers or config.overpass_workers
+        tiles = self.get_tiles(size, bbox)
+        data = osm.Osm()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for content in executor.map(lambda q: q.read(), tiles):
+                with io.BytesIO(content) as fo:
+                    osmxml.deserialize(fo, data)
+        return data
+
+
+def get_tiles(bbox, size):
+    """
+    Split a bounding box clause in tiles.
+
+    Args:
+        bbox (str): Bounding box clause (bottom, left, top, right)
+        size (float): Maximum size of the tiles in degrees
+
+    Returns:
+        (list) Bounding box clauses of the tiles
+    """
+    (bottom, left, top, right) = [float(c) for c in bbox.split(",")]
+    nx = max(1, int(math.ceil(round((right - left) / size, 8))))
+    ny = max(1, int(math.ceil(round((top - bottom) / size, 8))))
+    if nx * ny == 1:
+        return [bbox]
+    dx = (right - left) / nx
+    dy = (top - bottom) / ny
+    tiles = []
+    for j in range(ny):
+        for i in range(nx):
+            tile = [
+                bottom + j * dy,
+                left + i * dx,
+                top if j == ny - 1 else bottom + (j + 1) * dy,
+                right if i == nx - 1 else left + (i + 1) * dx,
+            ]
+            tiles.append("{:.8f},{:.8f},{:.8f},{:.8f}".format(*tile))
+    return tiles
+
+
+def match(statement, element):
+    """
+    Test if an OSM element would be selected by a query statement.
+
+    Supports the type and tag filters used in the application queries, that is
+    the element types node, way, relation, nwr, nw, nr, wr and the filters
+    ["k"], [!"k"], ["k"="v"], ["k"!="v"], ["k"~"v"], ["k"!~"v"] and [~"k"~"v"].
+    """
+    m = statement_re.match(re.sub(r"\s+", "", statement))
+    if not m:
+        raise TypeError("Unsupported statement: %s" % statement)
+    etype = m.group(1)
+    if etype in ("node", "way", "relation"):
+        if element.type != etype:
+            return False
+    elif element.type[0] not in etype:
+        return False
+    for (neg, regex_key, key, op, value) in filter_re.findall(m.group(2)):
+        if regex_key:
+            keys = [k for k in element.tags.keys() if re.search(key, k)]
+            if not any(re.search(value, element.tags[k]) for k in keys):
+                return False
+        elif not op:
+            if (key in element.tags) == bool(neg):
+                return False
+        elif key not in element.tags:
+            if not op.startswith("!"):
+                return False
+        elif op == "=" and element.tags[key] != value:
+            return False
+        elif op == "!=" and element.tags[key] == value:
+            return False
+        elif op == "~" and not re.search(value, element.tags[key]):
+            return False
+        elif op == "!~" and re.search(value, element.tags[key]):
+            return False
+    return True
+
+
+def partition(data, queries):
+    """
+    Split the response of a combined query in the data sets of its queries.
+
+    Args:
+        data (Osm): Response for the union of all the statements in queries.
+        queries (dict): Name of each data set and its list of statements.
+
+    Returns:
+        (dict) Name of each data set and its Osm data set, including the
+        elements matching any of its statements and their descendants.
+    """
+    result = {}
+    for name, statements in queries.items():
+        if isinstance(statements, str):
+            statements = statements.split(";")
+        statements = [st for st in statements if st.strip()]
+        subset = osm.Osm(upload=data.upload, generator=data.generator)
+        subset.version = data.version
+        subset.note = data.note
+        subset.meta = data.meta
+        subset.append(data, lambda e: any(match(st, e) for st in statements))
+        result[name] = subset
+    return result
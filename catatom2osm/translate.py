@@ -1,6 +1,4 @@
 """Translations from source fields to OSM tags."""
-import json
-
 from catatom2osm import config
 
 
@@ -39,48 +37,99 @@ def address_tags(feature):
     return tags
 
 
-def building_tags(feature):
-    """Translate constructions layer fields."""
-    building_key = {
-        "functional": "building",
-        "declined": "disused:building",
-        "ruin": "abandoned:building",
-    }
-    get_building_key = lambda feat: building_key.get(feat["condition"], "building")
-    translations = {
-        "condition": {
-            "declined": '{"building": "yes"}',
-            "ruin": '{"building": "ruins"}',
-        },
-        "currentUse": {
-            "1_residential": '{"%s": "residential"}' % get_building_key(feature),
-            "2_agriculture": '{"%s": "barn"}' % get_building_key(feature),
-            "3_industrial": '{"%s": "industrial"}' % get_building_key(feature),
-            "4_1_office": '{"%s": "office"}' % get_building_key(feature),
-            "4_2_retail": '{"%s": "retail"}' % get_building_key(feature),
-            "4_3_publicServices": '{"%s": "public"}' % get_building_key(feature),
-        },
-        "nature": {"openAirPool": '{"leisure": "swimming_pool"}'},
-    }
+# Constructions layer fields used by building_tags in order
+BUILDING_FIELDS = (
+    "localId",
+    "condition",
+    "currentUse",
+    "nature",
+    "lev_above",
+    "lev_below",
+    "layer",
+    "fixme",
+)
+building_key = {
+    "functional": "building",
+    "declined": "disused:building",
+    "ruin": "abandoned:building",
+}
+condition_tags = {
+    "declined": {"building": "yes"},
+    "ruin": {"building": "ruins"},
+}
+current_use_values = {
+    "1_residential": "residential",
+    "2_agriculture": "barn",
+    "3_industrial": "industrial",
+    "4_1_office": "office",
+    "4_2_retail": "retail",
+    "4_3_publicServices": "public",
+}
+# Tags for each (condition, currentUse)
+current_use_tags = {
+    (condition, use): {building_key.get(condition, "building"): value}
+    for condition in list(building_key.keys()) + [None]
+    for use, value in current_use_values.items()
+}
+nature_tags = {"openAirPool": {"leisure": "swimming_pool"}}
+
+
+def get_building_tags(
+    localid, condition, use, nature, lev_above, lev_below, layer, fixme
+):
+    """Translate the values of BUILDING_FIELDS of a construction to tags."""
     tags = {}
-    if "_" not in feature["localId"]:
+    if "_" not in localid:
         tags["building"] = "yes"
-        tags["ref"] = feature["localId"]
-    for field, action in list(translations.items()):
-        for value, new_tags in list(action.items()):
-            if feature[field] == value:
-                tags.update(json.loads(new_tags))
-    if feature["condition"] == "ruin" and feature["currentUse"] == None:  # NOQA
+        tags["ref"] = localid
+    if not isinstance(condition, str) or condition not in building_key:
+        condition = None
+    if condition in condition_tags:
+        tags.update(condition_tags[condition])
+    if isinstance(use, str) and use in current_use_values:
+        tags.update(current_use_tags[(condition, use)])
+    if isinstance(nature, str) and nature in nature_tags:
+        tags.update(nature_tags[nature])
+    if condition == "ruin" and use == None:  # NOQA
         tags["abandoned:building"] = "yes"
-    if "_part" in feature["localId"]:
-        tags["building:part"] = "roof" if feature["lev_above"] == 0 else "yes"
-    if feature["lev_above"]:
-        tags["building:levels"] = str(feature["lev_above"])
-    if feature["lev_below"]:
-        tags["building:levels:underground"] = str(feature["lev_below"])
-    if feature["layer"] == 1:
+    if "_part" in localid:
+        tags["building:part"] = "roof" if lev_above == 0 else "yes"
+    if lev_above:
+        tags["building:levels"] = str(lev_above)
+    if lev_below:
+        tags["building:levels:underground"] = str(lev_below)
+    if layer == 1:
         tags["layer"] = "1"
         tags["location"] = "roof"
-    if feature["fixme"]:
-        tags["fixme"] = feature["fixme"]
+    if fixme:
+        tags["fixme"] = fixme
     return tags
+
+
+def building_tags(feature):
+    """Translate constructions layer fields."""
+    return get_building_tags(*[feature[name] for name in BUILDING_FIELDS])
+
+
+def get_building_translator(fields):
+    """
+    Return a faster building_tags for the features of a layer.
+
+    Args:
+        fields (QgsFields): Fields of the layer.
+
+    Returns:
+        (function) Translation of a feature reading the attributes by index.
+    """
+    indexes = [fields.indexFromName(name) for name in BUILDING_FIELDS]
+
+    def translate(feature):
+        attrs = feature.attributes()
+        return get_building_tags(*[attrs[i] for i in indexes])
+
+    return translate
+
+
+def building_tags_batch(rows):
+    """Translate a list of tuples with the values of BUILDING_FIELDS."""
+    return [get_building_tags(*row) for row in rows]
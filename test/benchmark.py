@@ -0,0 +1,259 @@
+"""
+Benchmarks for the most time consuming processing steps.
+
+Usage: python -m test.benchmark [name ...] [-n size]
+
+Runs the named benchmarks (all by default) over synthetic data sets and
+prints the elapsed time in milliseconds of each variant.
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import mock
+from qgis.core import QgsFeature, QgsField, QgsGeometry, QgsPointXY
+from qgis.PyQt.QtCore import QVariant
+
+from catatom2osm import compress, hgwnames, osmxml
+from catatom2osm.app import QgsSingleton
+from catatom2osm.geo.geometry import Geometry
+from catatom2osm.geo.layer.address import AddressLayer
+from catatom2osm.geo.layer.base import BaseLayer
+from catatom2osm.geo.layer.cons import ConsLayer
+from catatom2osm.geo.layer.polygon import PolygonLayer
+
+qgs = QgsSingleton()
+benchmarks = OrderedDict()
+MS = 1000
+
+
+def benchmark(size):
+    """Register a benchmark function with its default data set size."""
+
+    def decorator(func):
+        benchmarks[func.__name__] = (func, size)
+        return func
+
+    return decorator
+
+
+def timer(label, func, *args, **kwargs):
+    """Run func and print its elapsed time."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print("{:<40} {:>10.0f} ms".format(label, (time.perf_counter() - start) * MS))
+    return result
+
+
+def get_polygons(size, crs="EPSG:25830", vertices=8, layer_class=BaseLayer):
+    """
+    Return a memory layer with size polygons in a regular grid.
+
+    If the layer has a localId field, each group of four consecutive
+    features gets the references of a building and three parts.
+    """
+    layer = layer_class("Polygon?crs=" + crs, "benchmark", "memory")
+    has_id = "localId" in layer.fields().names()
+    side = int(size**0.5) + 1
+    to_add = []
+    for i in range(size):
+        x = 400000 + (i % side) * 20
+        y = 4400000 + (i // side) * 20
+        ring = []
+        for j in range(vertices):
+            a = 2 * math.pi * j / vertices
+            ring.append(QgsPointXY(x + 8 * math.cos(a), y + 8 * math.sin(a)))
+        ring.append(ring[0])
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(QgsGeometry.fromPolygonXY([ring]))
+        if has_id:
+            ref = "%07dAB1234C" % (i // 4)
+            feat["localId"] = ref if i % 4 == 0 else "%s_part%d" % (ref, i % 4)
+        to_add.append(feat)
+    layer.writer.addFeatures(to_add)
+    return layer
+
+
+@benchmark(100000)
+def reproject(size):
+    layer = get_polygons(size)
+    with mock.patch.object(BaseLayer, "get_osr_transform", return_value=None):
+        timer("reproject per feature", layer.reproject)
+    layer = get_polygons(size)
+    timer("reproject batched", layer.reproject)
+
+
+def get_table(size, name, value):
+    """Return a memory table with size rows of gml_id and name = value(row)."""
+    layer = BaseLayer("None", "table", "memory")
+    attrs = [QgsField("gml_id", QVariant.String), QgsField(name, QVariant.String)]
+    layer.writer.addAttributes(attrs)
+    layer.updateFields()
+    to_add = []
+    for i in range(size):
+        feat = QgsFeature(layer.fields())
+        feat.setAttributes(["ID.%d" % i, value(i)])
+        to_add.append(feat)
+    layer.writer.addFeatures(to_add)
+    return layer
+
+
+@benchmark(500000)
+def join_field(size):
+    address = AddressLayer()
+    side = int(size**0.5) + 1
+    to_add = []
+    for i in range(size):
+        feat = QgsFeature(address.fields())
+        feat["localId"] = str(i)
+        feat["TN_id"] = "ID.%d" % (i % (size // 10 + 1))
+        feat["PD_id"] = "ID.%d" % (i % 1000)
+        point = QgsPointXY(400000 + (i % side) * 10, 4400000 + (i // side) * 10)
+        feat.setGeometry(QgsGeometry.fromPointXY(point))
+        to_add.append(feat)
+    address.writer.addFeatures(to_add)
+    thoroughfarename = get_table(size // 10 + 1, "text", lambda i: "Calle %d" % i)
+    postaldescriptor = get_table(1000, "postCode", lambda i: str(38000 + i))
+    timer(
+        "join_field thoroughfarename",
+        address.join_field,
+        thoroughfarename,
+        "TN_id",
+        "gml_id",
+        ["text"],
+        "TN_",
+    )
+    timer(
+        "join_field postaldescriptor",
+        address.join_field,
+        postaldescriptor,
+        "PD_id",
+        "gml_id",
+        ["postCode"],
+    )
+
+
+@benchmark(200000)
+def requests(size):
+    layer = get_polygons(size, layer_class=ConsLayer)
+    timer("read all columns and geometry", lambda: list(layer.getFeatures()))
+    request = layer.get_request(["localId"], geometry=False)
+    timer("read localId only", lambda: list(layer.getFeatures(request)))
+    timer("count", layer.count, unique="localId")
+    timer("remove_parts_wo_building", layer.remove_parts_wo_building)
+
+
+@benchmark(100000)
+def clean(size):
+    for workers in (1, 2, 4, 8):
+        layer = get_polygons(size, vertices=32, layer_class=PolygonLayer)
+        timer("clean with %d workers" % workers, layer.clean, workers)
+
+
+@benchmark(20000)
+def union(size):
+    layer = get_polygons(size, vertices=16)
+    geometries = [QgsGeometry(f.geometry()) for f in layer.getFeatures()]
+    groups = [geometries[i : i + 100] for i in range(0, size, 100)]
+
+    def pairwise(group):
+        geom = group[0]
+        for g in group[1:]:
+            geom = geom.combine(g)
+        return geom
+
+    timer("union pairwise", lambda: [pairwise(group) for group in groups])
+    timer("union cascaded", lambda: [Geometry.union(group) for group in groups])
+    timer("union whole layer", Geometry.union, geometries)
+
+
+@benchmark(50000)
+def to_osm(size):
+    layer = get_polygons(size, crs="EPSG:4326", layer_class=ConsLayer)
+    data = timer("to_osm", layer.to_osm)
+    timer("merge_duplicated", data.merge_duplicated)
+    data = timer("to_osm compact", layer.to_osm, compact=True)
+    timer("merge_duplicated compact", data.merge_duplicated)
+
+
+def get_street_names(size, streets=2000):
+    """Return size Cadastre street names, with repetitions as in addresses."""
+    rnd = random.Random(size)
+    types = ["CL", "AV", "PZ", "CM", "CR", "TR", "PS", "UR", "DS", "LG"]
+    words = (
+        "SAN JOAQUIN MAYOR IGLESIA REAL NUEVA SOL LUNA ROSALIA CASTRO MARCEL.LI "
+        "RUL·LAN BASTIO SANOGUERA ESPAÑA CONSTITUCION MOLINO FUENTE HOYO PAZ ERAS"
+    ).split()
+    articles = ["DE", "DEL", "D'EN", "DE LA", "DE L'", "LES", "EL", "LOS"]
+    names = []
+    for __ in range(streets):
+        name = [rnd.choice(types)] + rnd.sample(words, rnd.randint(1, 3))
+        if rnd.random() < 0.3:
+            name.append("(%s)" % rnd.choice(articles))
+        elif rnd.random() < 0.2:
+            name[-1] += "," + rnd.choice(articles)
+        if rnd.random() < 0.1:
+            name.append("(%s)" % rnd.choice(words))
+        names.append(" ".join(name))
+    return [rnd.choice(names) for __ in range(size)]
+
+
+@benchmark(200000)
+def parse(size):
+    names = get_street_names(size)
+    uncached = hgwnames.parse.__wrapped__
+    timer("parse uncached", lambda: [uncached(name) for name in names])
+    hgwnames.parse.cache_clear()
+    timer("parse cached", lambda: [hgwnames.parse(name) for name in names])
+
+
+@benchmark(200000)
+def write(size):
+    layer = get_polygons(size, crs="EPSG:4326", layer_class=ConsLayer)
+    data = layer.to_osm(compact=True)
+    data.merge_duplicated()
+    path = tempfile.mkdtemp()
+    variants = [("plain", ".osm", 0, 1)]
+    variants += [("gzip level %d" % lv, ".osm.gz", lv, 1) for lv in (1, 6, 9)]
+    variants += [("gzip level 6 %d workers" % w, ".osm.gz", 6, w) for w in (2, 4)]
+    variants += [("xz level %d" % lv, ".osm.xz", lv, 1) for lv in (0, 6)]
+    if compress.zstandard:
+        variants += [("zstd level %d" % lv, ".osm.zst", lv, 1) for lv in (3, 9)]
+
+    def write_osm(filename, level, workers):
+        fo = compress.open_writer(filename, level, workers)
+        osmxml.serialize(fo, data)
+        fo.close()
+
+    try:
+        for label, ext, level, workers in variants:
+            filename = os.path.join(path, "benchmark" + ext)
+            timer("write " + label, write_osm, filename, level, workers)
+            print("{:<40} {:>10.0f} KB".format("", os.path.getsize(filename) / 1024))
+    finally:
+        shutil.rmtree(path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("names", nargs="*", help=", ".join(benchmarks))
+    parser.add_argument("-n", "--size", type=int, help="Data set size")
+    options = parser.parse_args(argv)
+    for name in options.names:
+        if name not in benchmarks:
+            parser.error("unknown benchmark '%s'" % name)
+    for name in options.names or benchmarks:
+        func, size = benchmarks[name]
+        size = options.size or size
+        print("{} ({})".format(name, size))
+        func(size)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
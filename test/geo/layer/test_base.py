@@ -6,6 +6,7 @@ import mock
 from qgis.core import (
     QgsCoordinateReferenceSystem,
     QgsFeature,
+    QgsFeatureRequest,
     QgsField,
     QgsGeometry,
     QgsVectorFileWriter,
@@ -16,6 +17,9 @@ from qgis.PyQt.QtCore import QVariant
 from catatom2osm import config
 from catatom2osm.app import QgsSingleton
 from catatom2osm.geo import BaseLayer
+from catatom2osm.geo.geometry import Geometry
+from catatom2osm.geo.layer.base import LayerWriter
+from catatom2osm.geo.point import Point
 from catatom2osm.geo.types import WKBPoint
 
 qgs = QgsSingleton()
@@ -100,6 +104,23 @@ class TestBaseLayer(unittest.TestCase):
         layer.append(self.fixture, query=declined_filter)
         self.assertEqual(layer.featureCount(), 2)
 
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_append_with_request(self):
+        layer = BaseLayer("Polygon", "test", "memory")
+        request = QgsFeatureRequest().setFilterExpression(
+            "conditionOfConstruction = 'declined'"
+        )
+        layer.append(self.fixture, request=request)
+        self.assertEqual(layer.featureCount(), 2)
+        layer = BaseLayer("Polygon", "test", "memory")
+        query = lambda feat, kwargs: feat["localId"] != kwargs["localid"]
+        declined = next(self.fixture.getFeatures(request))
+        layer.append(
+            self.fixture, query=query, request=request, localid=declined["localId"]
+        )
+        self.assertEqual(layer.featureCount(), 1)
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
     def test_append_void(self):
@@ -201,16 +222,145 @@ class TestBaseLayer(unittest.TestCase):
         self.assertLess(abs(geom_in.area() - geom_out.area()), 1e8)
         self.assertEqual(feature_in.attributes(), feature_out.attributes())
 
+    def test_get_crs_transform(self):
+        crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
+        ct1 = BaseLayer.get_crs_transform(self.fixture.crs(), crs)
+        ct2 = BaseLayer.get_crs_transform(self.fixture.crs(), crs)
+        self.assertIs(ct1, ct2)
+        self.assertEqual(ct1.destinationCrs(), crs)
+        ct3 = BaseLayer.get_crs_transform(crs, self.fixture.crs())
+        self.assertIsNot(ct1, ct3)
+
+    def test_writer_revision(self):
+        revision = self.layer.writer.revision
+        self.layer.writer.addFeatures([QgsFeature(self.layer.fields())])
+        self.assertEqual(self.layer.writer.revision, revision + 1)
+        self.layer.writer.changeAttributeValues({})
+        self.assertEqual(self.layer.writer.revision, revision + 1)
+        self.layer.writer.changeGeometryValues({})
+        self.assertEqual(self.layer.writer.revision, revision + 2)
+        self.layer.writer.deleteFeatures([])
+        self.assertEqual(self.layer.writer.revision, revision + 3)
+        self.assertEqual(self.layer.writer.name(), "ogr")
+
+    def test_get_index_cache(self):
+        layer = BaseLayer("Polygon", "test", "memory")
+        square = "POLYGON(({0} 0, {1} 0, {1} 1, {0} 1, {0} 0))"
+        to_add = []
+        for i in range(8):
+            feat = QgsFeature(layer.fields())
+            feat.setGeometry(QgsGeometry.fromWkt(square.format(i * 2, i * 2 + 1)))
+            to_add.append(feat)
+        layer.writer.addFeatures(to_add)
+        fids = sorted(f.id() for f in layer.getFeatures())
+        index = layer.get_index()
+        self.assertIs(layer.get_index(), index)
+        self.assertEqual(layer.writer.stats, {"rebuilds": 1, "hits": 1})
+        rect = QgsGeometry.fromWkt(square.format(0, 3)).boundingBox()
+        self.assertEqual(sorted(index.intersects(rect)), fids[:2])
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(QgsGeometry.fromWkt(square.format(0.5, 0.7)))
+        __, (feat,) = layer.writer.addFeatures([feat])
+        layer.writer.changeGeometryValues(
+            {fids[1]: QgsGeometry.fromWkt(square.format(10, 11))}
+        )
+        layer.writer.deleteFeatures([fids[0]])
+        index = layer.get_index()
+        self.assertEqual(index.intersects(rect), [feat.id()])
+        self.assertEqual(layer.writer.stats["rebuilds"], 1)
+        self.assertEqual(layer.writer.stats["updates"], 2)
+        layer.startEditing()
+        layer.commitChanges()
+        layer.get_index()
+        self.assertEqual(layer.writer.stats["rebuilds"], 2)
+
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_get_view(self):
+        layer = BaseLayer("Polygon", "test", "memory")
+        layer.append(self.fixture)
+        crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
+        self.assertIsNone(layer.get_cached_view(crs))
+        view = layer.get_view()
+        self.assertIs(layer.get_cached_view(crs), view)
+        self.assertIs(layer.get_view(crs), view)
+        self.assertEqual(len(view), layer.featureCount())
+        crs_transform = layer.get_crs_transform(layer.crs(), crs)
+        for feat in layer.getFeatures():
+            geom = QgsGeometry(feat.geometry())
+            geom.transform(crs_transform)
+            point = view[feat.id()].vertexAt(0)
+            self.assertAlmostEqual(geom.vertexAt(0).x(), point.x(), places=6)
+            self.assertAlmostEqual(geom.vertexAt(0).y(), point.y(), places=6)
+        fid = next(layer.getFeatures()).id()
+        layer.writer.changeGeometryValues({fid: QgsGeometry()})
+        self.assertIsNone(layer.get_cached_view(crs))
+        self.assertIsNot(layer.get_view(), view)
+        view = layer.get_view(layer.crs())
+        self.assertEqual(len(view), layer.featureCount() - 1)
+        self.assertIsNone(layer.get_cached_view(crs))
+        fid = next(fid for fid in view)
+        layer.writer.deleteFeatures([fid])
+        self.assertIsNone(layer.get_cached_view(layer.crs()))
+        view = layer.get_view(layer.crs())
+        self.assertNotIn(fid, view)
+        self.assertEqual(len(view), layer.featureCount() - 1)
+
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_join_field(self):
+        table = BaseLayer("None", "table", "memory")
+        fields = [
+            QgsField("gml_id", QVariant.String),
+            QgsField("text", QVariant.String),
+            QgsField("other", QVariant.Int),
+        ]
+        table.writer.addAttributes(fields)
+        table.updateFields()
+        to_add = []
+        for row in [["x", "foo", 1], ["y", "bar", 2]]:
+            feat = QgsFeature(table.fields())
+            feat.setAttributes(row)
+            to_add.append(feat)
+        table.writer.addFeatures(to_add)
+        to_add = []
+        for key in ["y", "z", "x"]:
+            feat = QgsFeature(self.layer.fields())
+            feat["A"] = key
+            to_add.append(feat)
+        self.layer.writer.addFeatures(to_add)
+        self.layer.join_field(table, "A", "gml_id", ["text"], "T_")
+        self.assertNotIn("T_other", self.layer.fields().names())
+        values = [(f["A"], f["T_text"]) for f in self.layer.getFeatures()]
+        self.assertEqual(values, [("y", "bar"), ("z", None), ("x", "foo")])
+
+    def test_transform_geometries(self):
+        crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
+        geometries = [f.geometry() for f in self.fixture.getFeatures()]
+        osr_transform = BaseLayer.get_osr_transform(self.fixture.crs(), crs)
+        self.assertIsNotNone(osr_transform)
+        result = BaseLayer.transform_geometries(geometries, osr_transform)
+        crs_transform = BaseLayer.get_crs_transform(self.fixture.crs(), crs)
+        for geom, geom_out in zip(geometries, result):
+            geom = QgsGeometry(geom)
+            geom.transform(crs_transform)
+            self.assertEqual(geom.wkbType(), geom_out.wkbType())
+            self.assertEqual(len(geom.asWkb()), len(geom_out.asWkb()))
+            for v1, v2 in zip(geom.vertices(), geom_out.vertices()):
+                self.assertAlmostEqual(v1.x(), v2.x(), places=6)
+                self.assertAlmostEqual(v1.y(), v2.y(), places=6)
+
     @mock.patch("catatom2osm.geo.layer.base.QgsSpatialIndex")
     def test_get_index(self, m_index):
-        layer = mock.MagicMock()
-        layer.test = BaseLayer.get_index
-        layer.featureCount.return_value = 0
-        layer.test(layer)
+        provider = mock.MagicMock()
+        writer = LayerWriter(provider)
+        provider.featureCount.return_value = 0
+        writer.get_index()
         m_index.assert_called_once_with()
-        layer.featureCount.return_value = 1
-        layer.test(layer)
-        m_index.assert_called_with(layer.getFeatures.return_value)
+        writer.clear_index()
+        provider.featureCount.return_value = 1
+        writer.get_index()
+        m_index.assert_called_with(provider.getFeatures.return_value)
 
     def test_to_osm(self):
         data = self.layer.to_osm(upload="always", tags={"comment": "tryit"})
@@ -220,6 +370,69 @@ class TestBaseLayer(unittest.TestCase):
             else:
                 self.assertEqual(data.tags[key], value)
 
+    def test_to_osm_shared_nodes(self):
+        layer = BaseLayer("MultiPolygon?crs=EPSG:4326", "test", "memory")
+        squares = [
+            [
+                [
+                    [
+                        Point(x, 0),
+                        Point(x + 1, 0),
+                        Point(x + 1, 1),
+                        Point(x, 1),
+                        Point(x, 0),
+                    ]
+                ]
+            ]
+            for x in (0, 1)
+        ]
+        squares[1].append([[Point(5, 5), Point(6, 5), Point(6, 6), Point(5, 5)]])
+        to_add = []
+        for mp in squares:
+            feat = QgsFeature(layer.fields())
+            feat.setGeometry(Geometry.fromMultiPolygonXY(mp))
+            to_add.append(feat)
+        layer.writer.addFeatures(to_add)
+        data = layer.to_osm()
+        self.assertEqual(len(data.nodes), 9)
+        self.assertEqual(len(data.ways), 3)
+        self.assertEqual(len(data.relations), 1)
+        for way in data.ways:
+            self.assertIs(way.nodes[0], way.nodes[-1])
+        node = data.find_node(1, 0)
+        self.assertEqual(len(data.parents[node]), 2)
+
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_to_osm_view(self):
+        layer = BaseLayer("Polygon", "test", "memory")
+        layer.append(self.fixture)
+        data = layer.to_osm()
+        for node in data.nodes:
+            self.assertTrue(-17 < node.x < -16 and 28 < node.y < 29)
+        layer.reproject()
+        data2 = layer.to_osm()
+        self.assertEqual(len(data.nodes), len(data2.nodes))
+
+    def test_get_request(self):
+        layer = BaseLayer("test/fixtures/building.gml", "building", "ogr")
+        request = layer.get_request(["localId"], geometry=False)
+        feat = next(layer.getFeatures(request))
+        self.assertFalse(feat.hasGeometry())
+        self.assertTrue(feat["localId"])
+        self.assertEqual(
+            request.subsetOfAttributes(), [layer.fields().indexOf("localId")]
+        )
+        exp = "localId LIKE '76407%%'"
+        request = layer.get_request(expression=exp)
+        self.assertEqual(sum([1 for f in layer.getFeatures(request)]), 2)
+        self.assertTrue(next(layer.getFeatures(request)).hasGeometry())
+        fids = [f.id() for f in layer.getFeatures(request)]
+        request = layer.get_request([], fids=fids[:1])
+        self.assertEqual([f.id() for f in layer.getFeatures(request)], fids[:1])
+        with self.assertRaises(TypeError):
+            layer.get_request(fids=fids, expression=exp)
+
     def test_search(self):
         fn = "test/fixtures/building.gml"
         layer = BaseLayer(fn, "building", "ogr")
@@ -1,24 +1,81 @@
 import logging
 import unittest
-from collections import Counter
+from collections import Counter, defaultdict
 
 import mock
 from qgis.core import QgsExpression, QgsFeature, QgsFeatureRequest, QgsVectorLayer
 
-from catatom2osm import osm
+from catatom2osm import config, osm
 from catatom2osm.app import QgsSingleton
 from catatom2osm.geo.aux import is_inside
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.address import AddressLayer
 from catatom2osm.geo.layer.cons import ConsLayer
 from catatom2osm.geo.point import Point
+from catatom2osm.report import Report
 
 qgs = QgsSingleton()
 m_log = mock.MagicMock()
 m_log.app_level = logging.INFO
 
 
+def legacy_move_entrances(layer, address):
+    """Reference implementation of the entrances part of move_address."""
+    (buildings, parts) = layer.index_of_building_and_parts()
+    ppv, __ = layer.get_parents_per_vertex_and_geometries("NOT(localId ~ '_')")
+    to_insert = {}
+    for ad in address.getFeatures():
+        refcat = layer.get_id(ad)
+        if ad["spec"] != "Entrance" or not buildings.get(refcat):
+            continue
+        point = ad.geometry().asPoint()
+        distance = 9e9
+        for bu in buildings[refcat]:
+            d, c, v = bu.geometry().closestSegmentWithContext(point)[:3]
+            if d < distance:
+                (building, distance, closest, vertex) = (bu, d, c, v)
+        bg = building.geometry()
+        va = Point(bg.vertexAt(vertex - 1))
+        vb = Point(bg.vertexAt(vertex))
+        if (
+            distance > config.addr_thr**2
+            or vertex > len(Geometry.get_multipolygon(bg)[0][0])
+            or closest.sqrDist(va) < config.entrance_thr**2
+            or closest.sqrDist(vb) < config.entrance_thr**2
+            or ConsLayer.is_shared_segment(ppv, va, vb, building.id())
+        ):
+            continue
+        bg.insertVertex(closest.x(), closest.y(), vertex)
+        to_insert[building.id()] = bg.asWkt()
+        building.setGeometry(bg)
+        for part in parts[refcat]:
+            pg = part.geometry()
+            r = Geometry.get_multipolygon(pg)[0][0]
+            for i in range(len(r) - 1):
+                vpa = Point(pg.vertexAt(i))
+                vpb = Point(pg.vertexAt(i + 1))
+                if va in (vpa, vpb) and vb in (vpa, vpb):
+                    pg.insertVertex(closest.x(), closest.y(), i + 1)
+                    to_insert[part.id()] = pg.asWkt()
+                    part.setGeometry(pg)
+                    break
+    return to_insert
+
+
 class TestConsLayerSimple(unittest.TestCase):
+    def test_get_segments(self):
+        square = [Point(0, 0), Point(1, 0), Point(1, 1), Point(0, 1), Point(0, 0)]
+        geom = Geometry.fromPolygonXY([square])
+        segments = ConsLayer.get_segments(geom)
+        self.assertEqual(len(segments), 4)
+        self.assertEqual(segments[0], (frozenset([(0, 0), (1, 0)]), 1))
+        self.assertEqual(segments[3], (frozenset([(0, 1), (0, 0)]), 4))
+        index = defaultdict(dict)
+        ConsLayer.index_segments(index, "A", 7, geom)
+        self.assertEqual(index[("A", frozenset([(1, 1), (1, 0)]))], {7: 2})
+        ConsLayer.index_segments(index, "A", 7, geom, remove=True)
+        self.assertTrue(all(not fids for fids in index.values()))
+
     def test_is_building(self):
         self.assertTrue(ConsLayer.is_building({"localId": "foobar"}))
         self.assertFalse(ConsLayer.is_building({"localId": "foo_bar"}))
@@ -203,6 +260,29 @@ class TestConsLayer(unittest.TestCase):
         for feat in self.layer.getFeatures():
             self.assertNotIn(feat["localId"], refs)
 
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_preprocess(self):
+        layer = ConsLayer()
+        layer.append(self.fixture, rename="")
+        with mock.patch("catatom2osm.geo.layer.cons.report", Report()) as r1:
+            with mock.patch("catatom2osm.geo.layer.polygon.report", r1):
+                self.layer.remove_outside_parts()
+                self.layer.remove_parts_wo_building()
+                self.layer.explode_multi_parts()
+        with mock.patch("catatom2osm.geo.layer.cons.report", Report()) as r2:
+            with mock.patch("catatom2osm.geo.layer.polygon.report", r2):
+                layer.preprocess()
+        self.assertEqual(r1.values, r2.values)
+        self.assertEqual(layer.featureCount(), self.layer.featureCount())
+        result1 = Counter(
+            (f["localId"], f.geometry().asWkt()) for f in self.layer.getFeatures()
+        )
+        result2 = Counter(
+            (f["localId"], f.geometry().asWkt()) for f in layer.getFeatures()
+        )
+        self.assertEqual(result1, result2)
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
     def test_get_parts(self):
@@ -474,6 +554,60 @@ class TestConsLayer(unittest.TestCase):
         self.layer.move_address(address)
         self.assertEqual(address.featureCount(), 6)
 
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_move_address_parity(self):
+        self.layer.explode_multi_parts()
+        expected = ConsLayer()
+        expected.append(self.layer)
+        address = AddressLayer()
+        address_gml = QgsVectorLayer("test/fixtures/address.gml", "address", "ogr")
+        address.append(address_gml)
+        refs = {f.id(): f["localId"] for f in expected.getFeatures()}
+        to_insert = legacy_move_entrances(expected, address)
+        self.assertGreater(len(to_insert), 0)
+        expected = {refs[fid]: wkt for fid, wkt in to_insert.items()}
+        self.layer.move_address(address)
+        for feat in self.layer.getFeatures():
+            if feat["localId"] in expected:
+                self.assertEqual(feat.geometry().asWkt(), expected[feat["localId"]])
+
+    def test_move_entrance_parts(self):
+        layer = ConsLayer()
+        rings = {
+            "A": [(0, 0), (10, 0), (20, 0), (20, 10), (10, 10), (0, 10), (0, 0)],
+            "A_part1": [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)],
+            "A_part2": [(10, 0), (20, 0), (20, 10), (10, 10), (10, 0)],
+            "A_part3": [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)],
+        }
+        to_add = []
+        for localid, ring in rings.items():
+            feat = QgsFeature(layer.fields())
+            feat["localId"] = localid
+            polygon = [[Point(x, y) for x, y in ring]]
+            feat.setGeometry(Geometry.fromPolygonXY(polygon))
+            to_add.append(feat)
+        layer.writer.addFeatures(to_add)
+        address = AddressLayer()
+        for x in (5, 15):
+            ad = QgsFeature(address.fields())
+            ad["localId"] = "38.012.1.1.A"
+            ad["spec"] = "Entrance"
+            ad.setGeometry(Geometry.fromPointXY(Point(x, -1)))
+            address.writer.addFeatures([ad])
+        with mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock()):
+            layer.move_address(address)
+        geometries = {f["localId"]: f.geometry() for f in layer.getFeatures()}
+        self.assertEqual(len(Geometry.get_vertices_list(geometries["A"])), 8)
+        for localid in ("A_part1", "A_part3"):
+            vertices = Geometry.get_vertices_list(geometries[localid])
+            self.assertEqual(vertices[1], Point(5, 0))
+            self.assertEqual(len(vertices), 5)
+        vertices = Geometry.get_vertices_list(geometries["A_part2"])
+        self.assertEqual(vertices[1], Point(15, 0))
+        for ad in address.getFeatures():
+            self.assertEqual(ad.geometry().asPoint().y(), 0)
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
     def test_validate(self):
@@ -504,6 +638,32 @@ class TestConsLayer(unittest.TestCase):
         self.assertEqual(ways, len(data.ways))
         self.assertEqual(rels, len(data.relations))
 
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    def test_get_conflicts(self):
+        self.layer.reproject()
+        d = osm.Osm()
+        w1 = d.Way(
+            (
+                (-16.44051231511, 28.23655551417),
+                (-16.44042112, 28.23650529975),
+                (-16.4405699826, 28.23631153095),
+                (-16.44065782495, 28.23635288407),
+                (-16.44051231511, 28.23655551417),
+            ),
+            dict(building="yes"),
+        )
+        w2 = d.Way(((0, 0), (1, 0), (1, 1), (0, 0)), dict(building="yes"))
+        w3 = d.Way(((0, 0), (1, 1), (1, 0), (0, 1), (0, 0)), dict(building="yes"))
+        d.Way(((0, 0), (1, 0), (1, 1), (0, 0)), dict(highway="yes"))
+        conflicts = self.layer.get_conflicts(d)
+        self.assertEqual(len(conflicts), 3)
+        result = dict(conflicts)
+        self.assertGreater(len(result[w1]), 0)
+        for fid in result[w1]:
+            self.assertTrue(next(self.layer.getFeatures([fid])).isValid())
+        self.assertEqual(result[w2], [])
+        self.assertIsNone(result[w3])
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.cons.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
@@ -2,12 +2,13 @@ import logging
 import unittest
 
 import mock
-from qgis.core import QgsVectorLayer
+from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
 
 from catatom2osm.app import QgsSingleton
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.cons import ConsLayer
 from catatom2osm.geo.layer.parcel import ParcelLayer
+from catatom2osm.geo.layer.zoning import ZoningLayer
 
 qgs = QgsSingleton()
 m_log = mock.MagicMock()
@@ -212,3 +213,52 @@ class TestParcelLayer(unittest.TestCase):
         cl = len([k for k, v in tasks.items() if k != v])
         self.assertEqual(ld, la - cl)
         self.assertEqual(pca, pcd)
+
+    @mock.patch("catatom2osm.geo.layer.parcel.log", m_log)
+    def test_set_zones(self):
+        square = "MULTIPOLYGON((({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1})))"
+        layer = ParcelLayer("38012")
+        parcels = [
+            ("8642317CS5284S", (1, 1, 9, 9)),
+            ("9999901CS5284S", (11, 11, 19, 19)),
+            ("38012A00100001", (201, 1, 209, 9)),
+            ("9999902CS5284S", (501, 1, 509, 9)),
+        ]
+        to_add = []
+        for localid, coords in parcels:
+            feat = QgsFeature(layer.fields())
+            feat["localId"] = localid
+            feat.setGeometry(QgsGeometry.fromWkt(square.format(*coords)))
+            to_add.append(feat)
+        # Concave parcel with the centroid (432, 32) outside of its zone
+        feat = QgsFeature(layer.fields())
+        feat["localId"] = "9999903CS5284S"
+        wkt = "MULTIPOLYGON(((401 1, 499 1, 499 19, 419 19, 419 99, 401 99, 401 1)))"
+        feat.setGeometry(QgsGeometry.fromWkt(wkt))
+        to_add.append(feat)
+        layer.writer.addFeatures(to_add)
+        urban = ZoningLayer(baseName="urbanzoning")
+        rustic = ZoningLayer(baseName="rusticzoning")
+        zones = [
+            (urban, "86423", "M", (0, 0, 100, 100)),
+            (rustic, "1", "P", (200, 0, 300, 100)),
+        ]
+        for zoning, label, level, coords in zones:
+            feat = QgsFeature(zoning.fields())
+            feat["label"] = label
+            feat["levelName"] = "foo:" + level
+            feat.setGeometry(QgsGeometry.fromWkt(square.format(*coords)))
+            zoning.writer.addFeatures([feat])
+        feat = QgsFeature(urban.fields())
+        feat["label"] = "86424"
+        feat["levelName"] = "foo:M"
+        wkt = "MULTIPOLYGON(((400 0, 500 0, 500 20, 420 20, 420 100, 400 100, 400 0)))"
+        feat.setGeometry(QgsGeometry.fromWkt(wkt))
+        urban.writer.addFeatures([feat])
+        layer.set_zones(urban, rustic)
+        zones = {f["localId"]: f["zone"] for f in layer.getFeatures()}
+        self.assertEqual(zones["8642317CS5284S"], "86423")
+        self.assertEqual(zones["9999901CS5284S"], "86423")
+        self.assertEqual(zones["38012A00100001"], "001")
+        self.assertIsNone(zones["9999902CS5284S"])
+        self.assertEqual(zones["9999903CS5284S"], "86424")
@@ -2,12 +2,13 @@ import logging
 import unittest
 
 import mock
-from qgis.core import QgsFeature, QgsFeatureRequest, QgsVectorLayer
+from qgis.core import QgsFeature, QgsFeatureRequest, QgsGeometry, QgsVectorLayer
 
 from catatom2osm.app import QgsSingleton
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.polygon import PolygonLayer
 from catatom2osm.geo.point import Point
+from catatom2osm.report import instance as report
 
 qgs = QgsSingleton()
 m_log = mock.MagicMock()
@@ -101,6 +102,95 @@ class TestPolygonLayer(unittest.TestCase):
             )
         )
 
+    def test_get_containers(self):
+        layer = PolygonLayer("Polygon", "split", "memory")
+        square = "POLYGON(({0} 0, {1} 0, {1} 10, {0} 10, {0} 0))"
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(QgsGeometry.fromWkt(square.format(0, 10)))
+        layer.writer.addFeatures([feat])
+        g1 = QgsGeometry.fromWkt("POLYGON((1 1, 2 1, 2 2, 1 1))")
+        g2 = QgsGeometry.fromWkt("POLYGON((21 1, 22 1, 22 2, 21 1))")
+        self.assertEqual(len(list(layer.get_containers(g1))), 1)
+        self.assertEqual(len(list(layer.get_containers(g2))), 0)
+        self.assertIsNotNone(layer.is_inside_area(g1))
+        self.assertIsNone(layer.is_inside_area(g2))
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(QgsGeometry.fromWkt(square.format(20, 30)))
+        layer.writer.addFeatures([feat])
+        self.assertIsNotNone(layer.is_inside_area(g2))
+        self.assertIsNotNone(layer.is_inside(g1))
+        fid = layer.is_inside(g1).id()
+        layer.writer.deleteFeatures([fid])
+        self.assertEqual(list(layer.get_containers(g1)), [])
+        self.assertIsNone(layer.is_inside_area(g1))
+        self.assertIsNotNone(layer.is_inside_area(g2))
+
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    @mock.patch("catatom2osm.geo.layer.polygon.log", m_log)
+    def test_clean_shards(self):
+        uri = "MultiPolygon?crs=" + self.layer.crs().authid()
+        sharded = PolygonLayer(uri, "building", "memory")
+        sharded.append(self.layer, rename="")
+        keys = [
+            "vertex_close",
+            "vertex_topo",
+            "vertex_zz",
+            "vertex_spike",
+            "vertex_simplify",
+            "geom_parts",
+            "geom_rings",
+            "geom_invalid",
+        ]
+
+        def get_values():
+            return {k: report.values.pop(k + "_building", 0) for k in keys}
+
+        get_values()
+        self.layer.clean()
+        expected = get_values()
+        self.assertGreater(sum(expected.values()), 0)
+        sharded.clean(workers=2)
+        self.assertEqual(get_values(), expected)
+        self.assertEqual(sharded.featureCount(), self.layer.featureCount())
+        vertices = sum(
+            len(Geometry.get_vertices_list(f)) for f in self.layer.getFeatures()
+        )
+        sharded_vertices = sum(
+            len(Geometry.get_vertices_list(f)) for f in sharded.getFeatures()
+        )
+        self.assertAlmostEqual(sharded_vertices / vertices, 1, delta=0.01)
+
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
+    @mock.patch("catatom2osm.geo.layer.polygon.log", m_log)
+    def test_clean_shards_edge(self):
+        rect = "POLYGON(({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))"
+        rects = [
+            (0, 0, 1, 1),  # Corners of a 3x3 grid of 100 m tiles with 2 workers
+            (299, 299, 300, 300),
+            (60, 40, 140, 60),  # Crosses the tile line x = 100
+            (50, 45, 60.01, 55),  # Inside the first tile, touches the previous
+        ]
+        layers = []
+        for name in ("serial", "sharded"):
+            layer = PolygonLayer("Polygon?crs=EPSG:25830", name, "memory")
+            to_add = []
+            for coords in rects:
+                feat = QgsFeature(layer.fields())
+                feat.setGeometry(QgsGeometry.fromWkt(rect.format(*coords)))
+                to_add.append(feat)
+            layer.writer.addFeatures(to_add)
+            layers.append(layer)
+        layers[0].clean()
+        layers[1].clean(workers=2)
+        expected = {f.id(): f.geometry().asWkt() for f in layers[0].getFeatures()}
+        result = {f.id(): f.geometry().asWkt() for f in layers[1].getFeatures()}
+        self.assertEqual(result, expected)
+        features = layers[1].getFeatures()
+        big = next(f for f in features if f.geometry().boundingBox().xMaximum() == 140)
+        self.assertIn(Point(60.01, 45), Geometry.get_vertices_list(big))
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.tqdm", mock.MagicMock())
     def test_difference(self):
@@ -1,6 +1,17 @@
 import unittest
 
-from catatom2osm.geo.aux import merge_groups
+from qgis.core import QgsFeature, QgsGeometry
+
+from catatom2osm.app import QgsSingleton
+from catatom2osm.geo.aux import (
+    PreparedGeometry,
+    get_prepared,
+    is_inside,
+    is_inside_area,
+    merge_groups,
+)
+
+qgs = QgsSingleton()
 
 
 class TestAux(unittest.TestCase):
@@ -11,3 +22,31 @@ class TestAux(unittest.TestCase):
         g1 = result[0]
         g2 = result[1]
         self.assertTrue(all([g not in g1 for g in g2]))
+
+    def test_is_inside_prepared(self):
+        container = QgsGeometry.fromWkt("POLYGON((0 0, 10 0, 10 10, 0 10, 0 0))")
+        prepared = PreparedGeometry(container)
+        tests = [
+            "POLYGON((1 1, 2 1, 2 2, 1 2, 1 1))",
+            "POLYGON((8 8, 12 8, 12 9, 8 9, 8 8))",
+            "POLYGON((6 1, 14 1, 14 2, 6 2, 6 1))",
+            "POLYGON((20 20, 21 20, 21 21, 20 21, 20 20))",
+            "POINT(5 5)",
+        ]
+        for wkt in tests:
+            geom = QgsGeometry.fromWkt(wkt)
+            self.assertEqual(is_inside(geom, prepared), is_inside(geom, container))
+            if geom.area():
+                self.assertEqual(
+                    is_inside_area(geom, prepared), is_inside_area(geom, container)
+                )
+
+    def test_get_prepared(self):
+        feat = QgsFeature()
+        feat.setId(1)
+        feat.setGeometry(QgsGeometry.fromWkt("POLYGON((0 0, 1 0, 1 1, 0 0))"))
+        cache = {}
+        prepared = get_prepared(feat, cache)
+        self.assertIsInstance(prepared, PreparedGeometry)
+        self.assertIs(get_prepared(feat, cache), prepared)
+        self.assertEqual(list(cache.keys()), [1])
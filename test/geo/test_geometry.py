@@ -1,5 +1,6 @@
 import unittest
 
+import mock
 from qgis.core import QgsFeature, QgsFields
 
 from catatom2osm.geo import Geometry, Point
@@ -36,3 +37,30 @@ class TestGeometry(unittest.TestCase):
         f.setGeometry(Geometry.fromMultiPolygonXY(mp))
         v = p1[:-1] + p3[:-1]
         self.assertEqual(Geometry.get_outer_vertices(f), v)
+
+    def test_union(self):
+        self.assertIsNone(Geometry.union([]))
+        squares = [
+            Geometry.fromPolygonXY(
+                [[Point(i, 0), Point(i + 1, 0), Point(i + 1, 1), Point(i, 1)]]
+            )
+            for i in range(5)
+        ]
+        geom = Geometry.union(squares[:1])
+        self.assertTrue(geom.equals(squares[0]))
+        self.assertIsNot(geom, squares[0])
+        geom = Geometry.union(squares)
+        self.assertEqual(len(Geometry.get_multipolygon(geom)), 1)
+        self.assertAlmostEqual(geom.area(), 5)
+        with mock.patch("catatom2osm.geo.geometry.QgsGeometry") as m_geom:
+            m_geom.unaryUnion.return_value.isNull.return_value = True
+            geom = Geometry.union(squares)
+        self.assertEqual(len(Geometry.get_multipolygon(geom)), 1)
+        self.assertAlmostEqual(geom.area(), 5)
+
+    def test_get_clusters(self):
+        points = [Point(1, 1), Point(5, 2), Point(150, 10), Point(160, 90)]
+        clusters = Geometry.get_clusters(points, 100)
+        self.assertEqual(len(clusters), 2)
+        self.assertEqual(clusters[0].toString(0), "1,1 : 5,2")
+        self.assertEqual(clusters[1].toString(0), "150,10 : 160,90")
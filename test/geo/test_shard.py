@@ -0,0 +1,47 @@
+import unittest
+
+from qgis.core import QgsGeometry, QgsPointXY
+
+from catatom2osm.app import QgsSingleton
+from catatom2osm.geo import shard
+
+qgs = QgsSingleton()
+
+
+class TestShard(unittest.TestCase):
+    def get_square(self, x, y, side=1):
+        wkt = "POLYGON(({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))"
+        return QgsGeometry.fromWkt(wkt.format(x, y, x + side, y + side))
+
+    def test_get_shards(self):
+        geometries = {
+            1: self.get_square(0, 0),
+            2: self.get_square(8, 0),
+            3: self.get_square(0, 8),
+            4: self.get_square(8, 8),
+            5: self.get_square(4.5, 1, 1),
+        }
+        grid = shard.get_grid(geometries, 4)
+        self.assertEqual(grid, (0, 0, 4.5, 4.5, 2))
+        shards, border = shard.get_shards(geometries, grid, 0.1)
+        self.assertEqual([t for t, o, h in shards], [0, 1, 2, 3])
+        owned = sorted(fid for t, o, h in shards for fid in o)
+        self.assertEqual(owned, [1, 2, 3, 4, 5])
+        self.assertEqual(border, {5})
+        halos = [h for t, o, h in shards if h]
+        self.assertEqual(halos, [[5]])
+
+    def test_get_shards_single(self):
+        geometries = {1: self.get_square(0, 0), 2: self.get_square(8, 8)}
+        grid = shard.get_grid(geometries, 1)
+        shards, border = shard.get_shards(geometries, grid, 0.1)
+        self.assertEqual(shards, [(0, [1, 2], [])])
+        self.assertEqual(border, set())
+
+    def test_get_tile(self):
+        grid = (0, 0, 4.5, 4.5, 2)
+        self.assertEqual(shard.get_tile(grid, QgsPointXY(1, 1)), 0)
+        self.assertEqual(shard.get_tile(grid, QgsPointXY(4.5, 1)), 1)
+        self.assertEqual(shard.get_tile(grid, QgsPointXY(1, 8)), 2)
+        self.assertEqual(shard.get_tile(grid, QgsPointXY(9, 9)), 3)
+        self.assertEqual(shard.get_tile(grid, QgsPointXY(-1, 10)), 2)
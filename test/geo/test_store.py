@@ -0,0 +1,63 @@
+import unittest
+
+from qgis.core import QgsFeature, QgsGeometry, QgsRectangle
+
+from catatom2osm.app import QgsSingleton
+from catatom2osm.geo.layer.polygon import PolygonLayer
+from catatom2osm.geo.store import GeometryStore
+
+qgs = QgsSingleton()
+
+
+class TestGeometryStore(unittest.TestCase):
+    def setUp(self):
+        self.layer = PolygonLayer("Polygon?field=name:string", "test", "memory")
+        to_add = []
+        for i in range(4):
+            feat = QgsFeature(self.layer.fields())
+            feat["name"] = str(i)
+            wkt = "POLYGON(({0} 0, {1} 0, {1} 1, {0} 1, {0} 0))".format(
+                i * 2, i * 2 + 1
+            )
+            feat.setGeometry(QgsGeometry.fromWkt(wkt))
+            to_add.append(feat)
+        self.layer.writer.addFeatures(to_add)
+        self.fids = [f.id() for f in self.layer.getFeatures()]
+
+    def test_init(self):
+        store = GeometryStore(self.layer)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(set(store), set(self.fids))
+        self.assertEqual(store[self.fids[1]].boundingBox().xMinimum(), 2)
+        request = self.layer.get_request(expression="name > '1'")
+        store = GeometryStore(self.layer, request)
+        self.assertEqual(set(store.keys()), set(self.fids[2:]))
+
+    def test_change_delete(self):
+        store = GeometryStore(self.layer)
+        geom = QgsGeometry.fromWkt("POLYGON((0 0, 5 0, 5 5, 0 0))")
+        store[self.fids[0]] = geom
+        store.update({self.fids[1]: geom})
+        store.delete([self.fids[1], self.fids[2], 1234])
+        self.assertEqual(store.dirty, {self.fids[0]})
+        self.assertEqual(store.deleted, {self.fids[1], self.fids[2]})
+        self.assertNotIn(self.fids[1], store)
+        self.assertEqual(self.layer.featureCount(), 4)
+        names = [f["name"] for f in store.features()]
+        self.assertEqual(names, ["0", "3"])
+        self.assertEqual(next(store.features()).geometry().area(), 12.5)
+        request = self.layer.get_request(expression="name = '3'")
+        self.assertEqual([f["name"] for f in store.features(request)], ["3"])
+        store.flush()
+        self.assertEqual(store.dirty, set())
+        self.assertEqual(store.deleted, set())
+        self.assertEqual(self.layer.featureCount(), 2)
+        feat = next(self.layer.getFeatures())
+        self.assertEqual(feat.geometry().area(), 12.5)
+
+    def test_get_index(self):
+        store = GeometryStore(self.layer)
+        store.delete([self.fids[0]])
+        index = store.get_index()
+        fids = index.intersects(QgsRectangle(0, 0, 10, 1))
+        self.assertEqual(set(fids), set(self.fids[1:]))
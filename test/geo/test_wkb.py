@@ -0,0 +1,89 @@
+import struct
+import unittest
+
+from catatom2osm.geo import wkb
+
+
+def polygon(rings, little=True, wkb_type=3):
+    e = "<" if little else ">"
+    data = bytes([1 if little else 0]) + struct.pack(e + "II", wkb_type, len(rings))
+    for ring in rings:
+        data += struct.pack(e + "I", len(ring))
+        for p in ring:
+            data += struct.pack(e + "%dd" % len(p), *p)
+    return data
+
+
+class TestWkb(unittest.TestCase):
+    def setUp(self):
+        self.p1 = polygon([[(0, 0), (1, 0), (1, 1), (0, 0)]])
+        self.p2 = polygon(
+            [
+                [(5, 5), (6, 5), (6, 6), (5, 5)],
+                [(5.1, 5.1), (5.2, 5.1), (5.2, 5.2), (5.1, 5.1)],
+            ],
+            little=False,
+        )
+        self.p3 = polygon([[(0, 0, 9), (1, 0, 9), (1, 1, 9), (0, 0, 9)]], True, 1003)
+        self.mp = b"\x01" + struct.pack("<II", 6, 2) + self.p1 + self.p2
+        self.pt = b"\x01" + struct.pack("<Idd", 1, 3, 4)
+        self.wkbs = [self.p1, self.p2, self.p3, self.mp, self.pt]
+
+    def test_get_dimension(self):
+        self.assertEqual(wkb.get_dimension(3), (3, 2))
+        self.assertEqual(wkb.get_dimension(1003), (3, 3))
+        self.assertEqual(wkb.get_dimension(2003), (3, 3))
+        self.assertEqual(wkb.get_dimension(3006), (6, 4))
+        self.assertEqual(wkb.get_dimension(0x80000001), (1, 3))
+
+    def test_get_blocks(self):
+        blocks, end = wkb.get_blocks(self.p2)
+        self.assertEqual(blocks, [(13, 4, 2, False), (81, 4, 2, False)])
+        self.assertEqual(end, len(self.p2))
+        blocks, end = wkb.get_blocks(self.mp)
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual(end, len(self.mp))
+        with self.assertRaises(TypeError):
+            wkb.get_blocks(b"\x01" + struct.pack("<I", 17))
+
+    def test_get_coords(self):
+        xs, ys, layout = wkb.get_coords(self.wkbs)
+        self.assertEqual(len(xs), 29)
+        self.assertEqual(list(xs[:6]), [0, 1, 1, 0, 5, 6])
+        self.assertEqual(list(ys[8:12]), [5.1, 5.1, 5.2, 5.1])
+        self.assertEqual((xs[-1], ys[-1]), (3, 4))
+        self.assertEqual([len(blocks) for blocks in layout], [1, 2, 1, 3, 1])
+
+    def test_set_coords(self):
+        xs, ys, layout = wkb.get_coords(self.wkbs)
+        result = wkb.set_coords(
+            self.wkbs, layout, [x + 10 for x in xs], [y * 2 for y in ys]
+        )
+        self.assertEqual([len(data) for data in result], [len(d) for d in self.wkbs])
+        xs2, ys2, __ = wkb.get_coords(result)
+        self.assertEqual(list(xs2), [x + 10 for x in xs])
+        self.assertEqual(list(ys2), [y * 2 for y in ys])
+        self.assertEqual(result[2][-8:], self.p3[-8:])
+        self.assertEqual(result[1][0], 0)
+
+    def test_get_polygons(self):
+        square = [(0, 0), (1, 0), (1, 1), (0, 0)]
+        self.assertEqual(wkb.get_polygons(self.p1), [[square]])
+        self.assertEqual(wkb.get_polygons(self.p3), [[square]])
+        polygons = wkb.get_polygons(self.mp)
+        self.assertEqual(len(polygons), 2)
+        self.assertEqual(polygons[0], [square])
+        self.assertEqual(len(polygons[1]), 2)
+        self.assertEqual(polygons[1][1][1], (5.2, 5.1))
+        with self.assertRaises(TypeError):
+            wkb.get_polygons(self.pt)
+
+    def test_from_multipolygon(self):
+        rings = [[(0, 0), (1, 0), (1, 1), (0, 0)]]
+        inner = [(5.1, 5.1), (5.2, 5.1), (5.2, 5.2), (5.1, 5.1)]
+        data = wkb.from_multipolygon([rings, [[(5, 5), (6, 5), (6, 6), (5, 5)], inner]])
+        expected = b"\x01" + struct.pack("<II", 6, 2) + self.p1
+        self.assertTrue(data.startswith(expected))
+        xs, ys, layout = wkb.get_coords([data])
+        self.assertEqual(len(layout[0]), 3)
+        self.assertEqual(list(xs[-4:]), [p[0] for p in inner])
@@ -117,8 +117,7 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.process_building = get_func(app.CatAtom2Osm.process_building)
         self.m_app.process_building(self.m_app)
         building = self.m_app.building
-        building.remove_outside_parts.assert_called_once_with()
-        building.explode_multi_parts.assert_called_once_with()
+        building.preprocess.assert_called_once_with()
         building.clean.assert_called_once_with()
         building.validate.assert_called_once()
 
@@ -155,13 +154,23 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
         self.m_app.process_tasks(self.m_app, building)
         for label, task in self.m_app.get_tasks.return_value.items():
-            task.to_osm.assert_called_with(upload="yes", tags={"comment": "X" + label})
+            task.to_osm.assert_called_with(
+                upload="yes", tags={"comment": "X" + label}, compact=False
+            )
+        self.assertEqual(self.m_app.merge_address.call_count, 5)
+        self.m_app.options.address = False
+        self.m_app.process_tasks(self.m_app, building)
+        for label, task in self.m_app.get_tasks.return_value.items():
+            task.to_osm.assert_called_with(
+                upload="yes", tags={"comment": "X" + label}, compact=True
+            )
         self.assertEqual(self.m_app.merge_address.call_count, 5)
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.QgsCoordinateReferenceSystem")
     @mock.patch("catatom2osm.app.os")
     @mock.patch("catatom2osm.app.type")
-    def test_get_tasks(self, m_type, m_os):
+    def test_get_tasks(self, m_type, m_os, m_crs):
         m_os.path.join = lambda *args: "/".join(args)
         m_os.listdir.return_value = ["1", "2", "3"]
         layer_class = mock.MagicMock()
@@ -169,15 +178,23 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.tasks = {"00001": "00001", "00002": "00001"}
         building = mock.MagicMock()
         building.get_id = lambda feat: feat["localId"]
-        building.getFeatures.return_value = [
-            {"localId": "001"},
-            {"localId": "00001"},
-            {"localId": "00002"},
-        ]
+        features = []
+        for i, localid in enumerate(["001", "00001", "00002"]):
+            feat = mock.MagicMock()
+            feat.__getitem__.side_effect = {"localId": localid}.get
+            feat.id.return_value = i
+            features.append(feat)
+        building.getFeatures.return_value = features
+        building.get_view.return_value = {1: "foo"}
         building.featureCount.return_value = 3
         building.copy_feature.side_effect = [100, 101, 102]
         self.m_app.get_tasks = get_func(app.CatAtom2Osm.get_tasks)
         self.m_app.get_tasks(self.m_app, building)
+        crs = m_crs.fromEpsgId.return_value
+        m_crs.fromEpsgId.assert_called_once_with(4326)
+        building.get_view.assert_called_once_with(crs)
+        features[0].setGeometry.assert_not_called()
+        features[1].setGeometry.assert_called_once_with("foo")
         m_os.remove.assert_has_calls(
             [
                 mock.call("33333/tasks/1"),
@@ -188,12 +205,29 @@ class TestCatAtom2Osm(unittest.TestCase):
         layer_class.assert_has_calls(
             [
                 mock.call(baseName="001"),
+                mock.call().setCrs(crs),
                 mock.call().writer.addFeatures([100]),
                 mock.call(baseName="00001"),
+                mock.call().setCrs(crs),
                 mock.call().writer.addFeatures([101, 102]),
             ]
         )
 
+    @mock.patch("catatom2osm.app.QgsFeatureRequest")
+    def test_get_tasks_request(self, m_request):
+        self.m_app.tasks = {"001": "001", "002": "001"}
+        rect = self.m_app.parcel.extent.return_value.buffered.return_value
+        self.m_app.get_tasks_request = get_func(app.CatAtom2Osm.get_tasks_request)
+        request = self.m_app.get_tasks_request(self.m_app)
+        m_request.return_value.setFilterRect.assert_called_once_with(rect)
+        self.assertEqual(request, m_request.return_value.setFilterRect.return_value)
+        exp = "\"localId\" LIKE '%001%' OR \"localId\" LIKE '%002%'"
+        request.setFilterExpression.assert_called_once_with(exp)
+        request.setFilterExpression.reset_mock()
+        self.m_app.tasks = {str(i): str(i) for i in range(config.max_filter_keys + 1)}
+        request = self.m_app.get_tasks_request(self.m_app)
+        request.setFilterExpression.assert_not_called()
+
     def test_process_parcel(self):
         self.m_app.tasks = {"a": "a", "b": "b", "c": "c", "d": "d", "e": "e"}
         self.m_app.parcel.merge_by_adjacent_buildings.return_value = {
@@ -234,35 +268,102 @@ class TestCatAtom2Osm(unittest.TestCase):
 
     @mock.patch("catatom2osm.app.os")
     @mock.patch("catatom2osm.app.log")
-    @mock.patch("catatom2osm.app.open")
+    @mock.patch("catatom2osm.app.compress")
     @mock.patch("catatom2osm.app.osmxml")
     @mock.patch("catatom2osm.app.overpass")
-    def test_read_osm(self, m_overpass, m_xml, m_open, m_log, m_os):
+    def test_read_osm(self, m_overpass, m_xml, m_compress, m_log, m_os):
         self.m_app.read_osm = get_func(app.CatAtom2Osm.read_osm)
         m_os.path.join = lambda *args: "/".join(args)
         m_os.path.exists.return_value = True
         m_xml.deserialize.return_value.elements = []
         self.m_app.read_osm(self.m_app, "bar", "taz")
         m_overpass.Query.assert_not_called()
-        m_open.assert_called_with("33333/bar/taz", "rb")
-        m_xml.deserialize.assert_called_once_with(m_open())
+        m_compress.open_reader.assert_called_with("33333/bar/taz")
+        m_xml.deserialize.assert_called_once_with(m_compress.open_reader())
         output = m_log.warning.call_args_list[0][0][0]
         self.assertIn("No OSM data", output)
         m_xml.deserialize.return_value.elements = [1]
         self.m_app.boundary_search_area = "123456"
         m_os.path.exists.return_value = False
         data = self.m_app.read_osm(self.m_app, "taz", ql="bar")
-        m_overpass.Query.assert_called_with("123456")
+        m_overpass.Query.assert_called_with("123456", cache=self.m_app.overpass_cache)
         m_overpass.Query().add.assert_called_once_with("bar")
+        self.m_app.download_osm.assert_called_once_with(m_overpass.Query(), "33333/taz")
         self.assertEqual(data.elements, [1])
         output = m_log.info.call_args_list[0][0][0]
         self.assertIn("Downloading", output)
+        self.m_app.download_current_osm.assert_not_called()
+        self.m_app.read_osm(self.m_app, "current_highway.osm", ql="bar")
+        self.m_app.download_current_osm.assert_called_once_with()
 
+    @mock.patch("catatom2osm.app.os")
+    @mock.patch("catatom2osm.app.log")
+    @mock.patch("catatom2osm.app.io")
+    @mock.patch("catatom2osm.app.open")
     @mock.patch("catatom2osm.app.osmxml")
-    @mock.patch("catatom2osm.app.codecs")
+    @mock.patch("catatom2osm.app.overpass")
+    def test_download_current_osm(self, m_overpass, m_xml, m_open, m_io, m_log, m_os):
+        self.m_app.download_current_osm = get_func(app.CatAtom2Osm.download_current_osm)
+        self.m_app.boundary_search_area = "123456"
+        self.m_app.boundary_bbox = None
+        m_os.path.exists = lambda fn: fn.endswith("current_address.osm")
+        m_overpass.partition.return_value = {"current_highway.osm": "foo"}
+        self.m_app.download_current_osm(self.m_app)
+        m_overpass.Query.assert_called_once_with(
+            "123456", cache=self.m_app.overpass_cache
+        )
+        ql = app.current_osm_ql["current_highway.osm"]
+        m_overpass.Query().add.assert_called_once_with(ql)
+        self.m_app.download_osm.assert_called_once_with(
+            m_overpass.Query(), "33333/current_osm.osm"
+        )
+        data = m_xml.deserialize.return_value
+        m_overpass.partition.assert_called_once_with(data, {"current_highway.osm": ql})
+        m_os.remove.assert_called_once_with("33333/current_osm.osm")
+        m_io.open.assert_called_once_with(
+            "33333/current_highway.osm", "w", encoding="utf-8"
+        )
+        m_xml.serialize.assert_called_once_with(
+            m_io.open.return_value.__enter__.return_value, "foo"
+        )
+
+    @mock.patch("catatom2osm.app.config")
+    @mock.patch("catatom2osm.app.log")
     @mock.patch("catatom2osm.app.io")
-    @mock.patch("catatom2osm.app.gzip")
-    def test_write_osm(self, m_gz, m_io, m_codecs, m_xml):
+    @mock.patch("catatom2osm.app.osmxml")
+    @mock.patch("catatom2osm.app.overpass")
+    def test_download_osm(self, m_overpass, m_xml, m_io, m_log, m_config):
+        self.m_app.download_osm = get_func(app.CatAtom2Osm.download_osm)
+        m_config.overpass_tile_size = 0.1
+        m_log.app_level = logging.INFO
+        query = mock.MagicMock(bbox="")
+        self.m_app.download_osm(self.m_app, query, "foo")
+        query.download.assert_called_once_with("foo")
+        query.read_tiles.assert_not_called()
+        query.reset_mock()
+        query.bbox = "1,2,3,4"
+        m_overpass.get_tiles.return_value = ["1,2,3,4"]
+        self.m_app.download_osm(self.m_app, query, "foo")
+        m_overpass.get_tiles.assert_called_once_with("1,2,3,4", 0.1)
+        query.download.assert_called_once_with("foo")
+        query.reset_mock()
+        m_overpass.get_tiles.return_value = ["1,2,3,3", "1,3,3,4"]
+        self.m_app.download_osm(self.m_app, query, "foo")
+        query.download.assert_not_called()
+        query.read_tiles.assert_called_once_with(0.1)
+        m_io.open.assert_called_once_with("foo", "w", encoding="utf-8")
+        m_xml.serialize.assert_called_once_with(
+            m_io.open.return_value.__enter__.return_value,
+            query.read_tiles.return_value,
+        )
+        query.reset_mock()
+        m_config.overpass_tile_size = 0
+        self.m_app.download_osm(self.m_app, query, "foo")
+        query.download.assert_called_once_with("foo")
+
+    @mock.patch("catatom2osm.app.osmxml")
+    @mock.patch("catatom2osm.app.compress")
+    def test_write_osm(self, m_compress, m_xml):
         m_xml.serialize.return_value = "taz"
         data = osm.Osm()
         data.Node(0, 0, {"ref": "1"})
@@ -273,14 +374,10 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.assertNotIn(
             "ref", [k for el in data.elements for k in list(el.tags.keys())]
         )
-        m_io.open.assert_called_once_with("33333/bar", "w", encoding="utf-8")
-        file_obj = m_io.open.return_value
+        m_compress.open_writer.assert_called_once_with("33333/bar")
+        file_obj = m_compress.open_writer.return_value
         m_xml.serialize.assert_called_once_with(file_obj, data)
-        m_xml.reset_mock()
-        self.m_app.write_osm(self.m_app, data, "bar.gz")
-        m_gz.open.assert_called_once_with("33333/bar.gz", "w")
-        f_gz = m_gz.open.return_value
-        m_codecs.getwriter.return_value.assert_called_once_with(f_gz)
+        file_obj.close.assert_called_once_with()
 
     @mock.patch("catatom2osm.app.cdau")
     def test_get_auxiliary_addresses(self, m_cdau):
@@ -337,10 +434,11 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.merge_address(self.m_app, building, address)
         self.assertEqual(building.tags["source:date:addr"], address.tags["source:date"])
 
+    @mock.patch("catatom2osm.app.hgwnames")
     @mock.patch("catatom2osm.app.os")
     @mock.patch("catatom2osm.app.config")
     @mock.patch("catatom2osm.app.csvtools")
-    def test_get_translations(self, m_csv, m_config, m_os):
+    def test_get_translations(self, m_csv, m_config, m_os, m_hgw):
         m_os.path.join = lambda *args: "/".join(args)
         self.m_app.get_translations = get_func(app.CatAtom2Osm.get_translations)
         m_config.app_path = "foo"
@@ -357,6 +455,7 @@ class TestCatAtom2Osm(unittest.TestCase):
             ]
         )
         self.assertEqual(names, {"RAZ": "raz"})
+        m_hgw.update_tables.assert_called_once_with()
         address.get_highway_names.return_value = {"TAZ": " taz "}
         m_csv.csv2dict.reset_mock()
         m_os.path.exists.return_value = False
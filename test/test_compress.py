@@ -0,0 +1,82 @@
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from catatom2osm import compress, config
+from catatom2osm.exceptions import CatIOError
+
+config.install_gettext("catato2osm", "")
+
+TEXT = (
+    "<osm>\n"
+    + "".join(
+        "<node id='-%d' lat='%d' lon='%d'/>\n" % (i, i % 90, i % 180)
+        for i in range(20000)
+    )
+    + "</osm>\nÑandú\n"
+)
+
+
+class TestCompress(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, filename, text=TEXT, **kwargs):
+        filename = os.path.join(self.path, filename)
+        fo = compress.open_writer(filename, **kwargs)
+        fo.write(text)
+        fo.close()
+        return filename
+
+    def read(self, filename):
+        with compress.open_reader(filename) as fo:
+            return fo.read().decode("utf-8")
+
+    def test_get_format(self):
+        self.assertEqual(compress.get_format("foo.osm.gz"), ".gz")
+        self.assertEqual(compress.get_format("foo.osm.xz"), ".xz")
+        self.assertEqual(compress.get_format("foo.osm.zst"), ".zst")
+        self.assertEqual(compress.get_format("foo.osm"), "")
+
+    def test_plain(self):
+        fn = self.write("foo.osm")
+        with open(fn, "rb") as fo:
+            self.assertEqual(fo.read().decode("utf-8"), TEXT)
+        self.assertEqual(self.read(fn), TEXT)
+
+    def test_gzip(self):
+        fn = self.write("foo.osm.gz", level=1, workers=1)
+        with gzip.open(fn, "rb") as fo:
+            self.assertEqual(fo.read().decode("utf-8"), TEXT)
+        small = self.write("bar.osm.gz", level=9, workers=1)
+        self.assertLess(os.path.getsize(small), os.path.getsize(fn))
+
+    @mock.patch.object(config, "compress_block_size", 10000)
+    def test_block_gzip(self):
+        fn = self.write("foo.osm.gz", workers=3)
+        self.assertEqual(self.read(fn), TEXT)
+        with open(fn, "rb") as fo:
+            members = fo.read().count(b"\x1f\x8b\x08")
+        self.assertGreaterEqual(members, len(TEXT) // 10000)
+        fn = self.write("bar.osm.gz", text="", workers=3)
+        self.assertEqual(self.read(fn), "")
+
+    def test_xz(self):
+        fn = self.write("foo.osm.xz")
+        with lzma.open(fn, "rb") as fo:
+            self.assertEqual(fo.read().decode("utf-8"), TEXT)
+
+    @mock.patch.object(compress, "zstandard", None)
+    def test_zstd_missing(self):
+        with self.assertRaises(CatIOError):
+            self.write("foo.osm.zst")
+        with self.assertRaises(CatIOError):
+            self.read("foo.osm.zst")
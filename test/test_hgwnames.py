@@ -46,6 +46,27 @@ class TestHgwnames(unittest.TestCase):
         for (inp, out) in list(names.items()):
             self.assertEqual(hgwnames.parse(inp), out)
 
+    def test_parse_cache(self):
+        hgwnames.parse.cache_clear()
+        hgwnames.parse("CL FOO")
+        hgwnames.parse("CL FOO")
+        self.assertEqual(hgwnames.parse.cache_info().hits, 1)
+
+    def test_update_tables(self):
+        self.assertEqual(hgwnames.parse("XX FOO"), "Xx Foo")
+        try:
+            with mock.patch("catatom2osm.hgwnames.config") as m_config:
+                m_config.lowcase_words = ["FOO"]
+                m_config.highway_types = {"XX": "Taz"}
+                m_config.excluded_types = ["YY"]
+                hgwnames.update_tables()
+                self.assertEqual(hgwnames.parse("XX FOO"), "Taz foo")
+                self.assertEqual(hgwnames.parse("YY FOO"), "")
+                self.assertEqual(hgwnames.parse("CL DE"), "Cl De")
+        finally:
+            hgwnames.update_tables()
+        self.assertEqual(hgwnames.parse("XX FOO"), "Xx Foo")
+
     def test_fuzzy_match(self):
         self.assertEqual(hgwnames.match("FOOB", self.choices), "Foobar")
         self.assertEqual(hgwnames.match("CL FRANCIA", self.choices), "Calle Francia")
@@ -54,6 +75,70 @@ class TestHgwnames(unittest.TestCase):
     def test_nonfyzzy_match(self):
         self.assertEqual(hgwnames.match("CL FOOBAR", self.choices), "Calle Foobar")
 
+    def test_get_key(self):
+        self.assertEqual(hgwnames.get_key("Calle Rul·lan (A)"), "calle rullan")
+        self.assertEqual(hgwnames.get_key("Calle Rul·lan", True), "calle lan rul")
+        self.assertEqual(hgwnames.get_key("Paseo de España"), "de espaa paseo")
+
+    def test_matcher(self):
+        choices = self.choices + ["Foobar", "FOOBAR", "Calle Mayor (Centro)"]
+        matcher = hgwnames.Matcher(choices)
+        self.assertEqual(
+            matcher.choices, ["Foobar", "Foo bar", "Footaz", "Calle Mayor (Centro)"]
+        )
+        self.assertEqual(matcher.match("FOOB"), "Foobar")
+        self.assertEqual(matcher.match("CL FRANCIA"), "Calle Francia")
+        self.assertEqual(matcher.match("CL MAYOR"), "Calle Mayor (Centro)")
+        self.assertEqual(matcher.match("CL MAYOR", ["Footaz"]), "Calle Mayor")
+        self.assertEqual(matcher.match("FOOT", ["Foobar", "Footaz"]), "Footaz")
+        names = {"FOOB": None, "CL MAYOR": [], "XX FOO TAZ": self.choices}
+        expected = {"FOOB": "Foobar", "CL MAYOR": "Calle Mayor", "XX FOO TAZ": "Footaz"}
+        self.assertEqual(matcher.match_all(names), expected)
+
+    def test_matcher_parity(self):
+        choices = [
+            "Calle Mayor",
+            "Calle Mayor (Centro)",
+            "Calle de la Mar",
+            "Calle del Mar",
+            "Carrer del Mar",
+            "Avenida de España",
+            "Avinguda d'Espanya",
+            "Calle Rul·lan",
+            "Calle Rullan",
+            "Plaza Mayor",
+            "Plaça Major",
+            "Camino Viejo de Madrid",
+            "Camino Nuevo de Madrid",
+            "Calle Sant Marcel·li",
+        ]
+        names = [
+            "CL MAYOR",
+            "PZ MAYOR",
+            "CL MAR (DEL)",
+            "CL MAR,DE LA",
+            "AV ESPAÑA",
+            "CL RUL·LAN",
+            "CM VIEJO MADRID",
+            "CM MADRID",
+            "CL SANT MARCEL.LI",
+            "CL FOO",
+        ]
+        for backend in (hgwnames.rfuzz, None):
+            with mock.patch("catatom2osm.hgwnames.rfuzz", backend):
+                matcher = hgwnames.Matcher(choices)
+                for i, name in enumerate(names):
+                    subset = choices[i:] + choices[:i]
+                    for c in (choices, subset, choices[::-1]):
+                        self.assertEqual(
+                            matcher.match(name, c), hgwnames.match(name, c)
+                        )
+
+    @mock.patch("catatom2osm.hgwnames.fuzz", None)
+    def test_nonfuzzy_matcher(self):
+        matcher = hgwnames.Matcher(self.choices)
+        self.assertEqual(matcher.match("CL FOOBAR"), "Calle Foobar")
+
     def test_fuzzy_dsmatch(self):
         self.assertEqual(hgwnames.dsmatch("FOOB", self.ds, self.fn)["id"], 1)
         self.assertEqual(hgwnames.dsmatch("MADRID", self.ds2, self.fn)["id"], 4)
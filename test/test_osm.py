@@ -73,6 +73,25 @@ class TestOsm(OsmTestCase):
         self.assertEqual(n2.container, self.d)
         self.assertEqual(self.d.get(n2.id), n2)
         self.assertEqual(self.d.parents[n2], p)
+        self.assertIsNone(self.d.find_node(1, 1))
+        self.assertIs(self.d.find_node(2, 2), n2)
+
+    def test_find_node(self):
+        n1 = self.d.Node(1, 1)
+        n2 = self.d.Node(1, 1)
+        w1 = self.d.Way([(0, 0), n2, (0, 1)])
+        w2 = self.d.Way([(2, 0), (2, 1), (2, 2)])
+        self.assertIs(self.d.find_node(1, 1), n1)
+        self.assertIs(self.d.find_node(1, 1, {w1}), n2)
+        self.assertIsNone(self.d.find_node(1, 1, {w2}))
+        self.assertIsNone(self.d.find_node(1, 2))
+        self.assertIs(self.d.find_node(2, 1, {w1, w2}), w2.nodes[1])
+        self.d.remove(n1)
+        self.assertIs(self.d.find_node(1, 1), n2)
+        self.d.remove(w1)
+        self.assertIsNone(self.d.find_node(1, 1))
+        self.assertIsNone(self.d.find_node(0, 0))
+        self.assertNotIn((1, 1), self.d.coords)
 
     def test_merge_duplicated(self):
         n1 = self.d.Node(1, 1)
@@ -0,0 +1,105 @@
+import io
+import unittest
+
+from catatom2osm import osm, osmcompact, osmxml
+from catatom2osm.report import Report
+
+
+def get_content(data):
+    """Return the set of elements of a data set as comparable tuples."""
+    content = set()
+    for n in data.nodes:
+        content.add(("node", n.geometry(), tuple(sorted(n.tags.items()))))
+    for w in data.ways:
+        content.add(("way", w.geometry(), tuple(sorted(w.tags.items()))))
+    for r in data.relations:
+        members = tuple((m.role, m.element.geometry()) for m in r.members)
+        content.add(("relation", members, tuple(sorted(r.tags.items()))))
+    return content
+
+
+def fill(data):
+    """Add the same elements to data like BaseLayer.to_osm."""
+    data.Node((9, 9)).tags.update({"entrance": "yes"})
+    data.Node((9, 9)).tags.update({"entrance": "yes"})
+    data.Node((0, 0)).tags.update({"addr:street": "Foo"})
+    square = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+    data.Way(square).tags.update({"building": "yes"})
+    data.Way(square).tags.update({"building:part": "yes"})
+    data.Way(square).tags.update({"building:part": "yes"})
+    outer = [(2, 0), (6, 0), (6, 4), (2, 4), (2, 0)]
+    inner = [(3, 1), (4, 1), (4, 2), (3, 2), (3, 1)]
+    data.Polygon([outer, inner]).tags.update({"building": "yes"})
+    data.Way(inner).tags.update({"building:part": "yes"})
+    data.MultiPolygon([[square], [outer]]).tags.update({"leisure": "park"})
+    # Same rings rotated and reversed
+    courtyard = [(4, 2), (4, 1), (3, 1), (3, 2), (4, 2)]
+    data.Way(courtyard).tags.update({"building": "yes"})
+    around = [(-1, -1), (8, -1), (8, 6), (-1, 6), (-1, -1)]
+    rotated = [(6, 4), (2, 4), (2, 0), (6, 0), (6, 4)]
+    data.Polygon([around, rotated]).tags.update({"building": "yes"})
+
+
+class TestOsmCompact(unittest.TestCase):
+    def test_elements(self):
+        data = osmcompact.Osm(upload="yes", generator="foo")
+        n = data.Node(1, 2, tags={"a": "b"})
+        self.assertEqual(n.attrs["lon"], "1")
+        self.assertEqual(n.attrs["lat"], "2")
+        self.assertEqual(n.attrs["id"], "-1")
+        w = data.Way([n, (3, 4)])
+        self.assertEqual(w.attrs, {"id": "-2", "action": "modify", "visible": "true"})
+        self.assertIs(w.nodes[0], n)
+        p = data.Polygon([w.nodes])
+        self.assertEqual(p.tags, {"type": "multipolygon"})
+        self.assertEqual(
+            p.members[0].attrs, {"type": "way", "ref": "-5", "role": "outer"}
+        )
+        self.assertEqual(data.attrs, {"version": "0.6", "generator": "foo"})
+        self.assertEqual(len(data.elements), 5)
+        self.assertEqual(p.type, "polygon")
+        with self.assertRaises(AttributeError):
+            data.Foo()
+
+    def test_merge_duplicated_parity(self):
+        full = osm.Osm()
+        fill(full)
+        full.merge_duplicated()
+        data = osmcompact.Osm()
+        fill(data)
+        data.merge_duplicated()
+        self.assertEqual(get_content(data), get_content(full))
+        self.assertEqual(len(data.nodes), 17)
+        self.assertEqual(len(data.ways), 6)
+        self.assertEqual(len(data.relations), 3)
+        for way in data.ways:
+            self.assertIs(way.nodes[0], way.nodes[-1])
+
+    def test_serialize(self):
+        data = osmcompact.Osm(upload="yes")
+        data.tags["comment"] = "foo"
+        fill(data)
+        data.merge_duplicated()
+        fo = io.StringIO()
+        osmxml.serialize(fo, data)
+        result = osmxml.deserialize(io.BytesIO(fo.getvalue().encode()))
+        self.assertEqual(result.tags, {"comment": "foo"})
+        self.assertEqual(get_content(result), get_content(data))
+
+    def test_stats(self):
+        full = osm.Osm()
+        fill(full)
+        data = osmcompact.Osm()
+        fill(data)
+        r1 = Report()
+        r2 = Report()
+        for report, d in ((r1, full), (r2, data)):
+            report.address_stats(d)
+            report.cons_stats(d, "foo")
+            report.osm_stats(d)
+        keys = ["nodes", "ways", "relations"]
+        keys += [k for k in r1.values if k.startswith("out_")]
+        self.assertEqual(len(keys), 9)
+        for key in keys:
+            self.assertEqual(r1.values[key], r2.values[key])
+        self.assertEqual(r1.building_counter, r2.building_counter)
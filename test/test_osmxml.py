@@ -178,3 +178,16 @@ class OsmxmlTest(unittest.TestCase):
         self.assertEqual(len(result.relations), 3)
         self.assertEqual(result.get(-103, "w").version, "2")
         self.assertEqual(result.get(-202, "r").version, None)
+        root = etree.Element("osm")
+        nodexml = etree.Element("node", dict(id="-50", lon="0", lat="4"))
+        nodexml.append(etree.Element("tag", dict(k="foo", v="bar")))
+        root.append(nodexml)
+        wayxml = etree.Element("way", dict(id="-100"))
+        wayxml.append(etree.Element("nd", dict(ref="-50")))
+        root.append(wayxml)
+        fo = BytesIO(etree.tostring(root))
+        result = osmxml.deserialize(fo, result)
+        self.assertEqual(len(result.nodes), 17)
+        self.assertEqual(len(result.ways), 4)
+        self.assertEqual(result.get(-50).tags, {})
+        self.assertEqual(len(result.get(-100, "w").nodes), 5)
@@ -1,9 +1,40 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 import mock
 
+from catatom2osm import osm, overpass
 from catatom2osm.exceptions import CatIOError
-from catatom2osm.overpass import Query, api_servers
+from catatom2osm.overpass import Cache, Query, api_servers
+
+response = (
+    b"<?xml version='1.0' encoding='UTF-8'?>\n"
+    b"<osm version='0.6' generator='Overpass API'>\n"
+    b"<node id='1' lon='1' lat='1'/>\n"
+    b"</osm>\n"
+)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Replay a canned Overpass response."""
+
+    requests = []
+
+    def do_GET(self):
+        StandInHandler.requests.append(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/osm3s+xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
 
 
 class TestQuery(unittest.TestCase):
@@ -18,6 +49,7 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(q.statements, [])
         m_q.assert_called_once_with("foo")
         self.assertEqual(q.url, "")
+        self.assertEqual(q.cache, None)
         q = Query("foo", "json", False, False)
         self.assertEqual(q.output, "json")
         self.assertEqual(q.down, "")
@@ -92,3 +124,155 @@ class TestQuery(unittest.TestCase):
         out = q.read()
         m_download.get_response.assert_called_once_with(q.get_url())
         self.assertEqual(out, "bar")
+
+    def test_get_key(self):
+        q1 = Query("1234").add("foo", "bar")
+        q2 = Query("1234").add("bar;", " foo")
+        self.assertEqual(q1.get_key(), q2.get_key())
+        self.assertEqual(q1.get_key(), q1.get_key())
+        q3 = Query("1234").add("foo")
+        self.assertNotEqual(q1.get_key(), q3.get_key())
+        q4 = Query("1,2,3,4").add("foo", "bar")
+        self.assertNotEqual(q1.get_key(), q4.get_key())
+        q5 = Query("1, 2, 3, 4").add("foo", "bar")
+        self.assertEqual(q4.get_key(), q5.get_key())
+
+    def test_get_tiles(self):
+        self.assertEqual(overpass.get_tiles("1,2,1.1,2.1", 0.1), ["1,2,1.1,2.1"])
+        tiles = overpass.get_tiles("1,2,1.2,2.15", 0.1)
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual(tiles[0], "1.00000000,2.00000000,1.10000000,2.07500000")
+        self.assertEqual(tiles[-1], "1.10000000,2.07500000,1.20000000,2.15000000")
+        q = Query("1234").add("foo")
+        q.set_search_area("1,2,1.2,2.15")
+        qt = q.get_tiles(0.1)
+        self.assertEqual([t.bbox for t in qt], tiles)
+        self.assertEqual(qt[0].area_id, "1234")
+        self.assertEqual(qt[0].statements, q.statements)
+        self.assertEqual(q.bbox, "1,2,1.2,2.15")
+        self.assertIn(tiles[0], qt[0].get_url())
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = Cache(os.path.join(self.path, "cache"), 60)
+        self.server = HTTPServer(("127.0.0.1", 0), StandInHandler)
+        StandInHandler.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        url = "http://127.0.0.1:%d/api/interpreter?" % self.server.server_port
+        self.servers = mock.patch.object(overpass, "api_servers", [url])
+        self.servers.start()
+
+    def tearDown(self):
+        self.servers.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get("foo"), None)
+        self.cache.put("foo", content=b"bar")
+        fn = self.cache.get("foo")
+        with open(fn, "rb") as fo:
+            self.assertEqual(fo.read(), b"bar")
+        old = time.time() - 120
+        os.utime(fn, (old, old))
+        self.assertEqual(self.cache.get("foo"), None)
+        cache = Cache(self.cache.path, 0)
+        cache.put("taz", content=b"bar")
+        self.assertEqual(cache.get("foo"), None)
+        self.assertFalse(os.path.exists(cache.get_filename("taz")))
+
+    def test_read(self):
+        q = Query("1234", cache=self.cache).add("foo")
+        self.assertEqual(q.read(), response)
+        self.assertEqual(len(StandInHandler.requests), 1)
+        q = Query("1234", cache=self.cache).add("foo;")
+        self.assertEqual(q.read(), response)
+        self.assertEqual(len(StandInHandler.requests), 1)
+        q = Query("1234", cache=self.cache).add("bar")
+        q.read()
+        self.assertEqual(len(StandInHandler.requests), 2)
+        q = Query("1234").add("foo")
+        q.read()
+        self.assertEqual(len(StandInHandler.requests), 3)
+
+    def test_download(self):
+        fn = os.path.join(self.path, "foo.osm")
+        q = Query("1234", cache=self.cache).add("foo")
+        q.download(fn)
+        os.remove(fn)
+        q.download(fn)
+        self.assertEqual(len(StandInHandler.requests), 1)
+        with open(fn, "rb") as fo:
+            self.assertEqual(fo.read(), response)
+        self.assertEqual(q.read(), response)
+        self.assertEqual(len(StandInHandler.requests), 1)
+
+    def test_read_tiles(self):
+        q = Query("1234").add("foo")
+        data = q.read_tiles(0.1, "1,2,1.2,2.15", workers=2)
+        self.assertEqual(len(StandInHandler.requests), 4)
+        self.assertEqual(len(data.nodes), 1)
+        self.assertEqual(data.nodes[0].id, 1)
+
+
+class TestPartition(unittest.TestCase):
+    def setUp(self):
+        self.data = osm.Osm()
+        self.d = self.data
+        self.n1 = self.d.Node(0, 0, {"addr:street": "s", "addr:housenumber": "1"})
+        self.n2 = self.d.Node(0, 1, {"entrance": "yes"})
+        self.n2.tags.update({"addr:street": "s", "addr:housenumber": "2"})
+        self.w1 = self.d.Way([(0, 0), (1, 1)], {"highway": "primary", "name": "s"})
+        self.w2 = self.d.Way([(2, 2), (3, 3), (2, 3), (2, 2)], {"building": "yes"})
+        self.w2.tags.update({"addr:street": "s", "addr:housenumber": "3"})
+        self.w3 = self.d.Way([(4, 4), (5, 5)], {"highway": "primary"})
+        self.r1 = self.d.Relation([self.w3], {"highway": "pedestrian", "name": "p"})
+
+    def test_match(self):
+        self.assertTrue(overpass.match('way["highway"]["name"]', self.w1))
+        self.assertFalse(overpass.match('way["highway"]["name"]', self.w3))
+        self.assertFalse(overpass.match('relation["highway"]', self.w1))
+        self.assertTrue(overpass.match('wr["highway"]["name"]', self.r1))
+        self.assertTrue(overpass.match('nwr["addr:housenumber"]', self.n1))
+        self.assertFalse(overpass.match('node["entrance"]', self.n1))
+        self.assertTrue(overpass.match('node[!"entrance"]', self.n1))
+        self.assertTrue(overpass.match('node["entrance"="yes"]', self.n2))
+        self.assertFalse(overpass.match('node["entrance"!="yes"]', self.n2))
+        self.assertTrue(overpass.match('node["entrance"!="no"]', self.n1))
+        self.assertTrue(overpass.match('way["highway"~"^pri"]', self.w1))
+        self.assertFalse(overpass.match('way["highway"!~"^pri"]', self.w1))
+        self.assertTrue(overpass.match('wr[~"building"~".*"]', self.w2))
+        self.assertFalse(overpass.match('wr[~"building"~".*"]', self.w1))
+        with self.assertRaises(TypeError):
+            overpass.match("area[name]", self.w1)
+
+    def test_partition(self):
+        queries = {
+            "highway": ['way["highway"]["name"]', 'relation["highway"]["name"]'],
+            "address": (
+                'node["addr:street"]["addr:housenumber"]["entrance"];'
+                'wr["addr:street"]["addr:housenumber"][~"building"~".*"];'
+            ),
+            "building": ['wr["building"]'],
+        }
+        result = overpass.partition(self.data, queries)
+        highway = result["highway"]
+        self.assertEqual(
+            {e.fid for e in highway.elements if e.type != "node"},
+            {self.w1.fid, self.w3.fid, self.r1.fid},
+        )
+        self.assertEqual(len(highway.nodes), 4)
+        address = result["address"]
+        self.assertEqual(
+            {e.fid for e in address.elements if e.tags},
+            {self.n2.fid, self.w2.fid},
+        )
+        self.assertEqual(len(address.nodes), 5)
+        building = result["building"]
+        self.assertEqual(len(building.ways), 1)
+        self.assertEqual(building.ways[0].tags, self.w2.tags)
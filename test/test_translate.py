@@ -1,11 +1,61 @@
+import itertools
+import json
 import random
 import unittest
 
 import mock
 
+from catatom2osm import translate
 from catatom2osm.translate import address_tags, all_tags, building_tags
 
 
+def legacy_building_tags(feature):
+    """Previous implementation of building_tags."""
+    building_key = {
+        "functional": "building",
+        "declined": "disused:building",
+        "ruin": "abandoned:building",
+    }
+    key = building_key.get(feature["condition"], "building")
+    translations = {
+        "condition": {
+            "declined": '{"building": "yes"}',
+            "ruin": '{"building": "ruins"}',
+        },
+        "currentUse": {
+            "1_residential": '{"%s": "residential"}' % key,
+            "2_agriculture": '{"%s": "barn"}' % key,
+            "3_industrial": '{"%s": "industrial"}' % key,
+            "4_1_office": '{"%s": "office"}' % key,
+            "4_2_retail": '{"%s": "retail"}' % key,
+            "4_3_publicServices": '{"%s": "public"}' % key,
+        },
+        "nature": {"openAirPool": '{"leisure": "swimming_pool"}'},
+    }
+    tags = {}
+    if "_" not in feature["localId"]:
+        tags["building"] = "yes"
+        tags["ref"] = feature["localId"]
+    for field, action in list(translations.items()):
+        for value, new_tags in list(action.items()):
+            if feature[field] == value:
+                tags.update(json.loads(new_tags))
+    if feature["condition"] == "ruin" and feature["currentUse"] == None:  # NOQA
+        tags["abandoned:building"] = "yes"
+    if "_part" in feature["localId"]:
+        tags["building:part"] = "roof" if feature["lev_above"] == 0 else "yes"
+    if feature["lev_above"]:
+        tags["building:levels"] = str(feature["lev_above"])
+    if feature["lev_below"]:
+        tags["building:levels:underground"] = str(feature["lev_below"])
+    if feature["layer"] == 1:
+        tags["layer"] = "1"
+        tags["location"] = "roof"
+    if feature["fixme"]:
+        tags["fixme"] = feature["fixme"]
+    return tags
+
+
 class TestTranslate(unittest.TestCase):
     def test_all_tags(self):
         tags = {"a": 1, "b": 2, "c": 3}
@@ -121,6 +171,35 @@ class TestTranslate(unittest.TestCase):
         self.assertNotIn("building:levels", tags)
         self.assertNotIn("building:levels:underground", tags)
 
+    def test_building_tags_parity(self):
+        values = {
+            "localId": ["foo", "foo_part1", "foo_PI.1"],
+            "condition": ["functional", "declined", "ruin", None, "bar"],
+            "currentUse": [None, "bar"] + list(translate.current_use_values),
+            "nature": [None, "openAirPool"],
+            "lev_above": [None, 0, 2],
+            "lev_below": [None, 0, 1],
+            "layer": [None, 1],
+            "fixme": ["", "check"],
+        }
+        rows = list(itertools.product(*values.values()))
+        for row in rows:
+            feat = dict(zip(translate.BUILDING_FIELDS, row))
+            self.assertEqual(building_tags(feat), legacy_building_tags(feat))
+        expected = [legacy_building_tags(dict(zip(values, row))) for row in rows]
+        self.assertEqual(translate.building_tags_batch(rows), expected)
+
+    def test_get_building_translator(self):
+        names = list(reversed(translate.BUILDING_FIELDS)) + ["foo"]
+        fields = mock.MagicMock()
+        fields.indexFromName = names.index
+        feat = {"localId": "foo_part1", "condition": "ruin", "lev_above": 2}
+        feat = {k: feat.get(k) for k in translate.BUILDING_FIELDS}
+        feature = mock.MagicMock()
+        feature.attributes.return_value = [feat.get(k) for k in names]
+        translation = translate.get_building_translator(fields)
+        self.assertEqual(translation(feature), legacy_building_tags(feat))
+
     def test_places(self):
         f1 = {
             "localId": "000",